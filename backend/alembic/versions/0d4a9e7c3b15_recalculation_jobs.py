@@ -0,0 +1,46 @@
+"""Recalculation jobs
+
+Revision ID: 0d4a9e7c3b15
+Revises: 8b3d6f1e2c47
+Create Date: 2026-10-18 21:37:09.284516
+
+Also indexes estimate_items.parent_id: without it every deleted item makes
+the database scan the whole table for children to check the FK, which is
+most of the cost of re-saving an estimate.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d4a9e7c3b15'
+down_revision: Union[str, Sequence[str], None] = '8b3d6f1e2c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('recalculation_jobs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('options', sa.JSON(), nullable=False),
+    sa.Column('dry_run', sa.Boolean(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('estimates_total', sa.Integer(), nullable=False),
+    sa.Column('estimates_done', sa.Integer(), nullable=False),
+    sa.Column('items_changed', sa.Integer(), nullable=False),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_estimate_items_parent_id', 'estimate_items', ['parent_id'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_estimate_items_parent_id', table_name='estimate_items')
+    op.drop_table('recalculation_jobs')
@@ -0,0 +1,40 @@
+"""Composite indexes for keyset-paginated listings
+
+Revision ID: 3f8a1b6c0d52
+Revises: 9c2d7e1f4a3b
+Create Date: 2026-10-18 10:41:07.118530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8a1b6c0d52'
+down_revision: Union[str, Sequence[str], None] = '9c2d7e1f4a3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_estimates_updated_at_id', 'estimates', ['updated_at', 'id'])
+    op.create_index('ix_estimates_status_updated_at_id', 'estimates', ['status', 'updated_at', 'id'])
+    op.create_index('ix_estimates_client_name_updated_at_id', 'estimates', ['client_name', 'updated_at', 'id'])
+    op.create_index('ix_estimates_template_id_updated_at_id', 'estimates', ['template_id', 'updated_at', 'id'])
+    op.create_index('ix_estimates_estimate_date', 'estimates', ['estimate_date'])
+    op.create_index('ix_estimate_templates_updated_at_id', 'estimate_templates', ['updated_at', 'id'])
+    op.create_index('ix_estimate_data_created_at_id', 'estimate_data', ['created_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_estimate_data_created_at_id', table_name='estimate_data')
+    op.drop_index('ix_estimate_templates_updated_at_id', table_name='estimate_templates')
+    op.drop_index('ix_estimates_estimate_date', table_name='estimates')
+    op.drop_index('ix_estimates_template_id_updated_at_id', table_name='estimates')
+    op.drop_index('ix_estimates_client_name_updated_at_id', table_name='estimates')
+    op.drop_index('ix_estimates_status_updated_at_id', table_name='estimates')
+    op.drop_index('ix_estimates_updated_at_id', table_name='estimates')
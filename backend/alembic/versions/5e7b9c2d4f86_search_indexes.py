@@ -0,0 +1,50 @@
+"""Search indexes
+
+Revision ID: 5e7b9c2d4f86
+Revises: c93e5f0a7d14
+Create Date: 2026-10-18 18:48:03.114592
+
+Postgres only: tsvector and pg_trgm GIN indexes behind /api/v1/search. The
+expressions must match the ones search.py queries with. SQLite databases
+get FTS5 tables from search.install() when the app starts.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e7b9c2d4f86'
+down_revision: Union[str, Sequence[str], None] = 'c93e5f0a7d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ITEM_TEXT = "coalesce(description, '') || ' ' || coalesce(section_code, '')"
+ESTIMATE_TEXT = "coalesce(project_name, '') || ' ' || coalesce(client_name, '')"
+TEMPLATE_TEXT = "coalesce(name, '') || ' ' || coalesce(description, '')"
+
+INDEXES = {
+    'ix_estimate_items_search': f"estimate_items USING gin (to_tsvector('english', {ITEM_TEXT})) WHERE estimate_id IS NOT NULL",
+    'ix_estimate_items_description_trgm': "estimate_items USING gin (description gin_trgm_ops) WHERE estimate_id IS NOT NULL",
+    'ix_estimates_search': f"estimates USING gin (to_tsvector('simple', {ESTIMATE_TEXT}))",
+    'ix_estimates_search_trgm': f"estimates USING gin (({ESTIMATE_TEXT}) gin_trgm_ops)",
+    'ix_estimate_templates_search': f"estimate_templates USING gin (to_tsvector('english', {TEMPLATE_TEXT}))",
+    'ix_estimate_templates_name_trgm': "estimate_templates USING gin (name gin_trgm_ops)",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, definition in INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
@@ -0,0 +1,32 @@
+"""Template copy sources
+
+Revision ID: 6d1f9a3c7e20
+Revises: b5e0c2d94a17
+Create Date: 2026-10-18 14:21:07.318442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d1f9a3c7e20'
+down_revision: Union[str, Sequence[str], None] = 'b5e0c2d94a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('estimate_sections', sa.Column('source_id', sa.UUID(), nullable=True))
+    op.add_column('estimate_items', sa.Column('source_id', sa.UUID(), nullable=True))
+    op.create_index('ix_estimate_items_estimate_id_source_id', 'estimate_items', ['estimate_id', 'source_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_estimate_items_estimate_id_source_id', table_name='estimate_items')
+    op.drop_column('estimate_items', 'source_id')
+    op.drop_column('estimate_sections', 'source_id')
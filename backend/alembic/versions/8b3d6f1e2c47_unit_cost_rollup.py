@@ -0,0 +1,39 @@
+"""Unit cost rollup
+
+Revision ID: 8b3d6f1e2c47
+Revises: 5e7b9c2d4f86
+Create Date: 2026-10-18 20:12:41.530218
+
+Histogram table behind /api/v1/analytics/unit-costs. Saves keep it current
+from here on; existing estimates are counted by calling
+POST /api/v1/analytics/unit-costs/rebuild once after upgrading.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b3d6f1e2c47'
+down_revision: Union[str, Sequence[str], None] = '5e7b9c2d4f86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('unit_cost_rollup',
+    sa.Column('section_code', sa.String(length=50), nullable=False),
+    sa.Column('unit', sa.String(length=10), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('metric', sa.String(length=20), nullable=False),
+    sa.Column('bin', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('section_code', 'unit', 'month', 'metric', 'bin')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('unit_cost_rollup')
@@ -0,0 +1,53 @@
+"""Persist estimate trees and imported data
+
+Revision ID: 9c2d7e1f4a3b
+Revises: 4471f38d6845
+Create Date: 2026-10-18 09:12:44.301822
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2d7e1f4a3b'
+down_revision: Union[str, Sequence[str], None] = '4471f38d6845'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('estimate_data',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('project_info', sa.JSON(), nullable=False),
+    sa.Column('metadata', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.add_column('estimate_sections', sa.Column('position', sa.Integer(), nullable=True))
+    op.add_column('estimate_items', sa.Column('position', sa.Integer(), nullable=True))
+    op.add_column('estimate_items', sa.Column('data_id', sa.UUID(), nullable=True))
+    op.create_foreign_key('fk_estimate_items_data_id', 'estimate_items', 'estimate_data', ['data_id'], ['id'])
+    # Tree loads select children by owner; without these every selectinload is a scan.
+    op.create_index('ix_estimate_sections_estimate_id', 'estimate_sections', ['estimate_id'])
+    op.create_index('ix_estimate_sections_template_id', 'estimate_sections', ['template_id'])
+    op.create_index('ix_estimate_items_section_id', 'estimate_items', ['section_id'])
+    op.create_index('ix_estimate_items_estimate_id', 'estimate_items', ['estimate_id'])
+    op.create_index('ix_estimate_items_data_id', 'estimate_items', ['data_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_estimate_items_data_id', table_name='estimate_items')
+    op.drop_index('ix_estimate_items_estimate_id', table_name='estimate_items')
+    op.drop_index('ix_estimate_items_section_id', table_name='estimate_items')
+    op.drop_index('ix_estimate_sections_template_id', table_name='estimate_sections')
+    op.drop_index('ix_estimate_sections_estimate_id', table_name='estimate_sections')
+    op.drop_constraint('fk_estimate_items_data_id', 'estimate_items', type_='foreignkey')
+    op.drop_column('estimate_items', 'data_id')
+    op.drop_column('estimate_items', 'position')
+    op.drop_column('estimate_sections', 'position')
+    op.drop_table('estimate_data')
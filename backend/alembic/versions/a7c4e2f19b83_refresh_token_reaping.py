@@ -0,0 +1,68 @@
+"""Refresh token reaping indexes
+
+Revision ID: a7c4e2f19b83
+Revises: 6d1f9a3c7e20
+Create Date: 2026-10-18 16:02:44.905117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e2f19b83'
+down_revision: Union[str, Sequence[str], None] = '6d1f9a3c7e20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # users and refresh_tokens were only ever made by create_all at startup;
+    # create them here too so a migrated database has something to index.
+    # IF NOT EXISTS rather than inspecting the database, so that
+    # `alembic upgrade --sql` can render this offline.
+    metadata = sa.MetaData()
+    users = sa.Table('users', metadata,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=255), nullable=False),
+        sa.Column('full_name', sa.String(length=255), nullable=True),
+        sa.Column('ms_oid', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    refresh_tokens = sa.Table('refresh_tokens', metadata,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('jti', sa.String(length=50), nullable=False),
+        sa.Column('token_hash', sa.String(length=128), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('parent_jti', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('revoked_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(sa.schema.CreateTable(users, if_not_exists=True))
+    op.create_index('ix_users_email', 'users', ['email'], unique=True, if_not_exists=True)
+    op.create_index('ix_users_ms_oid', 'users', ['ms_oid'], if_not_exists=True)
+    op.execute(sa.schema.CreateTable(refresh_tokens, if_not_exists=True))
+    op.create_index('ix_refresh_tokens_jti', 'refresh_tokens', ['jti'], unique=True, if_not_exists=True)
+    op.create_index('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id'], if_not_exists=True)
+    # The app's create_all may already have added these on startup.
+    live = sa.text('revoked_at IS NULL')
+    revoked = sa.text('revoked_at IS NOT NULL')
+    op.create_index('ix_refresh_tokens_live_user_id', 'refresh_tokens', ['user_id', 'expires_at'],
+                    postgresql_where=live, sqlite_where=live, if_not_exists=True)
+    op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'], if_not_exists=True)
+    op.create_index('ix_refresh_tokens_revoked_at', 'refresh_tokens', ['revoked_at'],
+                    postgresql_where=revoked, sqlite_where=revoked, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_refresh_tokens_revoked_at', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_expires_at', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_live_user_id', table_name='refresh_tokens')
@@ -0,0 +1,41 @@
+"""Background export jobs
+
+Revision ID: b5e0c2d94a17
+Revises: 3f8a1b6c0d52
+Create Date: 2026-10-18 12:03:26.550913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e0c2d94a17'
+down_revision: Union[str, Sequence[str], None] = '3f8a1b6c0d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('export_jobs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('estimate_id', sa.UUID(), nullable=False),
+    sa.Column('options', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['estimate_id'], ['estimates.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_export_jobs_estimate_id', 'export_jobs', ['estimate_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_export_jobs_estimate_id', table_name='export_jobs')
+    op.drop_table('export_jobs')
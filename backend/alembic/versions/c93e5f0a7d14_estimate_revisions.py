@@ -0,0 +1,41 @@
+"""Estimate revisions
+
+Revision ID: c93e5f0a7d14
+Revises: e2b8d4a6f051
+Create Date: 2026-10-18 17:35:50.207118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c93e5f0a7d14'
+down_revision: Union[str, Sequence[str], None] = 'e2b8d4a6f051'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('estimates', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('estimate_revisions',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('estimate_id', sa.UUID(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['estimate_id'], ['estimates.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ux_estimate_revisions_estimate_id_version', 'estimate_revisions', ['estimate_id', 'version'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_estimate_revisions_estimate_id_version', table_name='estimate_revisions')
+    op.drop_table('estimate_revisions')
+    op.drop_column('estimates', 'version')
@@ -0,0 +1,130 @@
+"""Refresh token partitioning (opt-in, Postgres)
+
+Revision ID: e2b8d4a6f051
+Revises: a7c4e2f19b83
+Create Date: 2026-10-18 16:40:12.551873
+
+Rebuilds refresh_tokens as a table range-partitioned by month of
+expires_at, so the reaper can drop whole months instead of deleting rows.
+Only runs on Postgres with REFRESH_TOKEN_PARTITIONED=1 set for the
+migration; otherwise it is a no-op. The rebuild copies the table under an
+exclusive lock, so run it in a maintenance window.
+
+A partitioned table cannot have a unique index that leaves out the
+partition key: the primary key becomes (id, expires_at) and jti is unique
+together with expires_at, with a plain index on jti for lookups. jti values
+are 128-bit random, so this loses nothing in practice.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8d4a6f051'
+down_revision: Union[str, Sequence[str], None] = 'a7c4e2f19b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created past the current month; the app's reaper keeps
+# this many ready from then on (REFRESH_TOKEN_PARTITIONS_AHEAD).
+MONTHS_AHEAD = 2
+
+COLUMNS = """
+    id integer NOT NULL DEFAULT nextval('{sequence}'),
+    jti varchar(50) NOT NULL,
+    token_hash varchar(128) NOT NULL,
+    user_id integer NOT NULL,
+    parent_jti varchar(50),
+    created_at timestamp with time zone DEFAULT now(),
+    expires_at timestamp with time zone NOT NULL,
+    revoked_at timestamp with time zone
+"""
+COPY = (
+    "INSERT INTO {target} (id, jti, token_hash, user_id, parent_jti, created_at, expires_at, revoked_at) "
+    "SELECT id, jti, token_hash, user_id, parent_jti, created_at, expires_at, revoked_at FROM refresh_tokens"
+)
+
+
+def _enabled() -> bool:
+    return (op.get_bind().dialect.name == 'postgresql'
+            and os.getenv('REFRESH_TOKEN_PARTITIONED', '').lower() in ('1', 'true', 'yes'))
+
+
+def _partitioned() -> bool:
+    return bool(op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('refresh_tokens'))"
+    )).scalar())
+
+
+def _sequence() -> str:
+    return op.get_bind().execute(sa.text("SELECT pg_get_serial_sequence('refresh_tokens', 'id')")).scalar()
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _create_indexes(jti_unique: bool) -> None:
+    live = sa.text('revoked_at IS NULL')
+    revoked = sa.text('revoked_at IS NOT NULL')
+    op.create_index('ix_refresh_tokens_jti', 'refresh_tokens', ['jti'], unique=jti_unique)
+    if not jti_unique:
+        op.create_index('ux_refresh_tokens_jti_expires_at', 'refresh_tokens', ['jti', 'expires_at'], unique=True)
+    op.create_index('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id'])
+    op.create_index('ix_refresh_tokens_live_user_id', 'refresh_tokens', ['user_id', 'expires_at'], postgresql_where=live)
+    op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'])
+    op.create_index('ix_refresh_tokens_revoked_at', 'refresh_tokens', ['revoked_at'], postgresql_where=revoked)
+
+
+def _swap(sequence: str) -> None:
+    """Replace refresh_tokens with refresh_tokens_new, keeping the id sequence"""
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute(COPY.format(target='refresh_tokens_new'))
+    op.execute("DROP TABLE refresh_tokens")
+    op.execute("ALTER TABLE refresh_tokens_new RENAME TO refresh_tokens")
+    op.execute("ALTER TABLE refresh_tokens RENAME CONSTRAINT refresh_tokens_new_pkey TO refresh_tokens_pkey")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY refresh_tokens.id")
+    op.create_foreign_key('refresh_tokens_user_id_fkey', 'refresh_tokens', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _enabled() or _partitioned():
+        return
+    sequence = _sequence()
+    op.execute("LOCK TABLE refresh_tokens IN ACCESS EXCLUSIVE MODE")
+    op.execute(
+        f"CREATE TABLE refresh_tokens_new ({COLUMNS.format(sequence=sequence)}, PRIMARY KEY (id, expires_at)) "
+        "PARTITION BY RANGE (expires_at)"
+    )
+    oldest = op.get_bind().execute(sa.text("SELECT min(expires_at) FROM refresh_tokens")).scalar()
+    now = datetime.now(timezone.utc)
+    month = datetime((oldest or now).year, (oldest or now).month, 1, tzinfo=timezone.utc)
+    last = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE refresh_tokens_p{month:%Y%m} PARTITION OF refresh_tokens_new "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        )
+        month = _next_month(month)
+    # Catches inserts if the reaper ever falls behind creating months.
+    op.execute("CREATE TABLE refresh_tokens_pdefault PARTITION OF refresh_tokens_new DEFAULT")
+    _swap(sequence)
+    _create_indexes(jti_unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql' or not _partitioned():
+        return
+    sequence = _sequence()
+    op.execute("LOCK TABLE refresh_tokens IN ACCESS EXCLUSIVE MODE")
+    op.execute(f"CREATE TABLE refresh_tokens_new ({COLUMNS.format(sequence=sequence)}, PRIMARY KEY (id))")
+    _swap(sequence)  # dropping the partitioned parent drops its partitions too
+    _create_indexes(jti_unique=True)
@@ -0,0 +1,55 @@
+"""Timezone-aware timestamp columns
+
+Revision ID: f4c8a2e6d913
+Revises: 0d4a9e7c3b15
+Create Date: 2026-10-18 16:05:42.310274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4c8a2e6d913'
+down_revision: Union[str, Sequence[str], None] = '0d4a9e7c3b15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Written by database.utcnow from now on. Existing values were a mix of
+# local time and UTC and are taken as UTC. SQLite stores both types alike.
+COLUMNS = {
+    'estimate_templates': ('created_at', 'updated_at'),
+    'estimates': ('created_at', 'updated_at'),
+    'estimate_data': ('created_at',),
+    'estimate_revisions': ('created_at',),
+    'export_jobs': ('created_at', 'finished_at'),
+    'recalculation_jobs': ('created_at', 'finished_at'),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.alter_column(
+                table, column,
+                type_=sa.DateTime(timezone=True), existing_type=sa.DateTime(),
+                postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.alter_column(
+                table, column,
+                type_=sa.DateTime(), existing_type=sa.DateTime(timezone=True),
+                postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            )
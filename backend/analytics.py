@@ -0,0 +1,216 @@
+import math
+from collections import Counter
+from datetime import datetime
+from operator import attrgetter, itemgetter
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, String, case, cast, delete, func, literal, select, true, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import EstimateDB, EstimateItemDB, ItemType, UnitCostRollupDB, UnitType
+
+# Historical unit-cost analytics.
+#
+# unit_cost_rollup keeps, per (section_code, unit, month of estimate_date,
+# metric), a histogram of unit costs in log-spaced bins: bin b holds values
+# in (GAMMA**(b-1), GAMMA**b]. Counts add and subtract, so every save just
+# moves the counts of the line items it changed (old values out, new values
+# in) inside its own transaction, and the endpoint only reads the rollup.
+# min, median and p90 come back as the bin's midpoint, within
+# (GAMMA - 1) / (GAMMA + 1) ~ 1% of the true value; count is exact.
+#
+# Only LINE_ITEM rows with a positive unit cost count. Rows are upserted in
+# key order so concurrent saves lock shared rows in the same order.
+
+METRICS = ("material_unit_cost", "labor_unit_cost", "total_unit_cost")
+GAMMA = 1.02
+_LOG_GAMMA = math.log(GAMMA)
+_LINE = "line_item"
+_KEY = ("section_code", "unit", "month", "metric", "bin")
+_FIELDS = ("item_type", "section_code", "unit", *METRICS)
+_get_key = itemgetter(*_FIELDS)
+_get_attr = attrgetter(*_FIELDS)
+
+
+def _bin(value: float) -> int:
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+def _value(bin: int) -> float:
+    return 2 * GAMMA ** bin / (GAMMA + 1)
+
+
+def _month(estimate_date) -> str:
+    # Accepts a datetime or the ISO string revision states carry.
+    return (estimate_date.isoformat() if isinstance(estimate_date, datetime) else str(estimate_date))[:7]
+
+
+def _plain(value) -> Optional[str]:
+    return getattr(value, "value", value)
+
+
+def counts(items: Iterable, month: str) -> Counter:
+    """Histogram contributions of `items` (dicts or rows with item columns)"""
+    contributions: Counter = Counter()
+    for item in items:
+        item_type, code, unit, *values = (_get_key if isinstance(item, dict) else _get_attr)(item)
+        if _plain(item_type) not in (None, _LINE):
+            continue
+        code, unit = code or "", _plain(unit) or ""
+        for metric, value in zip(METRICS, values):
+            if value is not None and value > 0:
+                contributions[(code, unit, month, metric, _bin(value))] += 1
+    return contributions
+
+
+def _upsert(db: Session):
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(db.bind.dialect.name)
+    if dialect is None:
+        raise HTTPException(status_code=501, detail=f"Analytics is not available on {db.bind.dialect.name}")
+    return dialect.insert(UnitCostRollupDB)
+
+
+def _on_conflict_add(stmt):
+    return stmt.on_conflict_do_update(index_elements=list(_KEY), set_={"count": UnitCostRollupDB.count + stmt.excluded.count})
+
+
+def _adjust(db: Session, delta: Counter) -> None:
+    rows = [dict(zip(_KEY, key), count=count) for key, count in sorted(delta.items()) if count]
+    if not rows:
+        return
+    db.execute(_on_conflict_add(_upsert(db)), rows)
+
+
+#Maintenance
+
+def track_states(db: Session, before: Optional[dict], after: Optional[dict]) -> None:
+    """Move counts from one revision state of an estimate to another"""
+    delta: Counter = Counter()
+    if after is not None:
+        delta.update(counts(after["items"].values(), _month(after["estimate"]["estimate_date"])))
+    if before is not None:
+        delta.subtract(counts(before["items"].values(), _month(before["estimate"]["estimate_date"])))
+    _adjust(db, delta)
+
+
+def track_items(db: Session, estimate_id, before: Iterable = (), after: Iterable = ()) -> None:
+    """Move counts for items of one estimate replaced by `after` (either side may be empty)"""
+    delta = counts(after, "")
+    delta.subtract(counts(before, ""))
+    # Most edits (descriptions, quantities, order) leave unit costs alone.
+    if not any(delta.values()):
+        return
+    estimate_date = db.execute(select(EstimateDB.estimate_date).where(EstimateDB.id == estimate_id)).scalar_one()
+    month = _month(estimate_date)
+    _adjust(db, Counter({(code, unit, month, metric, bin): count for (code, unit, _, metric, bin), count in delta.items()}))
+
+
+def track_estimate(db: Session, estimate_id) -> None:
+    """Count every line item of a newly written estimate, grouped by bin inside the database"""
+    stmt = _upsert(db)
+    month = _month(db.execute(select(EstimateDB.estimate_date).where(EstimateDB.id == estimate_id)).scalar_one())
+    # Enum columns hold member names; the rollup keys on unit values.
+    unit = func.coalesce(case({member.name: member.value for member in UnitType}, value=cast(EstimateItemDB.unit, String)), "")
+    code = func.coalesce(EstimateItemDB.section_code, "")
+    parts = []
+    for metric in METRICS:
+        value = getattr(EstimateItemDB, metric)
+        bin = cast(func.ceil(func.ln(value) / _LOG_GAMMA), Integer)
+        parts.append(
+            select(
+                code.label("section_code"), unit.label("unit"), literal(month, String).label("month"),
+                literal(metric, String).label("metric"), bin.label("bin"), func.count().label("count"),
+            )
+            .where(
+                EstimateItemDB.estimate_id == estimate_id,
+                EstimateItemDB.item_type.is_(None) | (EstimateItemDB.item_type == ItemType.LINE_ITEM),
+                value > 0,
+            )
+            .group_by(code, unit, bin)
+        )
+    rows = union_all(*parts).subquery()
+    # WHERE keeps SQLite from reading ON CONFLICT as a join constraint.
+    stmt = stmt.from_select([*_KEY, "count"], select(rows).where(true()).order_by(*(rows.c[key] for key in _KEY)))
+    db.execute(_on_conflict_add(stmt))
+
+
+def rebuild(db: Session) -> int:
+    """Recount every estimate line item from scratch; returns rollup rows written"""
+    db.execute(delete(UnitCostRollupDB), execution_options={"synchronize_session": False})
+    total: Counter = Counter()
+    rows = db.execute(
+        select(
+            EstimateDB.estimate_date, EstimateItemDB.section_code, EstimateItemDB.unit, EstimateItemDB.item_type,
+            *(getattr(EstimateItemDB, metric) for metric in METRICS),
+        )
+        .join(EstimateDB, EstimateDB.id == EstimateItemDB.estimate_id)
+        .execution_options(yield_per=10_000)
+    )
+    for row in rows:
+        total.update(counts([row], _month(row.estimate_date)))
+    _adjust(db, total)
+    db.commit()
+    return sum(1 for count in total.values() if count)
+
+
+#Reading
+
+def _period(month: str, bucket: str) -> str:
+    if bucket == "year":
+        return month[:4]
+    if bucket == "quarter":
+        return f"{month[:4]}-Q{(int(month[5:7]) - 1) // 3 + 1}"
+    return month
+
+
+def _summary(histogram: dict) -> dict:
+    bins = sorted(histogram.items())
+    count = sum(n for _, n in bins)
+
+    def quantile(q: float) -> float:
+        rank = max(1, math.ceil(q * count))
+        seen = 0
+        for bin, n in bins:
+            seen += n
+            if seen >= rank:
+                return round(_value(bin), 4)
+
+    return {"min": round(_value(bins[0][0]), 4), "median": quantile(0.5), "p90": quantile(0.9), "count": count}
+
+
+def unit_costs(
+    db: Session,
+    *,
+    section_code: Optional[str] = None,
+    unit: Optional[str] = None,
+    bucket: str = "month",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> list[dict]:
+    """Unit-cost statistics per section code, unit and period, read from the rollup only"""
+    stmt = select(UnitCostRollupDB).where(UnitCostRollupDB.count > 0)
+    if section_code is not None:
+        stmt = stmt.where(UnitCostRollupDB.section_code == section_code)
+    if unit is not None:
+        stmt = stmt.where(UnitCostRollupDB.unit == unit)
+    if date_from:
+        stmt = stmt.where(UnitCostRollupDB.month >= _month(date_from))
+    if date_to:
+        stmt = stmt.where(UnitCostRollupDB.month <= _month(date_to))
+
+    groups: dict = {}
+    for row in db.execute(stmt).scalars():
+        group = groups.setdefault((row.section_code, row.unit, _period(row.month, bucket)), {})
+        histogram = group.setdefault(row.metric, {})
+        histogram[row.bin] = histogram.get(row.bin, 0) + row.count
+    return [
+        {
+            "section_code": code or None,
+            "unit": unit_value or None,
+            "period": period,
+            **{metric: _summary(group[metric]) if metric in group else None for metric in METRICS},
+        }
+        for (code, unit_value, period), group in sorted(groups.items())
+    ]
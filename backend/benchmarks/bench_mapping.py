@@ -0,0 +1,88 @@
+"""Data-to-estimate mapping benchmark.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_mapping
+
+Times mapping.build_sections on a flat imported item list (as it comes back
+from the database) and the rollup of the mapped estimate. Mapping should
+stay linear and well under a second at 100k items.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from ..models import Estimate, EstimateItem, ItemType, UnitType
+from .. import mapping, rollup
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def synthetic_items(items: int, divisions: int = 30, seed: int = 7) -> list[EstimateItem]:
+    """Flat import: a header per division, groups with parent links and level-only rows"""
+    rng = random.Random(seed)
+    built = []
+    header = None
+    for i in range(items):
+        code = f"{(i * divisions // items) + 1:02d}-{rng.randrange(10, 90):02d}-00"
+        if i % 200 == 0:
+            built.append(EstimateItem(
+                id=str(i), description="Division", item_type=ItemType.SECTION_HEADER, section_code=code, sort_order=i
+            ))
+            continue
+        if i % 20 == 1:
+            header = EstimateItem(
+                id=str(i), description="Group", item_type=ItemType.SUB_HEADER, section_code=code, sort_order=i
+            )
+            built.append(header)
+            continue
+        built.append(EstimateItem(
+            id=str(i),
+            description="Line",
+            quantity=rng.uniform(1, 500),
+            unit=UnitType.SF,
+            material_unit_cost=rng.uniform(0.5, 40),
+            labor_unit_cost=rng.uniform(0.5, 40),
+            # Every third line relies on level nesting instead of a parent link.
+            parent_id=None if i % 3 == 0 else header.id,
+            level=1,
+            sort_order=i,
+        ))
+    return built
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'sections':>8} {'map ms':>8} {'ns/item':>8} {'rollup ms':>10}")
+    for size in args.sizes:
+        items = synthetic_items(size)
+        sections = mapping.build_sections(items)
+        estimate = Estimate(
+            project_name="Benchmark",
+            project_location="Bench",
+            client_name="Bench",
+            estimate_date=datetime(2025, 1, 1),
+            prepared_by="bench",
+            sections=sections,
+        )
+        build = _best(lambda: mapping.build_sections(items), args.repeat)
+        apply = _best(lambda: rollup.apply(estimate), args.repeat)
+        print(f"{size:>8} {len(sections):>8} {build * 1e3:>8.1f} {build / size * 1e9:>8.0f} {apply * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Cost of the request and query instrumentation on the hot path.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_metrics --requests 20000 --queries 20000
+
+Measures, in microseconds of CPU per call:
+
+  request   one request through a bare ASGI app, then through the same app
+            wrapped in MetricsMiddleware (no server or client in between,
+            so the difference is the middleware alone)
+  query     a trivial SELECT on a SQLite engine without and with the cursor
+            events that count queries per request
+
+and renders /metrics once with every route of the app populated.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "metrics.db"))
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+from .. import metrics
+from ..main import app
+
+
+async def _bare_app(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b'{"ok":true}'})
+
+
+async def _requests(asgi, count: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    began = time.process_time()
+    for _ in range(count):
+        await asgi(dict(scope), receive, send)
+    return (time.process_time() - began) / count * 1e6
+
+
+def _queries(count: int) -> float:
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        statement = text("SELECT 1")
+        began = time.process_time()
+        for _ in range(count):
+            conn.execute(statement).scalar()
+        return (time.process_time() - began) / count * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=20_000)
+    args = parser.parse_args()
+
+    bare = asyncio.run(_requests(_bare_app, args.requests))
+    wrapped = asyncio.run(_requests(metrics.MetricsMiddleware(_bare_app), args.requests))
+    print(f"{'request':>8} {bare:>8.2f} us bare {wrapped:>8.2f} us with middleware (+{wrapped - bare:.2f})")
+
+    event.remove(Engine, "before_cursor_execute", metrics._query_started)
+    event.remove(Engine, "after_cursor_execute", metrics._query_finished)
+    plain = _queries(args.queries)
+    event.listen(Engine, "before_cursor_execute", metrics._query_started)
+    event.listen(Engine, "after_cursor_execute", metrics._query_finished)
+    counted = _queries(args.queries)
+    print(f"{'query':>8} {plain:>8.2f} us bare {counted:>8.2f} us with events (+{counted - plain:.2f})")
+
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            for status in (200, 404):
+                metrics.http.observe(method, route.path, status, 0.02, 2048, metrics._QueryStats())
+    began = time.perf_counter()
+    body = metrics.render({})
+    print(f"{'render':>8} {(time.perf_counter() - began) * 1e3:>8.2f} ms for {len(metrics.http.routes)} routes, {len(body):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
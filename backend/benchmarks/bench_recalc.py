@@ -0,0 +1,97 @@
+"""Bulk re-pricing against re-saving estimates one by one.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_recalc --estimates 300 --items 1000
+
+Stores synthetic estimates in a scratch SQLite database (or DATABASE_URL),
+then changes the labor unit cost of every SF line item:
+
+  per-estimate  load each estimate, edit it and save it with
+                repository.update_estimate (what a client PUT loop does)
+  bulk          recalc.reprice over chunks of RECALC_CHUNK_SIZE estimates on
+                the worker pool, as a recalculation job runs them
+
+and prints the wall time of each, plus a dry run of the bulk path.
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "recalc.db"))
+
+from .. import recalc, repository, rollup, search
+from ..database import Base, SessionLocal, engine
+from ..models import UnitCostOverride, UnitType
+from ..settings import settings
+from .bench_rollup import synthetic_estimate
+
+
+def fill(estimates: int, items: int) -> list[str]:
+    ids = []
+    db = SessionLocal()
+    try:
+        for seed in range(estimates):
+            estimate = rollup.apply(synthetic_estimate(items, sections=10, seed=seed))
+            ids.append(repository.create_estimate(db, estimate))
+    finally:
+        db.close()
+    return ids
+
+
+def per_estimate(ids: list[str], labor_unit_cost: float) -> None:
+    db = SessionLocal()
+    try:
+        for estimate_id in ids:
+            estimate = repository.get_estimate(db, estimate_id)
+            for section in estimate.sections:
+                for item in section.items:
+                    if item.unit == UnitType.SF:
+                        item.labor_unit_cost = labor_unit_cost
+                        item.total_unit_cost = None
+            rollup.apply(estimate)
+            repository.update_estimate(db, estimate_id, estimate)
+    finally:
+        db.close()
+
+
+def bulk(ids: list[str], labor_unit_cost: float, dry_run: bool) -> int:
+    overrides = [UnitCostOverride(unit=UnitType.SF, labor_unit_cost=labor_unit_cost)]
+    keys = [uuid.UUID(value) for value in ids]
+    size = max(settings.RECALC_CHUNK_SIZE, 1)
+    futures = [
+        recalc._pool.submit(recalc._run_chunk, overrides, keys[start:start + size], dry_run)
+        for start in range(0, len(keys), size)
+    ]
+    return sum(entry["items_changed"] for future in futures for entry in future.result())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--estimates", type=int, default=300)
+    parser.add_argument("--items", type=int, default=1000)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    search.install(engine)
+    start = time.perf_counter()
+    ids = fill(args.estimates, args.items)
+    print(f"filled {args.estimates} estimates x {args.items} items in {time.perf_counter() - start:.1f}s "
+          f"({engine.dialect.name}, chunks of {settings.RECALC_CHUNK_SIZE}, {settings.RECALC_WORKERS} workers)")
+
+    print(f"{'path':>14} {'seconds':>8} {'items changed':>14}")
+    start = time.perf_counter()
+    changed = bulk(ids, 55.0, dry_run=True)
+    print(f"{'bulk dry run':>14} {time.perf_counter() - start:>8.2f} {changed:>14,}")
+    start = time.perf_counter()
+    changed = bulk(ids, 55.0, dry_run=False)
+    print(f"{'bulk':>14} {time.perf_counter() - start:>8.2f} {changed:>14,}")
+    start = time.perf_counter()
+    per_estimate(ids, 60.0)
+    print(f"{'per-estimate':>14} {time.perf_counter() - start:>8.2f} {'':>14}")
+
+
+if __name__ == "__main__":
+    main()
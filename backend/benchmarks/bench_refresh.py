@@ -0,0 +1,90 @@
+"""Refresh token hashing and rotation benchmark.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_refresh
+
+Compares the HMAC-SHA256 token hash with the legacy sha256_crypt one, first
+as bare verify calls and then as full /auth/refresh rotations against a
+scratch SQLite database. Everything runs on one thread, so the rates are
+per core.
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import tempfile
+import time
+from datetime import timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "refresh.db"))
+
+from ..database import AsyncSessionLocal, Base, engine
+from ..models import RefreshToken
+from .. import session
+
+
+def _rate(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+
+async def _legacy_tokens(db, user_id: int, count: int) -> list[str]:
+    # Rows as the old code wrote them: a sha256_crypt hash of the secret.
+    raws = []
+    for _ in range(count):
+        jti, secret = secrets.token_hex(16), secrets.token_urlsafe(48)
+        db.add(RefreshToken(
+            jti=jti,
+            token_hash=session._legacy_pwd.hash(secret),
+            user_id=user_id,
+            expires_at=session._now() + timedelta(days=1),
+        ))
+        raws.append(f"{jti}.{secret}")
+    await db.commit()
+    return raws
+
+
+async def _rotations(rotations: int, legacy_rotations: int) -> tuple[float, float]:
+    async with AsyncSessionLocal() as db:
+        pair = await session.issue_session(db, "bench@example.com")
+        raw = pair.refresh_token
+        start = time.perf_counter()
+        for _ in range(rotations):
+            raw = (await session.rotate_refresh(db, raw)).refresh_token
+        hmac_rate = rotations / (time.perf_counter() - start)
+
+        token = await session._find_refresh_token(db, raw.split(".")[0])
+        legacy = await _legacy_tokens(db, token.user_id, legacy_rotations)
+        start = time.perf_counter()
+        for raw in legacy:
+            await session.rotate_refresh(db, raw)
+        legacy_rate = legacy_rotations / (time.perf_counter() - start)
+    return hmac_rate, legacy_rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verifies", type=int, default=20_000)
+    parser.add_argument("--rotations", type=int, default=500)
+    parser.add_argument("--legacy", type=int, default=50, help="legacy sha256_crypt verifies and rotations")
+    args = parser.parse_args()
+
+    secret = secrets.token_urlsafe(48)
+    stored = session._hash_secret(secret)
+    legacy_stored = session._legacy_pwd.hash(secret)
+    hmac_verify = _rate(lambda: session.hmac.compare_digest(stored, session._hash_secret(secret)), args.verifies)
+    legacy_verify = _rate(lambda: session._legacy_pwd.verify(secret, legacy_stored), args.legacy)
+
+    Base.metadata.create_all(bind=engine)
+    hmac_rotate, legacy_rotate = asyncio.run(_rotations(args.rotations, args.legacy))
+
+    print(f"{'scheme':>12} {'verify/s':>12} {'refresh/s':>10}")
+    print(f"{'hmac-sha256':>12} {hmac_verify:>12,.1f} {hmac_rotate:>10,.1f}")
+    print(f"{'sha256_crypt':>12} {legacy_verify:>12,.1f} {legacy_rotate:>10,.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Rollup engine benchmark.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_rollup
+
+Times rollup.compute on prebuilt columns and rollup.apply on a full
+Estimate document at growing sizes. Cost per item should stay flat as the
+estimate grows past 50k line items.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from ..models import Estimate, EstimateItem, EstimateSection, ItemType, UnitType
+from .. import rollup
+
+SIZES = (1_000, 10_000, 50_000, 100_000)
+
+
+def synthetic_estimate(items: int, sections: int = 20, seed: int = 7) -> Estimate:
+    """Estimate with headers, two-level line items and a SUBTOTAL per group"""
+    rng = random.Random(seed)
+    per_section = max(items // sections, 1)
+    built = []
+    for s in range(sections):
+        rows = []
+        header = None
+        for i in range(per_section):
+            if i % 25 == 0:
+                header = EstimateItem(
+                    id=f"{s}-{i}", description="Group", item_type=ItemType.SUB_HEADER, level=0, sort_order=i
+                )
+                rows.append(header)
+                continue
+            if i % 25 == 24:
+                rows.append(EstimateItem(
+                    id=f"{s}-{i}", description="Subtotal", item_type=ItemType.SUBTOTAL,
+                    parent_id=header.id, level=1, sort_order=i,
+                ))
+                continue
+            rows.append(EstimateItem(
+                id=f"{s}-{i}",
+                description="Line",
+                quantity=rng.uniform(1, 500),
+                unit=UnitType.SF,
+                material_unit_cost=rng.uniform(0.5, 40),
+                labor_unit_cost=rng.uniform(0.5, 40),
+                parent_id=header.id,
+                level=1,
+                sort_order=i,
+            ))
+        built.append(EstimateSection(section_code=f"{s:02d}-00-00", title=f"Division {s}", items=rows))
+    return Estimate(
+        project_name="Benchmark",
+        project_location="Bench",
+        client_name="Bench",
+        estimate_date=datetime(2025, 1, 1),
+        prepared_by="bench",
+        sections=built,
+    )
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'compute ms':>11} {'ns/item':>8} {'apply ms':>9} {'ns/item':>8}")
+    for size in args.sizes:
+        estimate = synthetic_estimate(size)
+        arrays = rollup.ItemArrays.from_sections(estimate.sections)
+        compute = _best(lambda: rollup.compute(arrays), args.repeat)
+        apply = _best(lambda: rollup.apply(estimate), args.repeat)
+        n = len(arrays)
+        print(f"{n:>8} {compute * 1e3:>11.2f} {compute / n * 1e9:>8.0f} {apply * 1e3:>9.2f} {apply / n * 1e9:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
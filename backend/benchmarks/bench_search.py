@@ -0,0 +1,125 @@
+"""Search latency over a large item table.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_search --items 1000000
+
+Fills a scratch SQLite database (or DATABASE_URL, migrated to head) with
+estimates whose line items draw descriptions from a construction vocabulary,
+through the normal insert path so the search index triggers fire. Then it
+times search.search for common, rare, multi-word and prefix queries, first
+page and a deep page. Target: p95 under 50 ms.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "search.db"))
+
+from sqlalchemy import insert
+
+from .. import search
+from ..database import Base, EstimateDB, EstimateItemDB, EstimateSectionDB, SessionLocal, engine
+from .load_async_db import _percentile
+
+MATERIALS = (
+    "concrete", "rebar", "formwork", "drywall", "gypsum", "plywood", "steel", "aluminum", "copper", "insulation",
+    "roofing", "membrane", "asphalt", "masonry", "brick", "mortar", "grout", "tile", "carpet", "paint",
+    "primer", "sealant", "glazing", "timber", "lumber", "anchor", "conduit", "ductwork", "piping", "valve",
+)
+WORK = (
+    "install", "supply", "demolish", "remove", "repair", "patch", "pour", "finish", "frame", "hang",
+    "tape", "seal", "excavate", "backfill", "compact", "grade", "erect", "weld", "bolt", "coat",
+)
+PLACES = ("footing", "slab", "wall", "column", "beam", "roof", "stair", "corridor", "lobby", "parking", "garage", "podium")
+
+QUERIES = {
+    "common": "concrete",
+    "two words": "pour slab",
+    "prefix": "insul",
+    "rare": "zinc",
+    "code": "03-30",
+}
+
+
+def fill(items: int, per_estimate: int, seed: int = 11) -> None:
+    rng = random.Random(seed)
+    db = SessionLocal()
+    try:
+        made = 0
+        number = 0
+        while made < items:
+            number += 1
+            estimate_id = uuid.uuid4()
+            db.execute(insert(EstimateDB), [{
+                "id": estimate_id, "project_name": f"{rng.choice(PLACES).title()} project {number}",
+                "project_location": "Bench", "client_name": f"Client {number % 97}",
+                "estimate_date": datetime(2025, 1, 1), "prepared_by": "bench",
+            }])
+            sections = []
+            rows = []
+            for division in range(10):
+                section_id = uuid.uuid4()
+                sections.append({
+                    "id": section_id, "estimate_id": estimate_id, "position": division,
+                    "section_code": f"{division + 1:02d}-00-00", "title": f"Division {division + 1}",
+                })
+                for position in range(per_estimate // 10):
+                    rows.append({
+                        "id": uuid.uuid4(), "estimate_id": estimate_id, "section_id": section_id, "position": position,
+                        "description": f"{rng.choice(WORK)} {rng.choice(MATERIALS)} {rng.choice(PLACES)}"
+                                       + (" zinc flashing" if rng.random() < 0.0005 else ""),
+                        "section_code": f"{division + 1:02d}-{rng.randrange(10, 90):02d}-00",
+                    })
+            db.execute(insert(EstimateSectionDB), sections)
+            db.execute(insert(EstimateItemDB), rows)
+            made += len(rows)
+            if number % 20 == 0:
+                db.commit()
+        db.commit()
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--per-estimate", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    search.install(engine)
+    start = time.perf_counter()
+    fill(args.items, args.per_estimate)
+    print(f"filled {args.items:,} items in {time.perf_counter() - start:.1f}s ({engine.dialect.name})")
+
+    print(f"{'query':>10} {'page':>5} {'hits':>5} {'p50 ms':>8} {'p95 ms':>8}")
+    db = SessionLocal()
+    try:
+        for name, query in QUERIES.items():
+            cursor = None
+            for page in (1, 2, 3, 4, 5):
+                samples = []
+                for _ in range(args.repeat):
+                    began = time.perf_counter()
+                    hits, next_cursor = search.search(db, query, cursor=cursor, limit=args.limit)
+                    samples.append(time.perf_counter() - began)
+                if page in (1, 5):
+                    print(f"{name:>10} {page:>5} {len(hits):>5} "
+                          f"{statistics.median(samples) * 1e3:>8.1f} {_percentile(samples, 95) * 1e3:>8.1f}")
+                cursor = next_cursor
+                if not cursor:
+                    break
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Per-request CPU of GET /api/v1/estimates/{id} by estimate size.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_serialization --sizes 1000 10000 100000
+
+Stores one synthetic estimate per size in a scratch SQLite database (or
+DATABASE_URL), then measures process CPU time per request for:
+
+  models    the old route: ORM tree -> Estimate model -> .dict() ->
+            jsonable_encoder -> stdlib json
+  documents repository.estimate_document -> orjson (the route's payload)
+  http      the full route through the app, without and with gzip
+
+and the response size with and without compression.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serialization.db"))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+from .. import repository, rollup
+from ..database import SessionLocal
+from ..main import app
+from .bench_rollup import synthetic_estimate
+
+
+def _cpu(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        began = time.process_time()
+        fn()
+        samples.append(time.process_time() - began)
+    return statistics.median(samples)
+
+
+def _models(estimate_id: str) -> bytes:
+    db = SessionLocal()
+    try:
+        return json.dumps(jsonable_encoder(repository.get_estimate(db, estimate_id).dict())).encode()
+    finally:
+        db.close()
+
+
+def _documents(estimate_id: str) -> bytes:
+    db = SessionLocal()
+    try:
+        return orjson.dumps(repository.estimate_document(db, estimate_id))
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'models ms':>10} {'documents ms':>13} {'http ms':>8} {'http gzip ms':>13} "
+          f"{'bytes':>11} {'gzip bytes':>11}")
+    with TestClient(app) as client:
+        for size in args.sizes:
+            estimate = synthetic_estimate(size)
+            rollup.apply(estimate)
+            db = SessionLocal()
+            try:
+                estimate_id = repository.create_estimate(db, estimate)
+            finally:
+                db.close()
+            url = f"/api/v1/estimates/{estimate_id}"
+            plain = client.get(url, headers={"Accept-Encoding": "identity"})
+            packed = client.get(url, headers={"Accept-Encoding": "gzip"})
+            # TestClient decodes gzip; the wire size is what the middleware set.
+            packed_bytes = int(packed.headers["content-length"])
+            repeat = max(1, args.repeat if size <= 10_000 else args.repeat // 2)
+            models = _cpu(lambda: _models(estimate_id), repeat)
+            documents = _cpu(lambda: _documents(estimate_id), repeat)
+            http = _cpu(lambda: client.get(url, headers={"Accept-Encoding": "identity"}), repeat)
+            http_gzip = _cpu(lambda: client.get(url, headers={"Accept-Encoding": "gzip"}), repeat)
+            print(f"{size:>8,} {models * 1e3:>10.1f} {documents * 1e3:>13.1f} {http * 1e3:>8.1f} "
+                  f"{http_gzip * 1e3:>13.1f} {len(plain.content):>11,} {packed_bytes:>11,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""API load test with a regression check against a stored baseline.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.load_api --repeat 3 --output results.json
+    python -m backend.benchmarks.load_api --repeat 3 --baseline backend/benchmarks/baseline_api.json
+
+Serves the app with uvicorn on a scratch SQLite database, seeds one
+synthetic estimate per --sizes entry (10 to 100k line items) plus a
+template, and drives each scenario below with --concurrency clients:
+
+  auth_issue, auth_refresh, auth_me        sign-in, token rotation, a bearer-token request
+  estimate_create                          POST a 200-item estimate
+  estimate_get[n], estimate_put[n]         read and save the seeded n-item estimate
+  item_patch[n]                            PATCH one line item of it
+  item_delete                              DELETE line items, one per request
+  estimate_list                            GET /api/v1/estimates?limit=50
+  template_instantiate                     new estimate from a 1000-item template
+  export[n]                                Excel export, polled to completion when queued
+
+Every export asks for a different format_options so none is a cache hit.
+Sized scenarios make fewer requests on the big estimates (see _count).
+
+For each scenario it reports throughput, p50/p95/p99/max latency, errors
+and SQL statements per request (from the in-process metrics), as JSON on
+stdout or in --output, with a table on stderr. --write-baseline stores
+the results; --baseline compares against stored results and exits 1 when
+a scenario's p50 or p95 grew, or its throughput fell, by more than
+--tolerance, or it issued more queries or failed more requests than
+before. p99 and max are reported but not checked; with a few requests
+they are too noisy. --repeat runs every scenario several times and keeps
+the median of each figure, which steadies p95 and throughput enough for
+the default tolerance.
+
+Seeds are fixed and each scenario makes a fixed number of requests, so
+runs do the same work and query counts match exactly; latencies still
+depend on the machine, so write the baseline on the machine that checks
+against it (the stored one: default options, --repeat 3). To run against
+Postgres, set DATABASE_URL to a scratch database (tables are created if
+missing). The load client runs in the same process as the server, so
+compare runs with each other rather than with production numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+_scratch = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(_scratch, "load_api.db"))
+os.environ.setdefault("EXPORT_DIR", os.path.join(_scratch, "exports"))
+# Writers queue on SQLite's single write lock; saving a 100k-item estimate
+# holds it for a minute. Wait for it, so queueing shows up as latency rather
+# than as "database is locked" failures.
+os.environ.setdefault("DB_SQLITE_BUSY_TIMEOUT_MS", "600000")
+
+import httpx
+import orjson
+import uvicorn
+
+from .. import metrics, repository, rollup
+from ..database import Base, SessionLocal, engine, utcnow
+from ..main import app
+from ..models import EstimateTemplate, ItemType
+from .bench_rollup import synthetic_estimate
+from .load_async_db import _percentile
+
+SIZES = (10, 1_000, 10_000, 100_000)
+CHECKED = ("p50_ms", "p95_ms")
+
+
+class Request(NamedTuple):
+    method: str
+    url: str
+    body: Optional[bytes] = None
+    headers: Optional[dict] = None
+    # Called with the response; the refresh scenario returns its new token here.
+    after: Optional[Callable[[httpx.Response], None]] = None
+
+
+class Scenario(NamedTuple):
+    name: str
+    # Route template as the metrics middleware labels it, for query counts.
+    method: str
+    route: str
+    requests: int
+    build: Callable[[int], Awaitable[Request]]
+
+
+def _count(base: int, size: int) -> int:
+    # Same total item volume per size, but never fewer than 5 requests.
+    return max(5, base * 1_000 // max(size, 1_000))
+
+
+def _json(value) -> bytes:
+    return orjson.dumps(value)
+
+
+#Seeding
+
+def _seed_estimate(items: int, name: str) -> str:
+    estimate = synthetic_estimate(items, sections=max(1, min(20, items // 100)), seed=items)
+    estimate.project_name = name
+    estimate.created_at = estimate.updated_at = utcnow()
+    rollup.apply(estimate)
+    db = SessionLocal()
+    try:
+        return repository.create_estimate(db, estimate)
+    finally:
+        db.close()
+
+
+def _line_item_ids(estimate_id: str) -> list[str]:
+    db = SessionLocal()
+    try:
+        estimate = repository.get_estimate(db, estimate_id)
+    finally:
+        db.close()
+    return [item.id for section in estimate.sections for item in section.items if item.item_type == ItemType.LINE_ITEM]
+
+
+def _seed_template(items: int) -> str:
+    estimate = synthetic_estimate(items, sections=10, seed=items)
+    rollup.apply(estimate)
+    template = EstimateTemplate(
+        name="Benchmark template", description="load_api", project_type="Construction", sections=estimate.sections
+    )
+    db = SessionLocal()
+    try:
+        return repository.create_template(db, template)
+    finally:
+        db.close()
+
+
+async def _scenarios(client: httpx.AsyncClient, args) -> list[Scenario]:
+    """Seed the database and build the scenarios that run against it"""
+    sizes = args.sizes
+    began = time.perf_counter()
+    estimates = {size: await asyncio.to_thread(_seed_estimate, size, f"Bench {size}") for size in sizes}
+    items = {size: await asyncio.to_thread(_line_item_ids, estimates[size]) for size in sizes}
+    template_id = await asyncio.to_thread(_seed_template, 1_000)
+    deletes = 200
+    delete_estimate = await asyncio.to_thread(_seed_estimate, (deletes + args.warmup) * args.repeat * 2, "Bench deletes")
+    delete_ids = await asyncio.to_thread(_line_item_ids, delete_estimate)
+    documents = {}
+    for size in sizes:
+        response = await client.get(f"/api/v1/estimates/{estimates[size]}")
+        response.raise_for_status()
+        documents[size] = response.content
+    print(f"seeded {', '.join(map(str, sizes))} item estimates in {time.perf_counter() - began:.1f}s", file=sys.stderr)
+
+    # One refresh token per client; each request rotates one and returns the new one.
+    refresh_tokens: asyncio.Queue = asyncio.Queue()
+    for n in range(args.concurrency):
+        response = await client.post("/auth/issue", json={"email": f"refresh{n}@bench.example"})
+        refresh_tokens.put_nowait(response.json()["refresh_token"])
+    access = (await client.post("/auth/issue", json={"email": "me@bench.example"})).json()["access_token"]
+    created = _json(orjson.loads(synthetic_estimate(200, sections=4).json()))
+
+    async def auth_issue(i):
+        return Request("POST", "/auth/issue", _json({"email": f"user{i}@bench.example", "full_name": "Bench"}))
+
+    async def auth_refresh(i):
+        token = await refresh_tokens.get()
+
+        def after(response):
+            refresh_tokens.put_nowait(response.json()["refresh_token"] if response.status_code == 200 else token)
+
+        return Request("POST", "/auth/refresh", _json({"refresh_token": token}), after=after)
+
+    async def auth_me(i):
+        return Request("GET", "/me", headers={"Authorization": f"Bearer {access}"})
+
+    async def estimate_create(i):
+        return Request("POST", "/api/v1/estimates", created)
+
+    async def estimate_list(i):
+        return Request("GET", "/api/v1/estimates?limit=50")
+
+    async def template_instantiate(i):
+        return Request("POST", f"/api/v1/estimates/from-template/{template_id}", _json({"project_name": f"From template {i}"}))
+
+    async def item_delete(i):
+        return Request("DELETE", f"/api/v1/estimates/{delete_estimate}/items/{delete_ids[i]}")
+
+    def sized(size):
+        estimate_id = estimates[size]
+        line_items = items[size]
+        original = f'"project_name":"Bench {size}"'.encode()
+
+        async def get(i):
+            return Request("GET", f"/api/v1/estimates/{estimate_id}")
+
+        async def put(i):
+            return Request(
+                "PUT", f"/api/v1/estimates/{estimate_id}",
+                documents[size].replace(original, f'"project_name":"Bench {size} #{i}"'.encode(), 1),
+            )
+
+        async def patch(i):
+            return Request(
+                "PATCH", f"/api/v1/estimates/{estimate_id}/items/{line_items[i % len(line_items)]}",
+                _json({"quantity": i + 1}),
+            )
+
+        async def export(i):
+            return Request(
+                "POST", f"/api/v1/estimates/{estimate_id}/export/excel",
+                _json({"estimate_id": estimate_id, "format_options": {"run": i}}),
+            )
+
+        return get, put, patch, export
+
+    scenarios = [
+        Scenario("auth_issue", "POST", "/auth/issue", 300, auth_issue),
+        Scenario("auth_refresh", "POST", "/auth/refresh", 300, auth_refresh),
+        Scenario("auth_me", "GET", "/me", 1000, auth_me),
+        Scenario("estimate_create", "POST", "/api/v1/estimates", 100, estimate_create),
+        Scenario("estimate_list", "GET", "/api/v1/estimates", 300, estimate_list),
+        Scenario("template_instantiate", "POST", "/api/v1/estimates/from-template/{template_id}", 100, template_instantiate),
+        Scenario("item_delete", "DELETE", "/api/v1/estimates/{estimate_id}/items/{item_id}", deletes, item_delete),
+    ]
+    for size in sizes:
+        get, put, patch, export = sized(size)
+        scenarios += [
+            Scenario(f"estimate_get[{size}]", "GET", "/api/v1/estimates/{estimate_id}", _count(300, size), get),
+            Scenario(f"estimate_put[{size}]", "PUT", "/api/v1/estimates/{estimate_id}", _count(50, size), put),
+            Scenario(f"item_patch[{size}]", "PATCH", "/api/v1/estimates/{estimate_id}/items/{item_id}", _count(200, size), patch),
+            Scenario(f"export[{size}]", "POST", "/api/v1/estimates/{estimate_id}/export/excel", _count(20, size), export),
+        ]
+    return scenarios
+
+
+#Load
+
+def _serve() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def _send(client: httpx.AsyncClient, request: Request) -> bool:
+    """Send one request and report whether it succeeded; a dropped connection is a failure"""
+    headers = {"Content-Type": "application/json", **(request.headers or {})}
+    try:
+        response = await client.request(request.method, request.url, content=request.body, headers=headers)
+    except httpx.TransportError:
+        response = httpx.Response(599)
+    if request.after:
+        request.after(response)
+    if response.status_code >= 400:
+        return False
+    # Queued work (large exports) counts as done when its job is.
+    if response.status_code == 202 and "status_url" in response.json():
+        status_url = response.json()["status_url"]
+        while True:
+            await asyncio.sleep(0.02)
+            try:
+                job = await client.get(status_url)
+            except httpx.TransportError:
+                return False
+            if job.status_code != 200 or job.json()["status"] == "failed":
+                return False
+            if job.json()["status"] == "done":
+                return True
+    return True
+
+
+def _db_queries(scenario: Scenario) -> tuple[int, float]:
+    entry = metrics.http.routes.get((scenario.method, scenario.route))
+    return (0, 0.0) if entry is None else (sum(entry.queries.counts), entry.queries.sum)
+
+
+async def _drive(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, warmup: int, first: int) -> dict:
+    # Request indexes start at `first`; warm-up requests take the ones after the measured ones.
+    end = first + scenario.requests
+    for i in range(end, end + warmup):
+        await _send(client, await scenario.build(i))
+
+    latencies: list[float] = []
+    errors = 0
+    indexes = iter(range(first, end))
+
+    async def worker():
+        nonlocal errors
+        for i in indexes:
+            request = await scenario.build(i)
+            start = time.perf_counter()
+            ok = await _send(client, request)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    requests_before, queries_before = _db_queries(scenario)
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - began
+    requests_after, queries_after = _db_queries(scenario)
+    served = requests_after - requests_before
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1e3, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1e3, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1e3, 3),
+        "max_ms": round(max(latencies) * 1e3, 3),
+        "queries_per_request": round((queries_after - queries_before) / served, 2) if served else None,
+    }
+
+
+def _combine(runs: list[dict]) -> dict:
+    """Median of each figure over repeated runs; requests and errors are totals"""
+    combined = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run[key] is not None]
+        if key in ("requests", "errors"):
+            combined[key] = sum(values)
+        else:
+            combined[key] = statistics.median(values) if values else None
+    return combined
+
+
+async def _run(base: str, args) -> dict:
+    async with httpx.AsyncClient(base_url=base, timeout=600) as client:
+        scenarios = await _scenarios(client, args)
+        selected = [s for s in scenarios if not args.only or any(s.name.startswith(prefix) for prefix in args.only)]
+        results = {}
+        print(f"{'scenario':<24} {'req':>5} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}",
+              file=sys.stderr)
+        for scenario in selected:
+            runs = []
+            for n in range(args.repeat):
+                first = n * (scenario.requests + args.warmup)
+                runs.append(await _drive(client, scenario, args.concurrency, args.warmup, first))
+            result = results[scenario.name] = _combine(runs)
+            queries = "-" if result["queries_per_request"] is None else f"{result['queries_per_request']:.1f}"
+            print(f"{scenario.name:<24} {result['requests']:>5} {result['errors']:>4} {result['throughput_rps']:>8.1f} "
+                  f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {queries:>8}", file=sys.stderr)
+    return results
+
+
+#Baseline
+
+def compare(results: dict, baseline: dict, tolerance: float, slack_ms: float) -> list[str]:
+    """Regressions of `results` against `baseline`, one line each"""
+    regressions = []
+    for name, before in baseline["scenarios"].items():
+        now = results["scenarios"].get(name)
+        if now is None:
+            continue
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{name}: {now['errors']} failed requests (baseline {before['errors']})")
+        for key in CHECKED:
+            limit = before[key] * (1 + tolerance) + slack_ms
+            if now[key] > limit:
+                regressions.append(f"{name}: {key} {now[key]:.1f} > {limit:.1f} (baseline {before[key]:.1f})")
+        floor = before["throughput_rps"] * (1 - tolerance)
+        if now["throughput_rps"] < floor:
+            regressions.append(
+                f"{name}: throughput {now['throughput_rps']:.1f} req/s < {floor:.1f} (baseline {before['throughput_rps']:.1f})"
+            )
+        # Statement counts do not depend on the machine; only rounding is tolerated.
+        if before.get("queries_per_request") is not None and now["queries_per_request"] is not None:
+            if now["queries_per_request"] > before["queries_per_request"] + 0.5:
+                regressions.append(
+                    f"{name}: {now['queries_per_request']:.1f} queries per request (baseline {before['queries_per_request']:.1f})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES), help="line items per seeded estimate")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests before each scenario")
+    parser.add_argument("--repeat", type=int, default=1, help="run each scenario this often and report the medians")
+    parser.add_argument("--only", nargs="*", help="run only scenarios whose name starts with one of these")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    parser.add_argument("--write-baseline", help="also store the results as a baseline here")
+    parser.add_argument("--baseline", help="compare against this baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative change in latency and throughput")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="latency change always allowed, for sub-ms scenarios")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    base = _serve()
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "database": engine.dialect.name,
+            "sizes": args.sizes,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": asyncio.run(_run(base, args)),
+    }
+    body = json.dumps(results, indent=2) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body)
+    else:
+        sys.stdout.write(body)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            f.write(body)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("database", "concurrency"):
+            if baseline["meta"].get(key) != results["meta"][key]:
+                print(f"warning: baseline {key} is {baseline['meta'].get(key)!r}, this run {results['meta'][key]!r}",
+                      file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance, args.slack_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}", file=sys.stderr)
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Sync vs async request path under load.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.load_async_db
+
+Serves the app with uvicorn on a scratch SQLite database, next to a copy of
+the old synchronous path: an `async def` dependency that runs a blocking
+query on the event loop, as get_current_user used to. Each path gets the
+same load on GET /me and GET /api/v1/estimates/{id} while a side client
+keeps one slow query (a recursive CTE) running against that path. Blocking
+on the loop shows up as a p99 close to the slow query's duration; the async
+path should stay near its p50.
+
+The load client runs in the same process as the server, so absolute numbers
+are inflated; compare the two rows with each other.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load.db"))
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import repository
+from ..database import SessionLocal, get_async_db
+from ..main import app
+from ..models import User
+from ..session import _decode_access_token, get_current_user, oauth2_scheme
+from .bench_rollup import synthetic_estimate
+
+SLOW_QUERY = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) SELECT count(*) FROM c"
+)
+
+bench = FastAPI()
+
+
+async def _sync_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    # The old get_current_user: async, but the query blocks the event loop.
+    data = _decode_access_token(token)
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == data.sub).first()
+    finally:
+        db.close()
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
+
+@bench.get("/sync/me")
+async def sync_me(current_user: User = Depends(_sync_current_user)):
+    return {"id": current_user.id, "email": current_user.email}
+
+
+@bench.get("/async/me")
+async def async_me(current_user: User = Depends(get_current_user)):
+    return {"id": current_user.id, "email": current_user.email}
+
+
+@bench.get("/sync/slow")
+async def sync_slow(n: int):
+    db = SessionLocal()
+    try:
+        return {"count": db.execute(SLOW_QUERY, {"n": n}).scalar()}
+    finally:
+        db.close()
+
+
+@bench.get("/async/slow")
+async def async_slow(n: int, db: AsyncSession = Depends(get_async_db)):
+    return {"count": (await db.execute(SLOW_QUERY, {"n": n})).scalar()}
+
+
+@bench.get("/sync/estimates/{estimate_id}")
+def sync_estimate(estimate_id: str):
+    # Old estimate route: sync handler in the threadpool.
+    db = SessionLocal()
+    try:
+        return repository.get_estimate(db, estimate_id).dict()
+    finally:
+        db.close()
+
+
+bench.mount("/", app)
+
+
+def _serve() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(bench, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def _run(base: str, path: str, requests: int, concurrency: int, slow_n: int) -> dict:
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        tokens = (await client.post("/auth/issue", json={"email": "load@example.com"})).json()
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        estimate = synthetic_estimate(20, sections=2)
+        estimate_id = (await client.post("/api/v1/estimates", content=estimate.json())).json()["id"]
+        urls = [f"/{path}/me", f"/{path}/estimates/{estimate_id}" if path == "sync" else f"/api/v1/estimates/{estimate_id}"]
+
+        done = asyncio.Event()
+
+        async def slow_traffic():
+            while not done.is_set():
+                await client.get(f"/{path}/slow", params={"n": slow_n})
+
+        latencies: list[float] = []
+        queue = asyncio.Queue()
+        for i in range(requests):
+            queue.put_nowait(urls[i % len(urls)])
+
+        async def worker():
+            while not queue.empty():
+                url = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        slow = asyncio.create_task(slow_traffic())
+        await asyncio.sleep(0.05)
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        done.set()
+        await slow
+    return {
+        "p50": statistics.median(latencies),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "max": max(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--slow-n", type=int, default=1_000_000, help="rows the slow recursive query counts")
+    args = parser.parse_args()
+
+    from ..database import Base, engine
+    Base.metadata.create_all(bind=engine)
+    base = _serve()
+    print(f"{'path':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for path in ("sync", "async"):
+        result = asyncio.run(_run(base, path, args.requests, args.concurrency, args.slow_n))
+        print(f"{path:>6} " + " ".join(f"{result[key] * 1e3:>8.1f}" for key in ("p50", "p95", "p99", "max")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Concurrent refresh of one token.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.stress_refresh_race
+
+Serves the app with uvicorn on a scratch SQLite database (or DATABASE_URL),
+then has many threads POST the same refresh token to /auth/refresh at once,
+for several rounds. Rotation is single-use, so every round must produce
+exactly one 200 and 401s for everyone else; the script exits non-zero if a
+round lets two callers through or lets none through.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "race.db"))
+
+import httpx
+
+from .load_async_db import _serve
+
+
+def _round(base: str, token: str, threads: int) -> tuple[Counter, list[str]]:
+    barrier = threading.Barrier(threads)
+
+    def refresh(_):
+        with httpx.Client(base_url=base, timeout=30) as client:
+            barrier.wait()
+            response = client.post("/auth/refresh", json={"refresh_token": token})
+            return response.status_code, response.json().get("refresh_token") if response.status_code == 200 else None
+
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(refresh, range(threads)))
+    return Counter(code for code, _ in results), [new for _, new in results if new]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    from ..database import Base, engine
+    Base.metadata.create_all(bind=engine)
+    base = _serve()
+    token = httpx.post(f"{base}/auth/issue", json={"email": "race@example.com"}).json()["refresh_token"]
+
+    failures = 0
+    start = time.perf_counter()
+    for number in range(1, args.rounds + 1):
+        codes, issued = _round(base, token, args.threads)
+        ok = codes.get(200, 0) == 1 and sum(codes.values()) == args.threads
+        failures += not ok
+        print(f"round {number:>3}: {dict(sorted(codes.items()))}{'' if ok else '  <-- FAIL'}")
+        if not issued:
+            break
+        token = issued[0]
+    print(f"{args.rounds} rounds x {args.threads} threads in {time.perf_counter() - start:.1f}s, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from email.utils import formatdate
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Union
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .database import EstimateDB, EstimateItemDB, EstimateSectionDB, ExportJobDB, SessionLocal, utcnow
+from .models import ExcelExportRequest, ItemType
+from .settings import settings
+
+# Excel export.
+#
+# The workbook is produced with openpyxl's write-only mode, which streams
+# each row straight to disk, and items are read with yield_per so only one
+# batch of rows is ever in memory. Memory therefore stays flat whatever the
+# size of the estimate. Large estimates are exported on a small thread pool
+# and tracked in export_jobs, so any worker can answer a status poll. A job
+# lives only in the pool of the process that queued it, so one still open
+# after EXPORT_JOB_TIMEOUT_SECONDS is marked failed, at startup and when polled.
+
+_pool = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS, thread_name_prefix="export")
+
+_BATCH = 2000
+
+# format_options keys understood by the writer, with their defaults.
+_FORMAT_DEFAULTS = {
+    "sheet_name": "Estimate",
+    "number_format": "#,##0.00",
+    "quantity_format": "#,##0.##",
+    "freeze_header": True,
+    "indent_levels": True,
+}
+
+_ITEM_FIELDS = (
+    EstimateItemDB.section_id,
+    EstimateItemDB.description,
+    EstimateItemDB.quantity,
+    EstimateItemDB.unit,
+    EstimateItemDB.material_unit_cost,
+    EstimateItemDB.material_amount,
+    EstimateItemDB.labor_unit_cost,
+    EstimateItemDB.labor_amount,
+    EstimateItemDB.total_unit_cost,
+    EstimateItemDB.total_amount,
+    EstimateItemDB.item_type,
+    EstimateItemDB.level,
+)
+
+#Reading
+
+def _estimate_key(estimate_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(str(estimate_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+
+def count_items(db: Session, estimate_id: str) -> int:
+    key = _estimate_key(estimate_id)
+    if db.get(EstimateDB, key) is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    return db.execute(select(func.count()).where(EstimateItemDB.estimate_id == key)).scalar_one()
+
+def _stream_items(db: Session, estimate_id: uuid.UUID) -> Iterator:
+    stmt = (
+        select(*_ITEM_FIELDS)
+        .join(EstimateSectionDB, EstimateSectionDB.id == EstimateItemDB.section_id)
+        .where(EstimateItemDB.estimate_id == estimate_id)
+        .order_by(EstimateSectionDB.position, EstimateSectionDB.id, EstimateItemDB.sort_order, EstimateItemDB.position)
+        .execution_options(yield_per=_BATCH)
+    )
+    yield from db.execute(stmt)
+
+#Writing
+
+def _columns(breakdown: bool) -> list[tuple[str, str, int]]:
+    # (header, field, width)
+    if breakdown:
+        return [
+            ("Description", "description", 48),
+            ("Qty", "quantity", 10),
+            ("Unit", "unit", 7),
+            ("Material Unit", "material_unit_cost", 13),
+            ("Material", "material_amount", 14),
+            ("Labor Unit", "labor_unit_cost", 13),
+            ("Labor", "labor_amount", 14),
+            ("Total Unit", "total_unit_cost", 13),
+            ("Total", "total_amount", 15),
+        ]
+    return [
+        ("Description", "description", 48),
+        ("Qty", "quantity", 10),
+        ("Unit", "unit", 7),
+        ("Unit Cost", "total_unit_cost", 13),
+        ("Total", "total_amount", 15),
+    ]
+
+def write_estimate_xlsx(db: Session, estimate_id: str, request: ExcelExportRequest, path: str) -> None:
+    """Stream one estimate to an .xlsx file at path"""
+    key = _estimate_key(estimate_id)
+    estimate = db.get(EstimateDB, key)
+    if estimate is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    sections = db.execute(
+        select(EstimateSectionDB.id, EstimateSectionDB.section_code, EstimateSectionDB.title,
+               EstimateSectionDB.subtotal_material, EstimateSectionDB.subtotal_labor, EstimateSectionDB.subtotal_total)
+        .where(EstimateSectionDB.estimate_id == key)
+        .order_by(EstimateSectionDB.position, EstimateSectionDB.id)
+    ).all()
+
+    options = {**_FORMAT_DEFAULTS, **request.format_options}
+    columns = _columns(request.include_breakdown)
+    money = {"material_unit_cost", "material_amount", "labor_unit_cost", "labor_amount", "total_unit_cost", "total_amount"}
+    bold = Font(bold=True)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(str(options["sheet_name"])[:31])
+    for index, (_, _, width) in enumerate(columns):
+        ws.column_dimensions[get_column_letter(index + 1)].width = width
+
+    def styled(value, *, font=None, number_format=None, indent=0):
+        cell = WriteOnlyCell(ws, value=value)
+        if font:
+            cell.font = font
+        if number_format:
+            cell.number_format = number_format
+        if indent:
+            cell.alignment = Alignment(indent=indent)
+        return cell
+
+    def figures_row(label: str, figures: dict, font=None) -> list:
+        row = [styled(label, font=font)]
+        for _, field, _ in columns[1:]:
+            value = figures.get(field)
+            row.append(styled(value, font=font, number_format=options["number_format"]) if value is not None else None)
+        return row
+
+    # Project block
+    for label, value in (
+        ("Project", estimate.project_name),
+        ("Location", estimate.project_location),
+        ("Client", estimate.client_name),
+        ("Date", estimate.estimate_date.strftime("%Y-%m-%d") if estimate.estimate_date else None),
+        ("Prepared by", estimate.prepared_by),
+    ):
+        ws.append([styled(label, font=bold), value])
+    ws.append([])
+    header_row = 7
+    ws.append([styled(header, font=bold) for header, _, _ in columns])
+    if options["freeze_header"]:
+        ws.freeze_panes = f"A{header_row + 1}"
+
+    items = _stream_items(db, key)
+    pending = next(items, None)
+    for section in sections:
+        ws.append([styled(f"{section.section_code}  {section.title}", font=bold)])
+        while pending is not None and pending.section_id == section.id:
+            item = pending._mapping
+            is_label = item["item_type"] in (ItemType.SECTION_HEADER, ItemType.SUB_HEADER)
+            is_subtotal = item["item_type"] == ItemType.SUBTOTAL
+            font = bold if is_label or is_subtotal else None
+            row = []
+            for _, field, _ in columns:
+                value = item[field]
+                if field == "description":
+                    indent = (item["level"] or 0) if options["indent_levels"] else 0
+                    row.append(styled(value, font=font, indent=indent))
+                elif field == "unit":
+                    row.append(value.value if value is not None else None)
+                elif value is None:
+                    row.append(None)
+                elif field == "quantity":
+                    row.append(styled(value, number_format=options["quantity_format"]))
+                else:
+                    row.append(styled(value, font=font, number_format=options["number_format"] if field in money else None))
+            ws.append(row)
+            pending = next(items, None)
+        if request.include_totals:
+            ws.append(figures_row(f"Subtotal {section.section_code}", {
+                "material_amount": section.subtotal_material,
+                "labor_amount": section.subtotal_labor,
+                "total_amount": section.subtotal_total,
+            }, font=bold))
+    if request.include_totals:
+        ws.append([])
+        ws.append(figures_row("TOTAL", {
+            "material_amount": estimate.total_material,
+            "labor_amount": estimate.total_labor,
+            "total_amount": estimate.total_amount,
+        }, font=bold))
+
+    # Write next to the target and rename, so a download never sees half a file.
+    partial = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        wb.save(partial)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+#Cache
+#
+# Files are content-addressed: the name carries a hash of the estimate's
+# updated_at version and the export options, so an unchanged estimate maps
+# to the file already on disk. Hits refresh the file's mtime, which makes
+# the size-based eviction below least-recently-used.
+
+# Bump when the workbook layout changes so older files stop matching.
+_WRITER_VERSION = 1
+
+def export_filename(db: Session, estimate_id: str, request: ExcelExportRequest) -> str:
+    key = _estimate_key(estimate_id)
+    version = db.execute(select(EstimateDB.updated_at).where(EstimateDB.id == key)).first()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    options = request.dict(exclude={"estimate_id"})
+    material = json.dumps(
+        [_WRITER_VERSION, str(key), version.updated_at.isoformat() if version.updated_at else None, options],
+        sort_keys=True, default=str,
+    )
+    digest = hashlib.sha256(material.encode()).hexdigest()[:32]
+    return f"estimate_{key}_{digest}.xlsx"
+
+def _path(filename: str) -> str:
+    return os.path.join(settings.EXPORT_DIR, os.path.basename(filename))
+
+def cached(filename: str) -> bool:
+    path = _path(filename)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def evict(max_bytes: Optional[int] = None, max_age: Optional[int] = None) -> int:
+    """Trim EXPORT_DIR by age, then oldest-first down to max_bytes; returns files removed"""
+    max_bytes = settings.EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = settings.EXPORT_CACHE_MAX_AGE_SECONDS if max_age is None else max_age
+    try:
+        entries = [entry for entry in os.scandir(settings.EXPORT_DIR) if entry.is_file()]
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            # Renamed or removed by a concurrent export since the scan.
+            continue
+        # In-flight writes are only removed once they are clearly abandoned.
+        if entry.name.endswith(".part") and now - stat.st_mtime < max_age:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Held open by a download on a platform that forbids removing it.
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def export_now(db: Session, estimate_id: str, request: ExcelExportRequest) -> str:
+    """Export inline unless already cached; returns the filename under EXPORT_DIR"""
+    filename = export_filename(db, estimate_id, request)
+    if cached(filename):
+        return filename
+    os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+    write_estimate_xlsx(db, estimate_id, request, _path(filename))
+    evict()
+    return filename
+
+#Downloads
+
+_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_CHUNK = 64 * 1024
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _parse_range(header: str, size: int) -> Union[tuple[int, int], str, None]:
+    # One "bytes=" range -> (start, end) inclusive; anything we do not serve
+    # partially (several ranges, bad syntax) -> None, meaning the whole file.
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+def _read(f, start: int, length: int) -> Iterator[bytes]:
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_CHUNK, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+def serve(request: Request, filename: str) -> Response:
+    """Send a cached export, honouring If-None-Match, Range and If-Range"""
+    path = _path(filename)
+    # Everything is sent from this one handle, so an evict() that removes the
+    # file mid-request cannot turn a found export into a failed response.
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    stat = os.fstat(f.fileno())
+    size = stat.st_size
+    # The name already is a content hash, so it doubles as a strong ETag.
+    name = os.path.basename(path)
+    etag = f'"{os.path.splitext(name)[0]}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    start, end, status_code = 0, size - 1, 200
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        f.close()
+        return Response(status_code=304, headers=headers)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        span = _parse_range(range_header, size)
+        if span == "unsatisfiable":
+            f.close()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if span is not None:
+            start, end = span
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if status_code == 200:
+        headers["Content-Disposition"] = f'attachment; filename="{name}"'
+    length = end - start + 1
+    return StreamingResponse(
+        _read(f, start, length),
+        status_code=status_code,
+        media_type=_XLSX,
+        headers={**headers, "Content-Length": str(length)},
+    )
+
+#Background jobs
+
+def _run_job(job_id: uuid.UUID) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(ExportJobDB, job_id)
+        job.status = "running"
+        db.commit()
+        try:
+            job.filename = export_now(db, str(job.estimate_id), ExcelExportRequest(**job.options))
+            job.status = "done"
+        except Exception as exc:
+            db.rollback()
+            job = db.get(ExportJobDB, job_id)
+            job.status = "failed"
+            job.error = str(exc)[:2000]
+        job.finished_at = utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def submit_export(db: Session, estimate_id: str, request: ExcelExportRequest) -> str:
+    """Queue an export on the worker pool; returns the job id"""
+    job = ExportJobDB(estimate_id=_estimate_key(estimate_id), options=request.dict())
+    db.add(job)
+    db.commit()
+    _pool.submit(_run_job, job.id)
+    return str(job.id)
+
+def fail_stale_jobs(db: Session, job_id: Optional[uuid.UUID] = None) -> int:
+    """Mark queued or running jobs past EXPORT_JOB_TIMEOUT_SECONDS failed; returns how many"""
+    now = utcnow()
+    stale = update(ExportJobDB).where(
+        ExportJobDB.status.in_(("queued", "running")),
+        ExportJobDB.created_at < now - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT_SECONDS),
+    )
+    if job_id is not None:
+        stale = stale.where(ExportJobDB.id == job_id)
+    result = db.execute(
+        stale.values(status="failed", error="Export did not finish; its worker stopped", finished_at=now),
+        execution_options={"synchronize_session": False},
+    )
+    db.commit()
+    return result.rowcount
+
+def get_job(db: Session, job_id: str) -> dict:
+    try:
+        job = db.get(ExportJobDB, uuid.UUID(str(job_id)))
+    except ValueError:
+        job = None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status in ("queued", "running") and fail_stale_jobs(db, job.id):
+        db.refresh(job)
+    result = {
+        "job_id": str(job.id),
+        "estimate_id": str(job.estimate_id),
+        "status": job.status,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == "done":
+        result["filename"] = job.filename
+        result["download_url"] = f"/api/v1/downloads/{job.filename}"
+    if job.status == "failed":
+        result["error"] = job.error
+    return result
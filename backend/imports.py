@@ -0,0 +1,209 @@
+import codecs
+import csv
+import json
+import os
+import uuid
+from typing import Any, BinaryIO, Iterator, Optional
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+
+from .database import EstimateDataDB, EstimateItemDB, SessionLocal
+from .models import EstimateItem
+
+# Bulk takeoff import.
+#
+# CSV and XLSX files are read one row at a time (csv over the spooled upload,
+# openpyxl in read-only mode), validated against EstimateItem in batches and
+# written with one executemany INSERT per batch. Nothing outlives a batch:
+# item ids are derived from the file's own ids with uuid5, and parent links
+# to earlier batches are checked against the database rather than kept in
+# memory, so peak memory depends on batch_size, not on the file.
+#
+# Progress is reported as newline-delimited JSON, one line per batch with
+# that batch's row errors, then a final summary line.
+
+_ITEM_COLUMNS = (
+    "description", "quantity", "unit", "material_unit_cost", "material_amount",
+    "labor_unit_cost", "labor_amount", "total_unit_cost", "total_amount",
+    "item_type", "section_code", "level", "sort_order",
+)
+
+# Header spellings seen in estimator spreadsheets -> EstimateItem fields.
+_ALIASES = {
+    "qty": "quantity",
+    "uom": "unit",
+    "units": "unit",
+    "code": "section_code",
+    "csi": "section_code",
+    "type": "item_type",
+    "parent": "parent_id",
+    "material_unit": "material_unit_cost",
+    "labor_unit": "labor_unit_cost",
+    "unit_cost": "total_unit_cost",
+    "material": "material_amount",
+    "labor": "labor_amount",
+    "total": "total_amount",
+    "amount": "total_amount",
+}
+
+_FIELDS = set(EstimateItem.model_fields)
+# Text fields that spreadsheets often hold as numbers (ids, codes like 3100).
+_TEXT_FIELDS = {"id", "parent_id", "description", "section_code"}
+
+
+def _normalize_header(name: Any) -> Optional[str]:
+    if name is None:
+        return None
+    key = str(name).strip().lower().replace(" ", "_").replace("-", "_")
+    key = _ALIASES.get(key, key)
+    return key if key in _FIELDS else None
+
+
+def _clean(field: str, value: Any) -> Any:
+    if field in _TEXT_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool):
+        # XLSX stores every number as a float: 12.0 is the id "12".
+        return str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+        if field == "unit":
+            return value.upper()
+        if field == "item_type":
+            return value.lower().replace(" ", "_")
+    return value
+
+
+#Readers
+
+def _csv_rows(stream: BinaryIO) -> Iterator[tuple]:
+    text = codecs.getreader("utf-8-sig")(stream)
+    yield from csv.reader(text)
+
+
+def _xlsx_rows(stream: BinaryIO) -> Iterator[tuple]:
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".xlsx", ".xlsm") or (content_type or "").endswith("spreadsheetml.sheet"):
+        return "xlsx"
+    if ext in (".csv", ".txt") or (content_type or "").startswith("text/"):
+        return "csv"
+    raise ValueError("Upload a .csv or .xlsx file")
+
+
+def _records(stream: BinaryIO, fmt: str) -> Iterator[tuple[int, dict]]:
+    rows = _xlsx_rows(stream) if fmt == "xlsx" else _csv_rows(stream)
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [_normalize_header(name) for name in header]
+    if "description" not in fields:
+        raise ValueError("The first row must be a header with at least a 'description' column")
+    for line, row in enumerate(rows, start=2):
+        record = {field: _clean(field, value) for field, value in zip(fields, row) if field}
+        if any(value is not None for value in record.values()):
+            yield line, record
+
+
+#Import
+
+def _batched(records: Iterator, size: int) -> Iterator[list]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _error_messages(exc: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()]
+
+
+def _line(payload: dict) -> bytes:
+    return (json.dumps(payload, default=str) + "\n").encode()
+
+
+def stream_import(
+    stream: BinaryIO,
+    fmt: str,
+    project_info: dict,
+    metadata: dict,
+    batch_size: int = 1000,
+) -> Iterator[bytes]:
+    """Import a takeoff file, yielding NDJSON progress lines"""
+    db = SessionLocal()
+    data_id = uuid.uuid4()
+    rows = inserted = failed = 0
+    try:
+        db.add(EstimateDataDB(id=data_id, project_info=project_info, meta=metadata))
+        db.flush()
+        for batch in _batched(_records(stream, fmt), batch_size):
+            errors = []
+            pending = []
+            for line, record in batch:
+                rows += 1
+                try:
+                    item = EstimateItem(**record)
+                except ValidationError as exc:
+                    failed += 1
+                    errors.append({"row": line, "errors": _error_messages(exc)})
+                    continue
+                pending.append((line, item))
+
+            # Ids from the file become stable uuid5 keys under this import.
+            keyed = []
+            batch_ids = set()
+            for line, item in pending:
+                key = uuid.uuid5(data_id, item.id) if item.id else uuid.uuid4()
+                if key in batch_ids:
+                    failed += 1
+                    errors.append({"row": line, "errors": [f"id: duplicate id {item.id!r}"]})
+                    continue
+                batch_ids.add(key)
+                parent = uuid.uuid5(data_id, item.parent_id) if item.parent_id else None
+                keyed.append((line, item, key, parent))
+
+            # One lookup covers duplicates of earlier batches and parents in them.
+            probe = batch_ids | {parent for *_, parent in keyed if parent is not None}
+            existing = set(db.execute(
+                select(EstimateItemDB.id).where(EstimateItemDB.data_id == data_id, EstimateItemDB.id.in_(probe))
+            ).scalars()) if probe else set()
+
+            insert_rows = []
+            seen = set()
+            for line, item, key, parent in keyed:
+                if key in existing:
+                    failed += 1
+                    errors.append({"row": line, "errors": [f"id: duplicate id {item.id!r}"]})
+                    continue
+                if parent is not None and parent not in existing and parent not in seen:
+                    errors.append({"row": line, "errors": [f"parent_id: {item.parent_id!r} is not an earlier row; imported without a parent"]})
+                    parent = None
+                seen.add(key)
+                row = {column: getattr(item, column) for column in _ITEM_COLUMNS}
+                row.update(id=key, parent_id=parent, data_id=data_id, position=line)
+                insert_rows.append(row)
+            if insert_rows:
+                db.execute(insert(EstimateItemDB), insert_rows)
+                inserted += len(insert_rows)
+            errors.sort(key=lambda error: error["row"])
+            yield _line({"event": "progress", "rows": rows, "inserted": inserted, "failed": failed, "errors": errors})
+        db.commit()
+        yield _line({"event": "done", "id": str(data_id), "rows": rows, "inserted": inserted, "failed": failed})
+    except Exception as exc:
+        db.rollback()
+        yield _line({"event": "error", "detail": str(exc), "rows": rows})
+    finally:
+        db.close()
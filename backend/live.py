@@ -0,0 +1,326 @@
+import asyncio
+import uuid
+import weakref
+from typing import Callable, Optional
+
+import orjson
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from . import repository, revisions
+from .database import AsyncSessionLocal, EstimateDB, EstimateItemDB, SessionLocal
+from .models import EstimateItem, EstimateItemPatch, EstimateSection, EstimateSectionPatch, LiveEdit, ReorderRequest
+from .settings import settings
+
+# Live estimate editing.
+#
+# Clients open /api/v1/estimates/{id}/live and send item- and section-level
+# edits as LiveEdit messages. Each runs through the same repository function
+# as its REST route, so totals, revisions and analytics are kept in one place.
+# Every committed save of the estimate (from this channel, the REST routes, a
+# full PUT or a recalculation job) reaches its subscribers as the revision
+# delta that was recorded, in revisions.apply() shape:
+#
+#   {"type": "hello", "version": 7}                   on connect
+#   {"type": "delta", "version": 8, "delta": {...}}
+#   {"type": "reload", "version": 8}                  no delta kept; refetch
+#
+# and the sender of an edit gets {"type": "ack", "ref", "version", "result"}
+# or {"type": "error", "ref", "status", "detail"}.
+#
+# Ordering: saves bump estimates.version under the row's write lock, so
+# versions are dense and totally ordered per estimate. Clients apply deltas in
+# version order and refetch the document when one is missing. Edits to one
+# estimate from this worker's sockets also run one at a time.
+#
+# Concurrency: an edit carries the version it was made against. When the
+# estimate has moved on since, the saves in between are merged and the edit is
+# refused with 409 only if they changed the same fields of the same rows;
+# edits to other rows or other fields go through. A snapshot revision in
+# between hides what changed, so it counts as a conflict.
+#
+# Fan-out: after commit, each recorded save is handed to `broker`, which
+# delivers it to `hub`, which queues it for every socket on that estimate in
+# this process. LocalBroker stands in for a cross-process broker and only
+# reaches this process; with several workers, replace it with one that has
+# the same publish() and hands what it receives to hub.deliver (Redis
+# pub/sub, Postgres LISTEN/NOTIFY).
+
+_MISSING = object()
+# Fields a save recomputes on its own; only "any change" checks skip them.
+_DERIVED = {
+    "sections": {"subtotal_material", "subtotal_labor", "subtotal_total"},
+    "items": {"material_amount", "labor_amount", "total_unit_cost", "total_amount"},
+}
+# Close code for a socket whose queue overflowed; the client reconnects and refetches.
+_TRY_AGAIN_LATER = 1013
+_NOT_FOUND = 4404
+
+
+def _dumps(message: dict) -> str:
+    return orjson.dumps(message).decode()
+
+
+def channel_of(estimate_id) -> str:
+    return f"estimate:{estimate_id}"
+
+
+#Pub/sub
+
+class Hub:
+    """Per-process fan-out from channels to subscriber queues"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._channels: dict[str, set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._channels.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        queues = self._channels.get(channel)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._channels[channel]
+
+    def subscribers(self, channel: str) -> int:
+        return len(self._channels.get(channel, ()))
+
+    def deliver(self, channel: str, message: str) -> None:
+        """Queue `message` for the channel's subscribers; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed() or channel not in self._channels:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fan_out(channel, message)
+        else:
+            loop.call_soon_threadsafe(self._fan_out, channel, message)
+
+    def _fan_out(self, channel: str, message: str) -> None:
+        for queue in list(self._channels.get(channel, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too far behind to catch up from deltas: drop what is queued
+                # and tell the socket to close, the client then refetches.
+                self.unsubscribe(channel, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+class LocalBroker:
+    """Stand-in for a cross-process broker: publishes straight to this process"""
+
+    def __init__(self, deliver: Callable[[str, str], None]):
+        self._deliver = deliver
+
+    def publish(self, channel: str, message: str) -> None:
+        self._deliver(channel, message)
+
+
+hub = Hub(settings.LIVE_QUEUE_SIZE)
+broker = LocalBroker(hub.deliver)
+
+
+# revisions.record() notes every save in session.info; nothing goes out
+# until the transaction commits, and a rollback discards it.
+@event.listens_for(Session, "after_commit")
+def _publish_recorded(session: Session) -> None:
+    for estimate_id, version, delta in session.info.pop("recorded", ()):
+        if delta is None:
+            message = {"type": "reload", "version": version}
+        else:
+            message = {"type": "delta", "version": version, "delta": delta}
+        broker.publish(channel_of(estimate_id), _dumps(message))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_recorded(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop("recorded", None)
+
+
+#Edits
+
+def _key(value) -> str:
+    # Revision deltas key rows by canonical UUID text.
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return str(value)
+
+
+def _changed_fields(model, data: dict) -> set:
+    return set(model(**data).dict(exclude_unset=True))
+
+
+def _targets(db: Session, edit: LiveEdit) -> list[tuple[str, str, Optional[set]]]:
+    """(part, row id, fields) this edit depends on; fields None means any field"""
+    if edit.op == "update_item":
+        return [("items", _key(edit.item_id), _changed_fields(EstimateItemPatch, edit.data))]
+    if edit.op == "delete_item":
+        return [("items", _key(edit.item_id), None)]
+    if edit.op == "update_section":
+        return [("sections", _key(edit.section_id), _changed_fields(EstimateSectionPatch, edit.data))]
+    if edit.op == "delete_section":
+        items = db.execute(
+            select(EstimateItemDB.id).where(EstimateItemDB.section_id == repository._parse_id(edit.section_id, "Section not found"))
+        ).scalars()
+        return [("sections", _key(edit.section_id), None)] + [("items", str(item), None) for item in items]
+    if edit.op == "reorder_items":
+        return [("items", _key(item), {"sort_order", "position"}) for item in ReorderRequest(**edit.data).ids]
+    if edit.op == "reorder_sections":
+        return [("sections", _key(section), {"position"}) for section in ReorderRequest(**edit.data).ids]
+    # Additions depend on nothing that a concurrent save could overwrite.
+    return []
+
+
+def _conflicts(changes: dict, targets: list) -> bool:
+    for part, key, fields in targets:
+        changed = changes.get(part, {}).get(key, _MISSING)
+        if changed is _MISSING:
+            continue
+        if changed is None:
+            return True
+        if fields is None:
+            fields = set(changed) - _DERIVED[part]
+            if fields:
+                return True
+        elif fields & set(changed):
+            return True
+    return False
+
+
+_OPS = {
+    "add_item": lambda db, estimate_id, edit: repository.add_item(db, estimate_id, edit.section_id, EstimateItem(**edit.data)),
+    "update_item": lambda db, estimate_id, edit: repository.update_item(db, estimate_id, edit.item_id, EstimateItemPatch(**edit.data)),
+    "delete_item": lambda db, estimate_id, edit: repository.delete_item(db, estimate_id, edit.item_id),
+    "reorder_items": lambda db, estimate_id, edit: repository.reorder_items(db, estimate_id, edit.section_id, ReorderRequest(**edit.data).ids),
+    "add_section": lambda db, estimate_id, edit: repository.add_section(db, estimate_id, EstimateSection(**edit.data)),
+    "update_section": lambda db, estimate_id, edit: repository.update_section(db, estimate_id, edit.section_id, EstimateSectionPatch(**edit.data)),
+    "delete_section": lambda db, estimate_id, edit: repository.delete_section(db, estimate_id, edit.section_id),
+    "reorder_sections": lambda db, estimate_id, edit: repository.reorder_sections(db, estimate_id, ReorderRequest(**edit.data).ids),
+}
+
+
+def apply_edit(db: Session, estimate_id: str, edit: LiveEdit) -> tuple[int, Optional[dict]]:
+    """Check `edit` against the saves since its base_version, then apply it; returns (new version, result)"""
+    key = repository._parse_id(estimate_id, "Estimate not found")
+    # Held until the edit commits (ignored on SQLite, which has one writer anyway).
+    version = db.execute(select(EstimateDB.version).where(EstimateDB.id == key).with_for_update()).scalar_one_or_none()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    if edit.base_version > version:
+        raise HTTPException(status_code=400, detail=f"base_version {edit.base_version} is ahead of the estimate ({version})")
+    if edit.base_version < version:
+        changes = revisions.changes_since(db, key, edit.base_version)
+        if changes is None or _conflicts(changes, _targets(db, edit)):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Changed by someone else since version {edit.base_version} (now {version}); reapply on the latest",
+            )
+    result = _OPS[edit.op](db, estimate_id, edit)
+    # Every edit records exactly one revision.
+    return version + 1, result
+
+
+def _apply_in_session(estimate_id: str, edit: LiveEdit) -> tuple[int, Optional[dict]]:
+    db = SessionLocal()
+    try:
+        return apply_edit(db, estimate_id, edit)
+    finally:
+        db.close()
+
+
+#Sockets
+
+_edit_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _errors(exc: ValidationError) -> list[dict]:
+    return [{"loc": list(error["loc"]), "msg": error["msg"]} for error in exc.errors()]
+
+
+async def _handle(estimate_id: str, text: str) -> str:
+    ref = None
+    try:
+        message = orjson.loads(text)
+        if isinstance(message, dict):
+            ref = message.get("ref")
+        edit = LiveEdit.model_validate(message)
+        lock = _edit_locks.setdefault(estimate_id, asyncio.Lock())
+        async with lock:
+            # Edits can roll up a whole section; keep that off the event loop.
+            version, result = await run_in_threadpool(_apply_in_session, estimate_id, edit)
+    except HTTPException as exc:
+        return _dumps({"type": "error", "ref": ref, "status": exc.status_code, "detail": exc.detail})
+    except ValidationError as exc:
+        return _dumps({"type": "error", "ref": ref, "status": 422, "detail": _errors(exc)})
+    except orjson.JSONDecodeError:
+        return _dumps({"type": "error", "ref": ref, "status": 400, "detail": "Messages must be JSON"})
+    return _dumps({"type": "ack", "ref": ref, "version": version, "result": result})
+
+
+async def serve(websocket: WebSocket, estimate_id: str) -> None:
+    await websocket.accept()
+    try:
+        estimate_id = str(uuid.UUID(estimate_id))
+    except ValueError:
+        await websocket.close(code=_NOT_FOUND, reason="Estimate not found")
+        return
+    channel = channel_of(estimate_id)
+    # Subscribe before reading the version so no save can fall in between.
+    queue = hub.subscribe(channel)
+    try:
+        async with AsyncSessionLocal() as db:
+            version = (await db.execute(
+                select(EstimateDB.version).where(EstimateDB.id == uuid.UUID(estimate_id))
+            )).scalar_one_or_none()
+        if version is None:
+            await websocket.close(code=_NOT_FOUND, reason="Estimate not found")
+            return
+        send_lock = asyncio.Lock()
+
+        async def send(text: str) -> None:
+            async with send_lock:
+                await websocket.send_text(text)
+
+        async def forward() -> None:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    await websocket.close(code=_TRY_AGAIN_LATER, reason="Too far behind; refetch the estimate")
+                    return
+                await send(message)
+
+        async def receive() -> None:
+            try:
+                while True:
+                    text = await websocket.receive_text()
+                    await send(await _handle(estimate_id, text))
+            except WebSocketDisconnect:
+                pass
+
+        await send(_dumps({"type": "hello", "version": version}))
+        tasks = [asyncio.create_task(forward()), asyncio.create_task(receive())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+    finally:
+        hub.unsubscribe(channel, queue)
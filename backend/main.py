@@ -1,19 +1,25 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, File, Form, Query, Request, UploadFile, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
 from typing import List, Optional
+import asyncio
 import json
 import uuid
 from datetime import datetime
-import os
 from pydantic import BaseModel, EmailStr
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import session
-from .database import Base, engine, get_db
-from .settings import get_cors_origins
+from .database import Base, SessionLocal, async_engine, engine, get_async_db, get_db, ping, pool_stats, utcnow
+from . import analytics, exports, imports, live, mapping, metrics, profiling, reaper, recalc, repository, rollup, search
+from .compression import CompressionMiddleware
+from .settings import settings, get_cors_origins
 from .models import (
     User, RefreshToken,
     Estimate, EstimateTemplate, EstimateItem, EstimateSection,
-    EstimateData, ExcelExportRequest, UnitType, ItemType
+    EstimateData, ExcelExportRequest, UnitType, ItemType,
+    EstimateItemPatch, EstimateSectionPatch, ReorderRequest, RecalculationRequest,
 )
 from .session import (
     TokenPair,
@@ -22,12 +28,31 @@ from .session import (
     revoke_this_device,
     revoke_all_devices,
     get_current_user,
+    auth_cache_stats,
 )
 
 #Create Missing Tables
 Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
+search.install(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Export and recalculation jobs left open by a worker that died would
+    # otherwise poll forever.
+    with SessionLocal() as db:
+        exports.fail_stale_jobs(db)
+        recalc.fail_stale_jobs(db)
+    reaper_task = reaper.start()
+    yield
+    await reaper.stop(reaper_task)
+    # Close pooled connections so the database sees a clean disconnect.
+    await async_engine.dispose()
+    engine.dispose()
+
+# Routes that return large documents build them as plain dicts and return an
+# ORJSONResponse themselves, which skips FastAPI's jsonable_encoder pass and
+# response_model validation; response_model then only documents the shape.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(CORSMiddleware, 
     allow_origins=["http://localhost:5173"], 
@@ -35,231 +60,420 @@ app.add_middleware(CORSMiddleware,
     allow_methods=["*"], 
     allow_headers=["*"]
 )
+app.add_middleware(CompressionMiddleware,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_BYTES,
+    gzip_level=settings.RESPONSE_GZIP_LEVEL,
+    brotli_quality=settings.RESPONSE_BROTLI_QUALITY,
+)
+if profiling.enabled():
+    profiling.install()
+    app.add_middleware(profiling.ProfilingMiddleware)
+# Outermost, so timings include compression and sizes are what went out.
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Data Management Endpoints
 @app.post("/api/v1/data/import")
-async def import_data(data: EstimateData):
+def import_data(data: EstimateData, db: session = Depends(get_db)):
     """Import raw data for processing"""
-    data_id = str(uuid.uuid4())
-    data_db[data_id] = {
-        "id": data_id,
-        "project_info": data.project_info,
-        "items": [item.dict() for item in data.items],
-        "metadata": data.metadata,
-        "created_at": datetime.now().isoformat()
-    }
+    data_id = repository.create_data(db, data)
     return {"id": data_id, "message": "Data imported successfully"}
 
+@app.post("/api/v1/data/import/file")
+def import_data_file(
+    file: UploadFile = File(...),
+    project_info: str = Form("{}"),
+    metadata: str = Form("{}"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+):
+    """Import a CSV or XLSX takeoff file in batches.
+
+    The response is newline-delimited JSON: one progress line per batch with
+    that batch's row errors, then a "done" (or "error") line with the data id.
+    """
+    try:
+        fmt = imports.detect_format(file.filename, file.content_type)
+        info, meta = json.loads(project_info), json.loads(metadata)
+        if not isinstance(info, dict) or not isinstance(meta, dict):
+            raise ValueError("project_info and metadata must be JSON objects")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return StreamingResponse(
+        imports.stream_import(file.file, fmt, info, meta, batch_size),
+        media_type="application/x-ndjson",
+    )
+
 @app.get("/api/v1/data/{data_id}")
-async def get_data(data_id: str):
+def get_data(data_id: str, db: session = Depends(get_db)):
     """Get imported data"""
-    if data_id not in data_db:
-        raise HTTPException(status_code=404, detail="Data not found")
-    return data_db[data_id]
+    return ORJSONResponse(repository.get_data(db, data_id))
 
 @app.get("/api/v1/data")
-async def list_data():
-    """List all imported data"""
-    return {"data": list(data_db.values())}
+def list_data(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: session = Depends(get_db),
+):
+    """List imported data, newest first, without the item rows"""
+    data, next_cursor = repository.list_data(db, cursor=cursor, limit=limit)
+    return ORJSONResponse({"data": data, "next_cursor": next_cursor})
 
 # Template Management Endpoints
 @app.post("/api/v1/templates")
-async def create_template(template: EstimateTemplate):
+def create_template(template: EstimateTemplate, db: session = Depends(get_db)):
     """Create a new estimate template"""
     template_id = str(uuid.uuid4())
     template.id = template_id
-    template.created_at = datetime.now()
-    template.updated_at = datetime.now()
-    templates_db[template_id] = template.dict()
+    template.created_at = utcnow()
+    template.updated_at = utcnow()
+    rollup.apply_sections(template.sections)
+    repository.create_template(db, template)
     return {"id": template_id, "message": "Template created successfully"}
 
 @app.get("/api/v1/templates")
-async def list_templates():
-    """List all templates"""
-    return {"templates": list(templates_db.values())}
+def list_templates(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    project_type: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    db: session = Depends(get_db),
+):
+    """List template summaries, most recently updated first"""
+    templates, next_cursor = repository.list_templates(
+        db, cursor=cursor, limit=limit, project_type=project_type, is_active=is_active
+    )
+    return ORJSONResponse({"templates": [template.dict() for template in templates], "next_cursor": next_cursor})
 
-@app.get("/api/v1/templates/{template_id}")
-async def get_template(template_id: str):
+@app.get("/api/v1/templates/{template_id}", response_model=EstimateTemplate)
+def get_template(template_id: str, db: session = Depends(get_db)):
     """Get a specific template"""
-    if template_id not in templates_db:
-        raise HTTPException(status_code=404, detail="Template not found")
-    return templates_db[template_id]
+    return ORJSONResponse(repository.template_document(db, template_id))
 
 @app.put("/api/v1/templates/{template_id}")
-async def update_template(template_id: str, template: EstimateTemplate):
+def update_template(template_id: str, template: EstimateTemplate, db: session = Depends(get_db)):
     """Update a template"""
-    if template_id not in templates_db:
-        raise HTTPException(status_code=404, detail="Template not found")
     template.id = template_id
-    template.updated_at = datetime.now()
-    templates_db[template_id] = template.dict()
+    template.updated_at = utcnow()
+    rollup.apply_sections(template.sections)
+    repository.update_template(db, template_id, template)
     return {"message": "Template updated successfully"}
 
 # Estimate Management Endpoints
+# Routes that load, build or write whole estimates (or run the rollup) are
+# sync and run in the threadpool: their CPU work would otherwise stall every
+# request on the worker. Light queries use the AsyncSession, where run_sync
+# hands the repository a Session whose I/O goes through the async driver.
 @app.post("/api/v1/estimates")
-async def create_estimate(estimate: Estimate):
+def create_estimate(estimate: Estimate, db: session = Depends(get_db)):
     """Create a new estimate"""
     estimate_id = str(uuid.uuid4())
     estimate.id = estimate_id
-    estimate.created_at = datetime.now()
-    estimate.updated_at = datetime.now()
-    
-    # Calculate totals
-    total_material = sum(
-        sum(item.material_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    total_labor = sum(
-        sum(item.labor_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    total_amount = sum(
-        sum(item.total_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    
-    estimate.total_material = total_material
-    estimate.total_labor = total_labor
-    estimate.total_amount = total_amount
-    
-    estimates_db[estimate_id] = estimate.dict()
+    estimate.created_at = utcnow()
+    estimate.updated_at = utcnow()
+    rollup.apply(estimate)
+    repository.create_estimate(db, estimate)
     return {"id": estimate_id, "message": "Estimate created successfully"}
 
 @app.get("/api/v1/estimates")
-async def list_estimates():
-    """List all estimates"""
-    return {"estimates": list(estimates_db.values())}
+async def list_estimates(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    status: Optional[str] = None,
+    client_name: Optional[str] = None,
+    template_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """List estimate summaries, most recently updated first.
+
+    Pass the returned next_cursor back as `cursor` to fetch the following page.
+    """
+    estimates, next_cursor = await db.run_sync(
+        repository.list_estimates,
+        cursor=cursor,
+        limit=limit,
+        status=status,
+        client_name=client_name,
+        template_id=template_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    return ORJSONResponse({"estimates": [estimate.dict() for estimate in estimates], "next_cursor": next_cursor})
 
-@app.get("/api/v1/estimates/{estimate_id}")
-async def get_estimate(estimate_id: str):
+@app.get("/api/v1/estimates/{estimate_id}", response_model=Estimate)
+def get_estimate(estimate_id: str, db: session = Depends(get_db)):
     """Get a specific estimate"""
-    if estimate_id not in estimates_db:
-        raise HTTPException(status_code=404, detail="Estimate not found")
-    return estimates_db[estimate_id]
+    return ORJSONResponse(repository.estimate_document(db, estimate_id))
 
 @app.put("/api/v1/estimates/{estimate_id}")
-async def update_estimate(estimate_id: str, estimate: Estimate):
+def update_estimate(estimate_id: str, estimate: Estimate, db: session = Depends(get_db)):
     """Update an estimate"""
-    if estimate_id not in estimates_db:
-        raise HTTPException(status_code=404, detail="Estimate not found")
     estimate.id = estimate_id
-    estimate.updated_at = datetime.now()
-    
-    # Recalculate totals
-    total_material = sum(
-        sum(item.material_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    total_labor = sum(
-        sum(item.labor_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    total_amount = sum(
-        sum(item.total_amount or 0 for item in section.items)
-        for section in estimate.sections
-    )
-    
-    estimate.total_material = total_material
-    estimate.total_labor = total_labor
-    estimate.total_amount = total_amount
-    
-    estimates_db[estimate_id] = estimate.dict()
-    return {"message": "Estimate updated successfully"}
+    estimate.updated_at = utcnow()
+    rollup.apply(estimate)
+    version = repository.update_estimate(db, estimate_id, estimate)
+    return {"message": "Estimate updated successfully", "version": version}
+
+# Version history: each save is a revision; old versions are rebuilt on demand
+@app.get("/api/v1/estimates/{estimate_id}/revisions")
+async def list_revisions(
+    estimate_id: str,
+    before: Optional[int] = Query(None, description="Only versions older than this, for the next page"),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Revision numbers, kinds and timestamps, newest first"""
+    return {"revisions": await db.run_sync(repository.list_revisions, estimate_id, before=before, limit=limit)}
+
+@app.get("/api/v1/estimates/{estimate_id}/revisions/diff")
+def diff_revisions(
+    estimate_id: str,
+    from_version: int = Query(..., alias="from", ge=1),
+    to_version: Optional[int] = Query(None, alias="to", ge=1),
+    db: session = Depends(get_db),
+):
+    """Fields changed between two versions (`to` defaults to the latest); deleted rows are null"""
+    return repository.diff_revisions(db, estimate_id, from_version, to_version)
+
+@app.get("/api/v1/estimates/{estimate_id}/revisions/{version}", response_model=Estimate)
+def get_revision(estimate_id: str, version: int, db: session = Depends(get_db)):
+    """The estimate as it was at `version`"""
+    estimate = repository.get_revision(db, estimate_id, version)
+    return ORJSONResponse(estimate.dict())
+
+# Incremental estimate edits: totals move by the change, no full-document PUT
+@app.post("/api/v1/estimates/{estimate_id}/sections")
+def add_section(estimate_id: str, section: EstimateSection, db: session = Depends(get_db)):
+    """Append a section (with any items) to an estimate"""
+    return repository.add_section(db, estimate_id, section)
+
+@app.patch("/api/v1/estimates/{estimate_id}/sections/order")
+async def reorder_sections(estimate_id: str, body: ReorderRequest, db: AsyncSession = Depends(get_async_db)):
+    """Reorder the sections of an estimate"""
+    await db.run_sync(repository.reorder_sections, estimate_id, body.ids)
+    return {"message": "Sections reordered successfully"}
+
+@app.patch("/api/v1/estimates/{estimate_id}/sections/{section_id}")
+async def update_section(estimate_id: str, section_id: str, patch: EstimateSectionPatch, db: AsyncSession = Depends(get_async_db)):
+    """Rename or recode a section"""
+    await db.run_sync(repository.update_section, estimate_id, section_id, patch)
+    return {"message": "Section updated successfully"}
+
+@app.delete("/api/v1/estimates/{estimate_id}/sections/{section_id}")
+def delete_section(estimate_id: str, section_id: str, db: session = Depends(get_db)):
+    """Delete a section and its items"""
+    return repository.delete_section(db, estimate_id, section_id)
+
+@app.post("/api/v1/estimates/{estimate_id}/sections/{section_id}/items")
+def add_item(estimate_id: str, section_id: str, item: EstimateItem, db: session = Depends(get_db)):
+    """Append a line item to a section"""
+    return repository.add_item(db, estimate_id, section_id, item)
+
+@app.patch("/api/v1/estimates/{estimate_id}/sections/{section_id}/items/order")
+def reorder_items(estimate_id: str, section_id: str, body: ReorderRequest, db: session = Depends(get_db)):
+    """Reorder the items of a section"""
+    repository.reorder_items(db, estimate_id, section_id, body.ids)
+    return {"message": "Items reordered successfully"}
+
+@app.patch("/api/v1/estimates/{estimate_id}/items/{item_id}")
+def update_item(estimate_id: str, item_id: str, patch: EstimateItemPatch, db: session = Depends(get_db)):
+    """Change individual fields of a line item"""
+    return repository.update_item(db, estimate_id, item_id, patch)
+
+@app.delete("/api/v1/estimates/{estimate_id}/items/{item_id}")
+def delete_item(estimate_id: str, item_id: str, db: session = Depends(get_db)):
+    """Delete a line item; its children move up to its parent"""
+    return repository.delete_item(db, estimate_id, item_id)
+
+# Live editing: the edits above over one socket, with every save broadcast as a delta
+@app.websocket("/api/v1/estimates/{estimate_id}/live")
+async def live_estimate(websocket: WebSocket, estimate_id: str):
+    """Send LiveEdit messages; receive acks, errors and the deltas of every save (see live.py)"""
+    await live.serve(websocket, estimate_id)
 
 @app.post("/api/v1/estimates/{estimate_id}/export/excel")
-async def export_estimate_to_excel(estimate_id: str, request: ExcelExportRequest):
-    """Export estimate to Excel format"""
-    if estimate_id not in estimates_db:
-        raise HTTPException(status_code=404, detail="Estimate not found")
-    
-    estimate = estimates_db[estimate_id]
-    
-    # Create Excel file (simplified - you'd use openpyxl or xlsxwriter)
-    filename = f"estimate_{estimate_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    filepath = f"exports/{filename}"
-    
-    # Ensure exports directory exists
-    os.makedirs("exports", exist_ok=True)
-    
-    # For now, create a JSON file (replace with actual Excel generation)
-    with open(filepath.replace('.xlsx', '.json'), 'w') as f:
-        json.dump(estimate, f, indent=2, default=str)
-    
+def export_estimate_to_excel(estimate_id: str, request: ExcelExportRequest, response: Response, db: session = Depends(get_db)):
+    """Export estimate to Excel format.
+
+    An unchanged estimate is served from the export cache. Otherwise small
+    estimates are written inline and larger ones are queued and answered
+    with 202 and a job id to poll at /api/v1/exports/{job_id}.
+    """
+    filename = exports.export_filename(db, estimate_id, request)
+    if exports.cached(filename):
+        return {"filename": filename, "download_url": f"/api/v1/downloads/{filename}", "cached": True}
+    if exports.count_items(db, estimate_id) > settings.EXPORT_ASYNC_THRESHOLD:
+        job_id = exports.submit_export(db, estimate_id, request)
+        response.status_code = 202
+        return {"job_id": job_id, "status": "queued", "status_url": f"/api/v1/exports/{job_id}"}
+    filename = exports.export_now(db, estimate_id, request)
     return {"filename": filename, "download_url": f"/api/v1/downloads/{filename}"}
 
+@app.get("/api/v1/exports/{job_id}")
+def get_export_job(job_id: str, db: session = Depends(get_db)):
+    """Poll a background export"""
+    return exports.get_job(db, job_id)
+
 @app.get("/api/v1/downloads/{filename}")
-async def download_file(filename: str):
-    """Download exported file"""
-    filepath = f"exports/{filename}"
-    if not os.path.exists(filepath):
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(filepath)
+def download_file(filename: str, request: Request):
+    """Download exported file (supports ETag/If-None-Match and Range)"""
+    return exports.serve(request, filename)
 
 # Utility endpoints
+# Bulk re-pricing across many estimates, as a background job
+@app.post("/api/v1/recalculations", status_code=202, dependencies=[Depends(get_current_user)])
+def start_recalculation(request: RecalculationRequest, db: session = Depends(get_db)):
+    """Apply unit-cost overrides to every matching estimate; poll the job for progress.
+
+    With dry_run the changes are computed and rolled back, and the job
+    result holds the projected total deltas.
+    """
+    job = recalc.submit(db, request)
+    return {**job, "status_url": f"/api/v1/recalculations/{job['job_id']}"}
+
+@app.get("/api/v1/recalculations/{job_id}", dependencies=[Depends(get_current_user)])
+def get_recalculation(job_id: str, db: session = Depends(get_db)):
+    """Progress and total deltas of a recalculation job"""
+    return recalc.get_job(db, job_id)
+
 @app.post("/api/v1/estimates/from-template/{template_id}")
-async def create_estimate_from_template(template_id: str, project_info: dict):
+def create_estimate_from_template(template_id: str, project_info: dict, db: session = Depends(get_db)):
     """Create a new estimate from a template"""
-    if template_id not in templates_db:
-        raise HTTPException(status_code=404, detail="Template not found")
-    
-    template = templates_db[template_id]
-    
-    # Create new estimate based on template
+    # Rows, first snapshot and analytics counts are all built inside the database.
     estimate = Estimate(
+        id=str(uuid.uuid4()),
         project_name=project_info.get("project_name", "New Project"),
         project_location=project_info.get("project_location", ""),
         client_name=project_info.get("client_name", ""),
-        estimate_date=datetime.now(),
+        estimate_date=utcnow(),
         prepared_by=project_info.get("prepared_by", ""),
         template_id=template_id,
-        sections=[EstimateSection(**section) for section in template["sections"]]
+        sections=[],
+        created_at=utcnow(),
+        updated_at=utcnow(),
     )
-    
-    return await create_estimate(estimate)
+    estimate_id = repository.instantiate_template(db, template_id, estimate)
+    return {"id": estimate_id, "message": "Estimate created successfully"}
 
 @app.post("/api/v1/estimates/from-data/{data_id}")
-async def create_estimate_from_data(data_id: str, project_info: dict):
+def create_estimate_from_data(data_id: str, project_info: dict, db: session = Depends(get_db)):
     """Create a new estimate from imported data"""
-    if data_id not in data_db:
-        raise HTTPException(status_code=404, detail="Data not found")
-    
-    data = data_db[data_id]
-    
-    # Process data into estimate structure
-    # This would involve mapping your data format to estimate sections
+    data_info, items = repository.get_data_items(db, data_id)
+
+    # Items are grouped into sections by section_code prefix; section_segments
+    # picks how many code parts name a section (1: "03-00-00" divisions).
+    segments = project_info.get("section_segments", 1)
+    if not isinstance(segments, int) or segments < 1:
+        raise HTTPException(status_code=400, detail="section_segments must be a positive integer")
     estimate = Estimate(
-        project_name=project_info.get("project_name", data["project_info"].get("project_name", "New Project")),
+        project_name=project_info.get("project_name", data_info.get("project_name", "New Project")),
         project_location=project_info.get("project_location", ""),
         client_name=project_info.get("client_name", ""),
-        estimate_date=datetime.now(),
+        estimate_date=utcnow(),
         prepared_by=project_info.get("prepared_by", ""),
-        sections=[]  # Process data.items into sections
+        sections=mapping.build_sections(items, segments),
+    )
+
+    return create_estimate(estimate, db)
+
+@app.get("/api/v1/search")
+def search_all(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[List[str]] = Query(None, description="estimate, item and/or template; default all"),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: session = Depends(get_db),
+):
+    """Ranked matches over line items, estimates and templates"""
+    unknown = set(kind or ()) - set(search.KINDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kind: {', '.join(sorted(unknown))}")
+    hits, next_cursor = search.search(db, q, kinds=kind, cursor=cursor, limit=limit)
+    return {"hits": hits, "next_cursor": next_cursor}
+
+
+@app.get("/api/v1/analytics/unit-costs")
+def unit_costs(
+    section_code: Optional[str] = None,
+    unit: Optional[UnitType] = None,
+    bucket: str = Query("month", pattern="^(month|quarter|year)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: session = Depends(get_db),
+):
+    """Min, median, p90 and count of line-item unit costs per section code, unit and period"""
+    rows = analytics.unit_costs(
+        db,
+        section_code=section_code,
+        unit=unit.value if unit else None,
+        bucket=bucket,
+        date_from=date_from,
+        date_to=date_to,
     )
-    
-    return await create_estimate(estimate)
+    return {"unit_costs": rows}
+
+
+@app.post("/api/v1/analytics/unit-costs/rebuild", dependencies=[Depends(get_current_user)])
+def rebuild_unit_costs(db: session = Depends(get_db)):
+    """Recount the unit-cost rollup from every stored estimate"""
+    rows = analytics.rebuild(db)
+    return {"message": "Unit-cost rollup rebuilt", "rows": rows}
 
 @app.get("/")
 def root():
     return {"message": "CEAS Estimate API", "version": "1.0.0"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the database answers, 503 while it does not"""
+    try:
+        await asyncio.wait_for(ping(), settings.READINESS_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, OSError, SQLAlchemyError) as exc:
+        raise HTTPException(status_code=503, detail=f"Database unavailable ({type(exc).__name__})")
+    return {"status": "ready"}
+
+# Metrics (see metrics.py); these need Authorization: Bearer <METRICS_TOKEN>
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(metrics.require_token)])
+def get_metrics():
+    """Request latency, sizes, SQL counts and pool state in Prometheus text format"""
+    return PlainTextResponse(
+        metrics.render({"sync": pool_stats(engine), "async": pool_stats(async_engine.sync_engine)}),
+        media_type="text/plain; version=0.0.4",
+    )
+
+# Request profiles (see profiling.py); these need the X-Profile-Token header
+@app.get("/api/v1/admin/profiles", dependencies=[Depends(profiling.require_admin)])
+def list_profiles():
+    """Kept request profiles, newest first, without their stacks"""
+    return {"profiles": profiling.list_profiles()}
+
+@app.get("/api/v1/admin/profiles/{profile_id}", dependencies=[Depends(profiling.require_admin)])
+def get_profile(profile_id: str, format: str = Query("json", pattern="^(json|folded)$")):
+    """One profile with its SQL statements; format=folded returns the stacks for flamegraph.pl or speedscope"""
+    profile = profiling.get_profile(profile_id)
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {**profile.summary(), "sql": profile.statements, "folded": profile.folded()}
+
+@app.get("/api/v1/metrics/pool", dependencies=[Depends(metrics.require_token)])
+def get_pool_metrics():
+    """Connection pool occupancy and checkout wait times, per engine"""
+    return {"sync": pool_stats(engine), "async": pool_stats(async_engine.sync_engine)}
+
+@app.get("/api/v1/metrics/auth-cache", dependencies=[Depends(metrics.require_token)])
+def get_auth_cache_metrics():
+    """Hit/miss counters of the get_current_user token and user caches"""
+    return auth_cache_stats()
+
+@app.get("/api/v1/metrics/refresh-tokens", dependencies=[Depends(metrics.require_token)])
+async def get_refresh_token_metrics(db: AsyncSession = Depends(get_async_db)):
+    """refresh_tokens table size and what the background reaper has removed"""
+    return {"table": await reaper.table_stats(db), "reaper": reaper.metrics.snapshot()}
+
 @app.get("/api/v1/users")
 def get_users():
     return {"message": "Users fetched successfully"}
 
-# Create tables if they don't exist (dev convenience).
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="CEAS — Sessions")
-
-# CORS config (allow all in dev; lock to your frontend origin(s) in prod)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=get_cors_origins(),
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type"],
-)
-
 #Request bodies (Pydantic)
 
 class IssueIn(BaseModel):
@@ -279,23 +493,23 @@ class LogoutIn(BaseModel):
 #Routes
 
 @app.post("/auth/issue", response_model=TokenPair)
-def auth_issue(body: IssueIn, db: session = Depends(get_db)):
-    return issue_session(db, body.email, body.full_name, body.ms_oid)
+async def auth_issue(body: IssueIn, db: AsyncSession = Depends(get_async_db)):
+    return await issue_session(db, body.email, body.full_name, body.ms_oid)
 
 @app.post("/auth/refresh", response_model=TokenPair)
-def auth_refresh(body: RefreshIn, db: session = Depends(get_db)):
-    return rotate_refresh(db, body.refresh_token)
+async def auth_refresh(body: RefreshIn, db: AsyncSession = Depends(get_async_db)):
+    return await rotate_refresh(db, body.refresh_token)
 
 @app.post("/auth/logout", status_code=204)
-def auth_logout(body: LogoutIn, db: session = Depends(get_db)):
-    revoke_this_device(db, body.refresh_token)
+async def auth_logout(body: LogoutIn, db: AsyncSession = Depends(get_async_db)):
+    await revoke_this_device(db, body.refresh_token)
     return
 
 @app.post("/auth/logout-all", status_code=204)
-def auth_logout_all(current_user: "User" = Depends(get_current_user), db: session = Depends(get_db)):
-    revoke_all_devices(db, current_user)
+async def auth_logout_all(current_user: "User" = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    await revoke_all_devices(db, current_user)
     return
 
 @app.get("/me")
-def me(current_user: "User" = Depends(get_current_user)):
+async def me(current_user: "User" = Depends(get_current_user)):
     return {"id": current_user.id, "email": current_user.email, "full_name": current_user.full_name}
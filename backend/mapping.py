@@ -0,0 +1,74 @@
+from typing import Iterable, Optional
+
+from .models import EstimateItem, EstimateSection, ItemType
+
+# Imported data -> estimate sections.
+#
+# One pass over the items (in sort_order, then import order) builds hash
+# indexes: parent -> children and section -> top-level items. A second pass
+# emits each section depth-first so children follow their parent. Both are
+# linear; nothing scans the item list per item. The initial sort is stable
+# and items normally come back from the database already ordered, so it
+# costs a single comparison run.
+#
+# Grouping: a top-level item belongs to the section named by the first
+# `segments` parts of its section_code ("03-30-00" -> "03-00-00" at one
+# segment). Items with a parent always join their parent's section so the
+# hierarchy stays intact; top-level items without a code stay with the item
+# before them (level-based nesting), or go to "Unassigned" if none precedes.
+
+UNASSIGNED = "UNASSIGNED"
+
+
+def section_key(code: Optional[str], segments: int = 1) -> Optional[str]:
+    if not code or not code.strip():
+        return None
+    parts = code.strip().split("-")
+    return "-".join(parts[:segments] + ["0" * len(part) for part in parts[segments:]])
+
+
+def build_sections(items: Iterable[EstimateItem], segments: int = 1) -> list[EstimateSection]:
+    """Group, order and nest imported items into estimate sections"""
+    ordered = sorted(items, key=lambda item: item.sort_order)
+    by_id = {item.id: item for item in ordered if item.id}
+
+    children: dict = {}
+    roots: dict = {}
+    titles: dict = {}
+    current = None
+    for item in ordered:
+        parent = by_id.get(item.parent_id) if item.parent_id else None
+        if parent is None or parent is item:
+            if item.parent_id is not None:
+                item.parent_id = None
+            current = section_key(item.section_code, segments) or current
+            roots.setdefault(current, []).append(item)
+        else:
+            children.setdefault(id(parent), []).append(item)
+        if item.item_type == ItemType.SECTION_HEADER and item.section_code:
+            titles.setdefault(section_key(item.section_code, segments), item.description)
+
+    sections = []
+    for key in sorted(roots, key=lambda k: (k is None, k or "")):
+        section_items = []
+        stack = [(item, item.level or 0) for item in reversed(roots[key])]
+        while stack:
+            item, level = stack.pop()
+            # Model setattr is the expensive part here; skip it when unchanged.
+            if item.level != level:
+                item.level = level
+            section_items.append(item)
+            stack.extend((child, level + 1) for child in reversed(children.pop(id(item), ())))
+        sections.append(EstimateSection(
+            section_code=key or UNASSIGNED,
+            title=titles.get(key) or ("Unassigned" if key is None else key),
+            items=section_items,
+        ))
+
+    # Whatever is left hangs off a parent cycle; keep it, unparented.
+    leftovers = [item for group in children.values() for item in group]
+    if leftovers:
+        for item in leftovers:
+            item.parent_id = None
+        sections.append(EstimateSection(section_code=UNASSIGNED, title="Unassigned", items=leftovers))
+    return sections
@@ -0,0 +1,249 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .settings import settings
+
+# Request and query instrumentation, served in Prometheus text format.
+#
+# MetricsMiddleware times every HTTP request and records, per method and
+# route template, latency, response size (as sent, after compression), and
+# the number of SQL statements and the database time the request caused.
+# Queries are counted with engine-level cursor events on every engine; the
+# request they belong to is found through a context variable, which follows
+# the request into threadpool routes and AsyncSession.run_sync. A route whose
+# query histogram sits in the high buckets is loading rows one at a time.
+# Statements run outside any request (background jobs, the reaper) are
+# counted separately.
+#
+# The per-request cost is a dict lookup and a few list increments at the end
+# of the request, plus two clock reads per query. Observations happen on the
+# event loop thread only, so the HTTP side needs no lock.
+#
+# The endpoints expose routes, traffic and pool state, so they answer only
+# requests carrying Authorization: Bearer <METRICS_TOKEN> (Prometheus sends
+# it with `authorization: {credentials: ...}` in the scrape config).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_UNMATCHED = "<unmatched>"
+
+
+class Histogram:
+    """Fixed-bucket histogram; bucket i counts values <= bounds[i], the last one the rest"""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _RouteMetrics:
+    __slots__ = ("statuses", "latency", "size", "queries", "db_seconds")
+
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = Histogram(DB_TIME_BUCKETS)
+
+
+class _QueryStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+class HttpMetrics:
+    def __init__(self):
+        self.routes: dict[tuple[str, str], _RouteMetrics] = {}
+        self.in_flight = 0
+        # Totals for queries run inside requests, and for everything else.
+        self.request_queries = _QueryStats()
+        self._background_lock = threading.Lock()
+        self.background_queries = _QueryStats()
+
+    def observe(self, method: str, route: str, status: int, seconds: float, size: int, queries: _QueryStats) -> None:
+        entry = self.routes.get((method, route))
+        if entry is None:
+            entry = self.routes[(method, route)] = _RouteMetrics()
+        entry.statuses[status] = entry.statuses.get(status, 0) + 1
+        entry.latency.observe(seconds)
+        entry.size.observe(size)
+        entry.queries.observe(queries.queries)
+        entry.db_seconds.observe(queries.seconds)
+        self.request_queries.queries += queries.queries
+        self.request_queries.seconds += queries.seconds
+
+    def background(self, seconds: float) -> None:
+        with self._background_lock:
+            self.background_queries.queries += 1
+            self.background_queries.seconds += seconds
+
+
+http = HttpMetrics()
+_request_queries: ContextVar[Optional[_QueryStats]] = ContextVar("request_queries", default=None)
+
+
+#SQL events
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _request_queries.get()
+    if stats is None:
+        http.background(elapsed)
+    else:
+        stats.queries += 1
+        stats.seconds += elapsed
+
+
+#Middleware
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+        queries = _QueryStats()
+        token = _request_queries.set(queries)
+
+        async def send_counted(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        http.in_flight += 1
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            http.in_flight -= 1
+            _request_queries.reset(token)
+            # The router leaves the matched route in the scope; label by its
+            # template so /estimates/{estimate_id} is one series.
+            route = scope.get("route")
+            http.observe(
+                scope["method"], getattr(route, "path", _UNMATCHED), status, time.perf_counter() - started, size, queries
+            )
+
+
+#Exposition
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _histogram_lines(name: str, histogram: Histogram, labels: str) -> Iterable[str]:
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    cumulative += histogram.counts[-1]
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+    yield f"{name}_sum{{{labels}}} {histogram.sum!r}"
+    yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+_HISTOGRAMS = (
+    ("ceas_http_request_duration_seconds", "latency", "Time from request to last response byte"),
+    ("ceas_http_response_size_bytes", "size", "Response body bytes as sent"),
+    ("ceas_http_request_db_queries", "queries", "SQL statements executed per request"),
+    ("ceas_http_request_db_seconds", "db_seconds", "Time spent in SQL statements per request"),
+)
+
+
+# (metric, database.pool_stats() key, type, help)
+_POOL = (
+    ("ceas_db_pool_checked_out", "checked_out", "gauge", "Connections checked out"),
+    ("ceas_db_pool_overflow", "overflow", "gauge", "Connections beyond pool_size (negative until it fills)"),
+    ("ceas_db_pool_checkouts_total", "checkouts", "counter", "Connection checkouts"),
+    ("ceas_db_pool_timeouts_total", "timeouts", "counter", "Checkouts that timed out"),
+    ("ceas_db_pool_wait_seconds_total", "wait_seconds_total", "counter", "Time spent waiting for a connection"),
+)
+
+
+def render(pools: dict) -> str:
+    """All metrics in Prometheus text format; `pools` maps engine name to database.pool_stats()"""
+    routes = sorted(http.routes.items())
+    lines = [
+        "# HELP ceas_http_requests_total Requests handled, by route and status",
+        "# TYPE ceas_http_requests_total counter",
+    ]
+    for (method, route), entry in routes:
+        for status, count in sorted(entry.statuses.items()):
+            lines.append(f"ceas_http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+    for name, attribute, help_text in _HISTOGRAMS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (method, route), entry in routes:
+            lines.extend(_histogram_lines(name, getattr(entry, attribute), _labels(method=method, route=route)))
+    lines += [
+        "# HELP ceas_http_requests_in_flight Requests being handled now",
+        "# TYPE ceas_http_requests_in_flight gauge",
+        f"ceas_http_requests_in_flight {http.in_flight}",
+        "# HELP ceas_db_queries_total SQL statements executed, inside requests or not",
+        "# TYPE ceas_db_queries_total counter",
+        f'ceas_db_queries_total{{source="request"}} {http.request_queries.queries}',
+        f'ceas_db_queries_total{{source="background"}} {http.background_queries.queries}',
+        "# HELP ceas_db_seconds_total Time spent in SQL statements",
+        "# TYPE ceas_db_seconds_total counter",
+        f'ceas_db_seconds_total{{source="request"}} {http.request_queries.seconds!r}',
+        f'ceas_db_seconds_total{{source="background"}} {http.background_queries.seconds!r}',
+    ]
+    for name, key, kind, help_text in _POOL:
+        samples = [(engine, stats[key]) for engine, stats in sorted(pools.items()) if key in stats]
+        if samples:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{{{_labels(engine=engine)}}} {value}" for engine, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+#Access
+
+def require_token(authorization: Optional[str] = Header(None)) -> None:
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise HTTPException(status_code=404, detail="Metrics are disabled; set METRICS_TOKEN")
+    scheme, _, value = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(value.strip().encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
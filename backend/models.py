@@ -1,8 +1,8 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import String, Integer, DateTime, func, ForeignKey
+from sqlalchemy import String, Integer, DateTime, func, ForeignKey, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -48,6 +48,49 @@ class EstimateSection(BaseModel):
     subtotal_labor: Optional[float] = None
     subtotal_total: Optional[float] = None
 
+class EstimateItemPatch(BaseModel):
+    """Partial item update; only the fields sent are changed"""
+    description: Optional[str] = None
+    quantity: Optional[float] = None
+    unit: Optional[UnitType] = None
+    material_unit_cost: Optional[float] = None
+    material_amount: Optional[float] = None
+    labor_unit_cost: Optional[float] = None
+    labor_amount: Optional[float] = None
+    total_unit_cost: Optional[float] = None
+    total_amount: Optional[float] = None
+    item_type: Optional[ItemType] = None
+    section_code: Optional[str] = None
+    parent_id: Optional[str] = None
+    level: Optional[int] = None
+    sort_order: Optional[int] = None
+
+class EstimateSectionPatch(BaseModel):
+    """Partial section update; subtotals are derived and cannot be set"""
+    section_code: Optional[str] = None
+    title: Optional[str] = None
+
+class ReorderRequest(BaseModel):
+    """Complete list of sibling ids in their new order"""
+    ids: List[str]
+
+class LiveEdit(BaseModel):
+    """One edit sent over an estimate's live channel.
+
+    `data` is the body of the matching REST call (EstimateItem, EstimateItemPatch,
+    EstimateSection, EstimateSectionPatch or ReorderRequest). base_version is
+    the last estimate version the client had applied when making the edit.
+    """
+    ref: Optional[str] = None  # echoed back in the ack or error
+    op: Literal[
+        "add_item", "update_item", "delete_item", "reorder_items",
+        "add_section", "update_section", "delete_section", "reorder_sections",
+    ]
+    base_version: int
+    section_id: Optional[str] = None
+    item_id: Optional[str] = None
+    data: Dict[str, Any] = {}
+
 class EstimateTemplate(BaseModel):
     id: Optional[str] = None
     name: str
@@ -73,6 +116,33 @@ class Estimate(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     status: str = "draft"  # draft, approved, sent
+    version: Optional[int] = None  # latest revision; read-only
+
+class EstimateSummary(BaseModel):
+    """Listing projection: estimate columns only, no sections or items"""
+    id: str
+    project_name: str
+    project_location: str
+    client_name: str
+    estimate_date: datetime
+    prepared_by: str
+    template_id: Optional[str] = None
+    total_material: Optional[float] = None
+    total_labor: Optional[float] = None
+    total_amount: Optional[float] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    status: str = "draft"
+
+class TemplateSummary(BaseModel):
+    """Listing projection: template columns only, no sections"""
+    id: str
+    name: str
+    description: str
+    project_type: str
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    is_active: bool = True
 
 class EstimateData(BaseModel):
     """Raw data that can be imported/exported"""
@@ -80,6 +150,30 @@ class EstimateData(BaseModel):
     items: List[EstimateItem]
     metadata: Dict[str, Any] = {}
 
+class UnitCostOverride(BaseModel):
+    """New unit costs for the line items matched by every criterion that is set.
+
+    description_pattern is a case-insensitive SQL LIKE pattern ("%drywall%").
+    Costs left unset are kept.
+    """
+    section_code: Optional[str] = None
+    unit: Optional[UnitType] = None
+    description_pattern: Optional[str] = None
+    material_unit_cost: Optional[float] = None
+    labor_unit_cost: Optional[float] = None
+    total_unit_cost: Optional[float] = None
+
+class RecalculationRequest(BaseModel):
+    """Overrides apply in order (later ones win) to the estimates matching the filters"""
+    overrides: List[UnitCostOverride]
+    estimate_ids: Optional[List[str]] = None
+    status: Optional[str] = None
+    client_name: Optional[str] = None
+    template_id: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    dry_run: bool = False
+
 class ExcelExportRequest(BaseModel):
     estimate_id: str
     format_options: Dict[str, Any] = {}
@@ -103,7 +197,7 @@ class RefreshToken(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     # Non-secret identifier (lets us look up the row fast)
     jti: Mapped[str] = mapped_column(String(50), unique=True, index=True, nullable=False)
-    # Bcrypt hash of the secret piece. We never store raw refresh token values.
+    # HMAC-SHA256 of the secret piece (sha256_crypt on older rows). We never store raw refresh token values.
     token_hash: Mapped[str] = mapped_column(String(128), nullable=False)
     # FK back to the user who owns this token.
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
@@ -114,3 +208,16 @@ class RefreshToken(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     revoked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    __table_args__ = (
+        # Live tokens only: what revoke-all and rotation touch, kept small as the table grows.
+        Index(
+            "ix_refresh_tokens_live_user_id", "user_id", "expires_at",
+            postgresql_where=text("revoked_at IS NULL"), sqlite_where=text("revoked_at IS NULL"),
+        ),
+        # Let the reaper find dead rows without a full scan.
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+        Index(
+            "ix_refresh_tokens_revoked_at", "revoked_at",
+            postgresql_where=text("revoked_at IS NOT NULL"), sqlite_where=text("revoked_at IS NOT NULL"),
+        ),
+    )
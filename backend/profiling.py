@@ -0,0 +1,250 @@
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .settings import settings
+
+# Request profiling (opt-in).
+#
+# A request is profiled when it carries X-Profile-Token: <PROFILE_ADMIN_TOKEN>,
+# or, with PROFILE_SLOW_REQUEST_MS set, always, keeping the profile only if
+# the request turned out slower than that. While a request is profiled, one
+# shared sampler thread records the request's stacks every
+# PROFILE_INTERVAL_MS, and every SQL statement it runs is logged with its
+# timing. The last PROFILE_KEEP profiles stay in memory for
+# /api/v1/admin/profiles; stacks come out in folded form ("a;b;c 12"),
+# which flamegraph.pl, inferno and speedscope all read.
+#
+# Which stacks belong to the request: on the event loop thread, those taken
+# while the request's own task is running (run_sync code included, since it
+# runs in that task); a worker thread joins the profile when it runs the
+# request's first SQL statement, so threadpool routes are sampled from then on.
+#
+# With neither setting configured the middleware and SQL hooks are not
+# installed at all, so there is no cost.
+
+ADMIN_PREFIX = "/api/v1/admin/profiles"
+_HEADER = b"x-profile-token"
+_MAX_DEPTH = 128
+_MAX_STATEMENTS = 1000
+
+_active: ContextVar[Optional["Profile"]] = ContextVar("active_profile", default=None)
+
+
+def enabled() -> bool:
+    return bool(settings.PROFILE_ADMIN_TOKEN) or settings.PROFILE_SLOW_REQUEST_MS > 0
+
+
+def _frame_name(code) -> str:
+    # Last two path parts tell fastapi/routing.py from starlette/routing.py.
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self, scope: Scope, trigger: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.trigger = trigger
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.loop_thread = threading.get_ident()
+        self.threads = {self.loop_thread}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.statements: list[dict] = []
+        self.statements_dropped = 0
+        self.route: Optional[str] = None
+        self.status = 500
+        self.duration_ms = 0.0
+
+    def sample(self, frames: dict) -> None:
+        for thread in list(self.threads):
+            frame = frames.get(thread)
+            if frame is None:
+                continue
+            if thread == self.loop_thread and asyncio.current_task(self.loop) is not self.task:
+                continue
+            names = []
+            while frame is not None and len(names) < _MAX_DEPTH:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            label = "loop" if thread == self.loop_thread else f"thread-{thread}"
+            self.stacks[";".join([label, *reversed(names)])] += 1
+        self.samples += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "samples": self.samples,
+            "interval_ms": settings.PROFILE_INTERVAL_MS,
+            "statements": len(self.statements) + self.statements_dropped,
+            "db_ms": round(sum(statement["ms"] for statement in self.statements), 3),
+        }
+
+    def folded(self) -> str:
+        # Copy first: a sample may still be landing from the sampler thread.
+        return "".join(f"{stack} {count}\n" for stack, count in Counter(self.stacks).most_common())
+
+
+class _Sampler:
+    """One daemon thread that samples every running profile"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: set[Profile] = set()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._running.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile: Profile) -> None:
+        with self._lock:
+            self._running.discard(profile)
+
+    def _run(self) -> None:
+        interval = max(settings.PROFILE_INTERVAL_MS, 1) / 1000
+        while True:
+            with self._lock:
+                running = list(self._running)
+                if not running:
+                    self._wake.clear()
+            if not running:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in running:
+                profile.sample(frames)
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+_lock = threading.Lock()
+_kept: deque = deque(maxlen=max(settings.PROFILE_KEEP, 1))
+
+
+#SQL statements
+
+def _statement_started(conn, cursor, statement, parameters, context, executemany) -> None:
+    profile = _active.get()
+    if profile is not None:
+        profile.threads.add(threading.get_ident())
+        context._profile_started = time.perf_counter()
+
+
+def _statement_finished(conn, cursor, statement, parameters, context, executemany) -> None:
+    profile = _active.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is None or started is None:
+        return
+    if len(profile.statements) >= _MAX_STATEMENTS:
+        profile.statements_dropped += 1
+        return
+    # Statement text only: parameters can hold tokens and personal data.
+    profile.statements.append({
+        "at_ms": round((started - profile.started) * 1000, 3),
+        "ms": round((time.perf_counter() - started) * 1000, 3),
+        "sql": statement,
+        "executemany": executemany,
+    })
+
+
+def install() -> None:
+    event.listen(Engine, "before_cursor_execute", _statement_started)
+    event.listen(Engine, "after_cursor_execute", _statement_finished)
+
+
+#Middleware
+
+def _token_matches(value: Optional[str]) -> bool:
+    token = settings.PROFILE_ADMIN_TOKEN
+    return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.slow_ms = settings.PROFILE_SLOW_REQUEST_MS
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        header = next((value for name, value in scope["headers"] if name == _HEADER), None)
+        forced = header is not None and _token_matches(header.decode("latin-1"))
+        if not forced and self.slow_ms <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope, "header" if forced else "slow")
+
+        async def send_observed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        token = _active.set(profile)
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            _sampler.remove(profile)
+            _active.reset(token)
+            profile.duration_ms = (time.perf_counter() - profile.started) * 1000
+            profile.route = getattr(scope.get("route"), "path", None)
+            if forced or profile.duration_ms >= self.slow_ms:
+                with _lock:
+                    _kept.append(profile)
+
+
+#Admin
+
+def require_admin(x_profile_token: Optional[str] = Header(None)) -> None:
+    if not settings.PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling admin is disabled; set PROFILE_ADMIN_TOKEN")
+    if not _token_matches(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+def list_profiles() -> list[dict]:
+    """Kept profiles, newest first"""
+    with _lock:
+        return [profile.summary() for profile in reversed(_kept)]
+
+
+def get_profile(profile_id: str) -> Profile:
+    with _lock:
+        for profile in _kept:
+            if profile.id == profile_id:
+                return profile
+    raise HTTPException(status_code=404, detail="Profile not found")
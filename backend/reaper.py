@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import AsyncSessionLocal
+from .models import RefreshToken
+from .settings import settings
+
+# Refresh token reaper.
+#
+# Every rotation revokes one row and inserts another, so refresh_tokens only
+# ever grows. This task runs inside each worker and deletes rows that have
+# been expired or revoked for longer than REFRESH_TOKEN_RETENTION_HOURS. A
+# rotation chain is just rows linked by parent_jti, and every link but the
+# newest is revoked, so whole chains go once their last token dies. Deletes
+# run in batches of REFRESH_TOKEN_REAP_BATCH_SIZE, each its own transaction,
+# to keep locks short. Running it in several workers at once is harmless.
+#
+# On Postgres the table can instead be range-partitioned by expires_at (see
+# the refresh_token_partitioning migration); the reaper then also keeps
+# future monthly partitions ready and drops whole months once they are past
+# retention, which costs nothing compared with deleting their rows.
+
+logger = logging.getLogger(__name__)
+
+TABLE = RefreshToken.__tablename__
+
+
+class ReaperMetrics:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.rows_reaped = 0
+        self.partitions_dropped = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_seconds: Optional[float] = None
+        self.last_run_rows = 0
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "rows_reaped": self.rows_reaped,
+            "partitions_dropped": self.partitions_dropped,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": round(self.last_run_seconds, 4) if self.last_run_seconds is not None else None,
+            "last_run_rows": self.last_run_rows,
+            "last_error": self.last_error,
+        }
+
+
+metrics = ReaperMetrics()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+#Rows
+
+async def reap_rows(db: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    """Delete rows expired or revoked before `cutoff`, one batch per commit"""
+    dead = or_(RefreshToken.expires_at < cutoff, RefreshToken.revoked_at < cutoff)
+    total = 0
+    while True:
+        batch = select(RefreshToken.id).where(dead).limit(batch_size).scalar_subquery()
+        result = await db.execute(
+            delete(RefreshToken).where(RefreshToken.id.in_(batch)),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+        # Let rotations queued behind this batch through before the next one.
+        await asyncio.sleep(0)
+
+
+#Partitions (Postgres)
+
+def _month(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def _next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+async def is_partitioned(db: AsyncSession) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return False
+    return bool((await db.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": TABLE},
+    )).scalar())
+
+
+async def _partitions(db: AsyncSession) -> list[str]:
+    return list((await db.execute(
+        text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"),
+        {"table": TABLE},
+    )).scalars())
+
+
+async def ensure_partitions(db: AsyncSession, months_ahead: int) -> int:
+    """Create monthly partitions from this month through `months_ahead`; returns how many were new"""
+    existing = set(await _partitions(db))
+    month = _month(_now())
+    created = 0
+    for _ in range(months_ahead + 1):
+        name = partition_name(month)
+        upper = _next_month(month)
+        if name not in existing:
+            await db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+            ))
+            created += 1
+        month = upper
+    await db.commit()
+    return created
+
+
+async def drop_partitions(db: AsyncSession, cutoff: datetime) -> int:
+    """Drop monthly partitions whose whole range expired before `cutoff`"""
+    dropped = 0
+    prefix = f"{TABLE}_p"
+    for name in await _partitions(db):
+        suffix = name[len(prefix):]
+        if not name.startswith(prefix) or not suffix.isdigit() or len(suffix) != 6:
+            continue  # the default partition, or one created by hand
+        month = datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=timezone.utc)
+        if _next_month(month) <= cutoff:
+            await db.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+            await db.execute(text(f"DROP TABLE {name}"))
+            await db.commit()
+            dropped += 1
+    return dropped
+
+
+#Table size
+
+async def table_stats(db: AsyncSession) -> dict:
+    now = _now()
+    live = (await db.execute(
+        select(func.count()).select_from(RefreshToken)
+        .where(RefreshToken.revoked_at.is_(None), RefreshToken.expires_at > now)
+    )).scalar()
+    stats = {"live_rows": live}
+    if db.bind.dialect.name == "postgresql":
+        # Planner estimates; exact counts on a big table cost a full scan.
+        rows, size = (await db.execute(text(
+            "SELECT coalesce(sum(c.reltuples), 0)::bigint, coalesce(sum(pg_total_relation_size(c.oid)), 0)::bigint "
+            "FROM pg_partition_tree(to_regclass(:table)) t JOIN pg_class c ON c.oid = t.relid"
+        ), {"table": TABLE})).one()
+        stats.update(rows=rows, total_bytes=size, partitioned=await is_partitioned(db))
+    else:
+        stats.update(rows=(await db.execute(select(func.count()).select_from(RefreshToken))).scalar(),
+                     total_bytes=None, partitioned=False)
+    return stats
+
+
+#Scheduling
+
+async def run_once() -> int:
+    """One reaper pass; failures are logged and counted, never raised"""
+    started = time.perf_counter()
+    cutoff = _now() - timedelta(hours=settings.REFRESH_TOKEN_RETENTION_HOURS)
+    rows = 0
+    try:
+        async with AsyncSessionLocal() as db:
+            if await is_partitioned(db):
+                await ensure_partitions(db, settings.REFRESH_TOKEN_PARTITIONS_AHEAD)
+                metrics.partitions_dropped += await drop_partitions(db, cutoff)
+            rows = await reap_rows(db, cutoff, settings.REFRESH_TOKEN_REAP_BATCH_SIZE)
+        metrics.last_error = None
+    except Exception as exc:
+        metrics.failures += 1
+        metrics.last_error = repr(exc)
+        logger.exception("refresh token reaper failed")
+    metrics.runs += 1
+    metrics.rows_reaped += rows
+    metrics.last_run_rows = rows
+    metrics.last_run_at = _now()
+    metrics.last_run_seconds = time.perf_counter() - started
+    return rows
+
+
+async def _loop(interval: float) -> None:
+    # Stagger workers started together so they don't all reap at once.
+    await asyncio.sleep(random.uniform(0, min(interval, 60)))
+    while True:
+        await run_once()
+        await asyncio.sleep(interval)
+
+
+def start() -> Optional[asyncio.Task]:
+    """Schedule the reaper on the running loop, unless disabled"""
+    interval = settings.REFRESH_TOKEN_REAP_INTERVAL_SECONDS
+    if interval <= 0:
+        return None
+    return asyncio.create_task(_loop(interval), name="refresh-token-reaper")
+
+
+async def stop(task: Optional[asyncio.Task]) -> None:
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
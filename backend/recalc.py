@@ -0,0 +1,344 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import analytics, repository, revisions
+from .database import EstimateDB, EstimateItemDB, EstimateSectionDB, RecalculationJobDB, SessionLocal, utcnow
+from .models import ItemType, RecalculationRequest, UnitCostOverride
+from .settings import settings
+
+# Bulk re-pricing.
+#
+# A job applies unit-cost overrides to every line item they match across a
+# filtered set of estimates. Estimates are split into chunks of
+# RECALC_CHUNK_SIZE and each chunk is one transaction on the worker pool:
+#   1. one UPDATE per override sets the new unit costs (later overrides win);
+#   2. one UPDATE re-derives amounts from the costs, by the rollup rules;
+#   3. one UPDATE each re-sums the touched sections' subtotals and the
+#      touched estimates' totals from their line items;
+#   4. touched sections that have SUBTOTAL rows are rolled up again and
+#      those rows rewritten (repository.refresh_subtotal_rows).
+# Python only compares the matched rows before and after, to record a
+# revision and move the analytics counts for each estimate that changed.
+#
+# A dry run does the same work and rolls every chunk back, so its deltas
+# are exactly what a real run would produce. Chunks commit independently:
+# a failed chunk leaves the others applied and lists its estimates in the
+# job result, so the job can be re-run for just those.
+
+_pool = ThreadPoolExecutor(max_workers=settings.RECALC_WORKERS, thread_name_prefix="recalc")
+
+_COSTS = ("material_unit_cost", "labor_unit_cost", "total_unit_cost")
+_AMOUNTS = ("material_amount", "labor_amount", "total_amount")
+_SUBTOTALS = ("subtotal_material", "subtotal_labor", "subtotal_total")
+_TOTALS = ("total_material", "total_labor", "total_amount")
+# Read before and after a chunk: what the revision delta and analytics need.
+_ITEM_COLUMNS = ("id", "estimate_id", "section_id", "item_type", "section_code", "unit", *_COSTS, *_AMOUNTS)
+_ID_COLUMNS = ("id", "estimate_id", "section_id")
+_NO_SYNC = {"synchronize_session": False}
+
+#SQL
+
+def _matches(override: UnitCostOverride):
+    conditions = []
+    if override.section_code is not None:
+        conditions.append(EstimateItemDB.section_code == override.section_code)
+    if override.unit is not None:
+        conditions.append(EstimateItemDB.unit == override.unit)
+    if override.description_pattern:
+        conditions.append(EstimateItemDB.description.ilike(override.description_pattern))
+    return and_(*conditions)
+
+def _cost(override: UnitCostOverride, name: str):
+    value = getattr(override, name)
+    return getattr(EstimateItemDB, name) if value is None else literal(value)
+
+def _cost_values(override: UnitCostOverride) -> dict:
+    values = {name: getattr(override, name) for name in _COSTS if getattr(override, name) is not None}
+    if override.total_unit_cost is None:
+        # A total unit cost that is just material + labor follows them;
+        # one entered on its own is kept.
+        split = func.coalesce(EstimateItemDB.material_unit_cost, 0.0) + func.coalesce(EstimateItemDB.labor_unit_cost, 0.0)
+        derived = or_(EstimateItemDB.total_unit_cost.is_(None), func.abs(EstimateItemDB.total_unit_cost - split) < 1e-9)
+        values["total_unit_cost"] = case(
+            (derived, func.coalesce(_cost(override, "material_unit_cost"), 0.0)
+                      + func.coalesce(_cost(override, "labor_unit_cost"), 0.0)),
+            else_=EstimateItemDB.total_unit_cost,
+        )
+    return values
+
+def _amount_values() -> dict:
+    # rollup.item_amounts, as SQL over the row's current costs.
+    quantity = EstimateItemDB.quantity
+
+    def product(cost, amount):
+        return case((and_(quantity.isnot(None), cost.isnot(None)), quantity * cost), else_=amount)
+
+    material = product(EstimateItemDB.material_unit_cost, EstimateItemDB.material_amount)
+    labor = product(EstimateItemDB.labor_unit_cost, EstimateItemDB.labor_amount)
+    total = case(
+        (and_(quantity.isnot(None), EstimateItemDB.total_unit_cost.isnot(None)), quantity * EstimateItemDB.total_unit_cost),
+        (or_(material.isnot(None), labor.isnot(None)), func.coalesce(material, 0.0) + func.coalesce(labor, 0.0)),
+        else_=EstimateItemDB.total_amount,
+    )
+    return {"material_amount": material, "labor_amount": labor, "total_amount": total}
+
+def _line_sum(name: str, owner):
+    return (
+        select(func.coalesce(func.sum(getattr(EstimateItemDB, name)), 0.0))
+        .where(owner, EstimateItemDB.item_type == ItemType.LINE_ITEM)
+        .scalar_subquery()
+    )
+
+def reprice(db: Session, estimate_ids: list[uuid.UUID], overrides: list[UnitCostOverride], *, record: bool = True) -> list[dict]:
+    """Apply `overrides` to the given estimates in the caller's transaction.
+
+    Returns one entry per estimate that changed, with its item count and
+    total deltas. With record=False no revisions or analytics are written
+    (for dry runs that roll back anyway).
+    """
+    in_chunk = and_(EstimateItemDB.estimate_id.in_(estimate_ids), EstimateItemDB.item_type == ItemType.LINE_ITEM)
+    # The overrides never change the columns they match on, so this selects
+    # the same rows before and after.
+    matched = and_(in_chunk, or_(*(_matches(override) for override in overrides)))
+    # Ids as text: only the few distinct estimate and section ids become UUIDs.
+    columns = [
+        repository.uuid_text(getattr(EstimateItemDB, name)).label(name) if name in _ID_COLUMNS else getattr(EstimateItemDB, name)
+        for name in _ITEM_COLUMNS
+    ]
+    before = {row.id: row for row in db.execute(select(*columns).where(matched)).all()}
+    if not before:
+        return []
+
+    for override in overrides:
+        db.execute(
+            update(EstimateItemDB).where(in_chunk, _matches(override)).values(**_cost_values(override)),
+            execution_options=_NO_SYNC,
+        )
+    db.execute(update(EstimateItemDB).where(matched).values(**_amount_values()), execution_options=_NO_SYNC)
+
+    changed: dict = {}
+    for row in db.execute(select(*columns).where(matched)).all():
+        old = before[row.id]
+        if tuple(old) != tuple(row):
+            changed.setdefault(uuid.UUID(row.estimate_id), []).append((old, row))
+    if not changed:
+        return []
+
+    old_totals = {
+        row.id: row for row in db.execute(select(EstimateDB.id, *(getattr(EstimateDB, name) for name in _TOTALS))
+                                          .where(EstimateDB.id.in_(list(changed)))).all()
+    }
+    section_ids = {uuid.UUID(section) for section in {new.section_id for pairs in changed.values() for _, new in pairs} if section}
+    sections = db.execute(
+        update(EstimateSectionDB)
+        .where(EstimateSectionDB.id.in_(section_ids))
+        .values(**{
+            subtotal: _line_sum(amount, EstimateItemDB.section_id == EstimateSectionDB.id)
+            for subtotal, amount in zip(_SUBTOTALS, _AMOUNTS)
+        })
+        .returning(EstimateSectionDB.id, EstimateSectionDB.estimate_id, *(getattr(EstimateSectionDB, name) for name in _SUBTOTALS)),
+        execution_options=_NO_SYNC,
+    ).all()
+    totals = db.execute(
+        update(EstimateDB)
+        .where(EstimateDB.id.in_(list(changed)))
+        .values(
+            updated_at=utcnow(),
+            **{total: _line_sum(amount, EstimateItemDB.estimate_id == EstimateDB.id) for total, amount in zip(_TOTALS, _AMOUNTS)},
+        )
+        .returning(EstimateDB.id, *(getattr(EstimateDB, name) for name in _TOTALS)),
+        execution_options=_NO_SYNC,
+    ).all()
+    sections_of: dict = {}
+    for section in sections:
+        sections_of.setdefault(section.estimate_id, []).append(section.id)
+
+    results = []
+    for row in totals:
+        pairs = changed[row.id]
+        subtotal_items = repository.refresh_subtotal_rows(db, sections_of.get(row.id, []))
+        if record:
+            revisions.record(db, row.id, {
+                "estimate": {name: getattr(row, name) for name in _TOTALS},
+                "sections": {
+                    str(section.id): {name: getattr(section, name) for name in _SUBTOTALS}
+                    for section in sections if section.estimate_id == row.id
+                },
+                "items": {
+                    **{
+                        new.id: {name: getattr(new, name) for name in _COSTS + _AMOUNTS if getattr(old, name) != getattr(new, name)}
+                        for old, new in pairs
+                    },
+                    **subtotal_items,
+                },
+            })
+            analytics.track_items(db, row.id, before=[old for old, _ in pairs], after=[new for _, new in pairs])
+        old = old_totals[row.id]
+        results.append({
+            "estimate_id": str(row.id),
+            "items_changed": len(pairs),
+            **{name: round(getattr(row, name) - (getattr(old, name) or 0.0), 6) for name in _TOTALS},
+        })
+    return results
+
+#Jobs
+
+# SQLite has a single writer, and a transaction that reads before it writes
+# fails outright (not after busy_timeout) if another writer got in first.
+# Chunks take turns there; on Postgres they run side by side.
+_sqlite_writer = threading.Lock()
+
+def _run_chunk(overrides: list[UnitCostOverride], estimate_ids: list[uuid.UUID], dry_run: bool) -> list[dict]:
+    db = SessionLocal()
+    try:
+        with _sqlite_writer if db.bind.dialect.name == "sqlite" else nullcontext():
+            try:
+                results = reprice(db, estimate_ids, overrides, record=not dry_run)
+            except Exception:
+                db.rollback()
+                raise
+            if dry_run:
+                db.rollback()
+            else:
+                db.commit()
+        return results
+    finally:
+        db.close()
+
+def _summary(estimates: list[dict], failed: list[str]) -> dict:
+    return {
+        "totals": {name: round(sum(entry[name] for entry in estimates), 6) for name in _TOTALS},
+        "estimates": sorted(estimates, key=lambda entry: entry["estimate_id"]),
+        "failed_estimates": failed,
+    }
+
+def _run_job(job_id: uuid.UUID) -> None:
+    # Coordinator: hands chunks to the pool and is the only writer of the
+    # job row, so progress updates never race.
+    db = SessionLocal()
+    try:
+        job = db.get(RecalculationJobDB, job_id)
+        request = RecalculationRequest(**job.options["request"])
+        estimate_ids = [uuid.UUID(value) for value in job.options["estimates"]]
+        job.status = "running"
+        db.commit()
+        size = max(settings.RECALC_CHUNK_SIZE, 1)
+        futures = {
+            _pool.submit(_run_chunk, request.overrides, estimate_ids[start:start + size], job.dry_run): estimate_ids[start:start + size]
+            for start in range(0, len(estimate_ids), size)
+        }
+        estimates, failed, errors = [], [], []
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                estimates.extend(future.result())
+            except Exception as exc:
+                failed.extend(str(value) for value in chunk)
+                errors.append(str(exc))
+            job.estimates_done += len(chunk)
+            job.items_changed = sum(entry["items_changed"] for entry in estimates)
+            job.result = _summary(estimates, failed)
+            db.commit()
+        job.status = "failed" if errors else "done"
+        job.error = "\n".join(errors)[:2000] or None
+        job.finished_at = utcnow()
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        job = db.get(RecalculationJobDB, job_id)
+        job.status = "failed"
+        job.error = str(exc)[:2000]
+        job.finished_at = utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def _validate(request: RecalculationRequest) -> None:
+    if not request.overrides:
+        raise HTTPException(status_code=400, detail="At least one override is required")
+    for number, override in enumerate(request.overrides, 1):
+        if override.section_code is None and override.unit is None and not override.description_pattern:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Override {number} matches nothing specific; set section_code, unit or description_pattern",
+            )
+        if all(getattr(override, name) is None for name in _COSTS):
+            raise HTTPException(status_code=400, detail=f"Override {number} sets no unit cost")
+
+def _estimate_ids(db: Session, request: RecalculationRequest) -> list[str]:
+    stmt = select(EstimateDB.id).where(*repository.estimate_filters(
+        status=request.status,
+        client_name=request.client_name,
+        template_id=request.template_id,
+        date_from=request.date_from,
+        date_to=request.date_to,
+    ))
+    if request.estimate_ids is not None:
+        try:
+            keys = [uuid.UUID(str(value)) for value in request.estimate_ids]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid estimate id")
+        stmt = stmt.where(EstimateDB.id.in_(keys))
+    return [str(value) for value in db.execute(stmt.order_by(EstimateDB.id)).scalars()]
+
+def submit(db: Session, request: RecalculationRequest) -> dict:
+    """Resolve the estimates and start the job; returns its id and size"""
+    _validate(request)
+    estimate_ids = _estimate_ids(db, request)
+    job = RecalculationJobDB(
+        options={"request": request.model_dump(mode="json"), "estimates": estimate_ids},
+        dry_run=request.dry_run,
+        estimates_total=len(estimate_ids),
+    )
+    db.add(job)
+    db.commit()
+    threading.Thread(target=_run_job, args=(job.id,), name=f"recalc-{job.id}", daemon=True).start()
+    return {"job_id": str(job.id), "status": "queued", "dry_run": job.dry_run, "estimates": len(estimate_ids)}
+
+def fail_stale_jobs(db: Session, job_id: Optional[uuid.UUID] = None) -> int:
+    """Mark queued or running jobs past RECALC_JOB_TIMEOUT_SECONDS failed; returns how many"""
+    now = utcnow()
+    stale = update(RecalculationJobDB).where(
+        RecalculationJobDB.status.in_(("queued", "running")),
+        RecalculationJobDB.created_at < now - timedelta(seconds=settings.RECALC_JOB_TIMEOUT_SECONDS),
+    )
+    if job_id is not None:
+        stale = stale.where(RecalculationJobDB.id == job_id)
+    result = db.execute(
+        stale.values(status="failed", error="Recalculation did not finish; its worker stopped", finished_at=now),
+        execution_options={"synchronize_session": False},
+    )
+    db.commit()
+    return result.rowcount
+
+def get_job(db: Session, job_id: str) -> dict:
+    try:
+        job = db.get(RecalculationJobDB, uuid.UUID(str(job_id)))
+    except ValueError:
+        job = None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Recalculation job not found")
+    if job.status in ("queued", "running") and fail_stale_jobs(db, job.id):
+        db.refresh(job)
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "dry_run": job.dry_run,
+        "progress": {
+            "estimates_done": job.estimates_done,
+            "estimates_total": job.estimates_total,
+            "items_changed": job.items_changed,
+        },
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
@@ -0,0 +1,1029 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import JSON, Float, String, Uuid, case, cast, delete, func, insert, literal, select, tuple_, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy.sql.functions import FunctionElement
+
+from . import analytics, revisions, rollup
+from .database import EstimateDB, EstimateDataDB, EstimateItemDB, EstimateSectionDB, EstimateTemplateDB, utcnow
+from .models import (
+    ItemType, Estimate, EstimateData, EstimateItem, EstimateSection, EstimateTemplate,
+    EstimateSummary, TemplateSummary, EstimateItemPatch, EstimateSectionPatch,
+)
+
+# Persistence for estimates, templates and imported data.
+#
+# Trees are written with one executemany INSERT per table inside the caller's
+# transaction and read back with selectinload, so loading an estimate costs
+# three queries (estimate, sections, items) no matter how many rows it has.
+
+_ITEM_COLUMNS = (
+    "description", "quantity", "unit", "material_unit_cost", "material_amount",
+    "labor_unit_cost", "labor_amount", "total_unit_cost", "total_amount",
+    "item_type", "section_code", "level", "sort_order",
+)
+
+#Ids
+
+def _parse_id(value: str, detail: str) -> uuid.UUID:
+    # Unknown and malformed ids are indistinguishable to the client.
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=404, detail=detail)
+
+def _client_id(value: Optional[str], taken: set) -> uuid.UUID:
+    # Keep a client-supplied id when it is a usable UUID; otherwise mint one.
+    try:
+        parsed = uuid.UUID(str(value)) if value else None
+    except ValueError:
+        parsed = None
+    if parsed is None or parsed in taken:
+        parsed = uuid.uuid4()
+    taken.add(parsed)
+    return parsed
+
+class random_uuid(FunctionElement):
+    """Server-side new row id, for INSERT ... SELECT copies"""
+    type = Uuid()
+    inherit_cache = True
+
+@compiles(random_uuid)
+def _random_uuid(element, compiler, **kw):
+    # Postgres 13+ has this built in.
+    return "gen_random_uuid()"
+
+@compiles(random_uuid, "sqlite")
+def _random_uuid_sqlite(element, compiler, **kw):
+    # Same 32-hex-digit form Uuid stores on SQLite.
+    return "lower(hex(randomblob(16)))"
+
+class uuid_text(FunctionElement):
+    """A UUID column as its canonical hyphenated string, formatted by the database"""
+    type = String()
+    inherit_cache = True
+
+@compiles(uuid_text)
+def _uuid_text(element, compiler, **kw):
+    return f"CAST({compiler.process(element.clauses, **kw)} AS TEXT)"
+
+@compiles(uuid_text, "sqlite")
+def _uuid_text_sqlite(element, compiler, **kw):
+    # Uuid stores 32 hex digits on SQLite; NULL stays NULL.
+    column = compiler.process(element.clauses, **kw)
+    return " || '-' || ".join(f"substr({column}, {start}, {length})" for start, length in ((1, 8), (9, 4), (13, 4), (17, 4), (21, 12)))
+
+#Keyset pagination
+
+def _encode_cursor(stamp: datetime, row_id: uuid.UUID) -> str:
+    raw = json.dumps([stamp.isoformat(), str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        stamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(stamp), uuid.UUID(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _page(db: Session, stmt, stamp_col, id_col, cursor: Optional[str], limit: int) -> tuple[list, Optional[str]]:
+    # Newest first on (stamp, id); the id breaks ties between rows saved in the
+    # same instant, so a page boundary never skips or repeats a row.
+    if cursor:
+        stmt = stmt.where(tuple_(stamp_col, id_col) < tuple_(*_decode_cursor(cursor)))
+    rows = db.execute(stmt.order_by(stamp_col.desc(), id_col.desc()).limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, _encode_cursor(getattr(last, stamp_col.key), getattr(last, id_col.key))
+
+#Tree writes
+
+def _parents_first(rows: list[dict]) -> list[dict]:
+    # Order rows so each parent is inserted before its children; the
+    # self-referencing FK on estimate_items is checked per batch.
+    by_id = {row["id"]: row for row in rows}
+    children: dict = {}
+    roots = []
+    for row in rows:
+        parent = row["parent_id"]
+        if parent is None or parent not in by_id or parent == row["id"]:
+            row["parent_id"] = None
+            roots.append(row)
+        else:
+            children.setdefault(parent, []).append(row)
+    ordered = []
+    stack = list(reversed(roots))
+    while stack:
+        row = stack.pop()
+        ordered.append(row)
+        stack.extend(reversed(children.pop(row["id"], ())))
+    # Whatever is left is part of a parent cycle; store those rows unparented.
+    for orphans in children.values():
+        for row in orphans:
+            row["parent_id"] = None
+            ordered.append(row)
+    return ordered
+
+def _item_rows(items: Iterable[EstimateItem], taken: set, keep_ids: bool, **owner) -> list[dict]:
+    rows = []
+    id_map = {}
+    for position, item in enumerate(items):
+        item_id = _client_id(item.id if keep_ids else None, taken)
+        if item.id:
+            id_map[item.id] = item_id
+        row = {column: getattr(item, column) for column in _ITEM_COLUMNS}
+        row.update(owner, id=item_id, position=position, parent_id=item.parent_id)
+        rows.append(row)
+    for row in rows:
+        row["parent_id"] = id_map.get(row["parent_id"]) if row["parent_id"] else None
+    return rows
+
+def _write_sections(
+    db: Session,
+    sections: list[EstimateSection],
+    *,
+    estimate_id: Optional[uuid.UUID] = None,
+    template_id: Optional[uuid.UUID] = None,
+    keep_ids: bool = False,
+) -> tuple[list[dict], list[dict]]:
+    taken: set = set()
+    section_rows = []
+    item_rows = []
+    for position, section in enumerate(sections):
+        section_id = _client_id(section.id if keep_ids else None, taken)
+        section_rows.append({
+            "id": section_id,
+            "section_code": section.section_code,
+            "title": section.title,
+            "subtotal_material": section.subtotal_material,
+            "subtotal_labor": section.subtotal_labor,
+            "subtotal_total": section.subtotal_total,
+            "position": position,
+            "estimate_id": estimate_id,
+            "template_id": template_id,
+        })
+        item_rows.extend(_item_rows(section.items, taken, keep_ids, section_id=section_id, estimate_id=estimate_id))
+    if section_rows:
+        db.execute(insert(EstimateSectionDB), section_rows)
+    if item_rows:
+        db.execute(insert(EstimateItemDB), _parents_first(item_rows))
+    return section_rows, item_rows
+
+def _delete_sections(db: Session, *, estimate_id: Optional[uuid.UUID] = None, template_id: Optional[uuid.UUID] = None) -> None:
+    owner = EstimateSectionDB.estimate_id == estimate_id if estimate_id else EstimateSectionDB.template_id == template_id
+    section_ids = select(EstimateSectionDB.id).where(owner).scalar_subquery()
+    # Drop the self-references first so the item delete never trips the parent FK.
+    no_sync = {"synchronize_session": False}
+    db.execute(
+        update(EstimateItemDB).where(EstimateItemDB.section_id.in_(section_ids)).values(parent_id=None),
+        execution_options=no_sync,
+    )
+    db.execute(delete(EstimateItemDB).where(EstimateItemDB.section_id.in_(section_ids)), execution_options=no_sync)
+    db.execute(delete(EstimateSectionDB).where(owner), execution_options=no_sync)
+
+def _take_sections(db: Session, estimate_id: uuid.UUID) -> tuple[dict, dict]:
+    """Delete an estimate's sections and items; return their revision states (sections, items)"""
+    owner = EstimateSectionDB.estimate_id == estimate_id
+    section_ids = select(EstimateSectionDB.id).where(owner).scalar_subquery()
+    no_sync = {"synchronize_session": False}
+    # Parents and children go in one statement, so the parent FK holds when
+    # it is checked at the end of it, and RETURNING still sees every parent_id.
+    items = db.execute(
+        delete(EstimateItemDB).where(EstimateItemDB.section_id.in_(section_ids))
+        .returning(*_columns(EstimateItemDB, ("id", *revisions.ITEM_FIELDS))),
+        execution_options=no_sync,
+    ).all()
+    sections = db.execute(
+        delete(EstimateSectionDB).where(owner)
+        .returning(*_columns(EstimateSectionDB, ("id", *revisions.SECTION_FIELDS))),
+        execution_options=no_sync,
+    ).all()
+    return revisions.rows_state(sections, revisions.SECTION_FIELDS), revisions.rows_state(items, revisions.ITEM_FIELDS)
+
+#Row -> Pydantic
+
+def _item_model(row: EstimateItemDB) -> EstimateItem:
+    return EstimateItem(
+        id=str(row.id),
+        parent_id=str(row.parent_id) if row.parent_id else None,
+        **{column: getattr(row, column) for column in _ITEM_COLUMNS},
+    )
+
+def _section_model(row: EstimateSectionDB) -> EstimateSection:
+    return EstimateSection(
+        id=str(row.id),
+        section_code=row.section_code,
+        title=row.title,
+        items=[_item_model(item) for item in row.items],
+        subtotal_material=row.subtotal_material,
+        subtotal_labor=row.subtotal_labor,
+        subtotal_total=row.subtotal_total,
+    )
+
+def _estimate_model(row: EstimateDB) -> Estimate:
+    return Estimate(
+        id=str(row.id),
+        project_name=row.project_name,
+        project_location=row.project_location,
+        client_name=row.client_name,
+        estimate_date=row.estimate_date,
+        prepared_by=row.prepared_by,
+        template_id=str(row.template_id) if row.template_id else None,
+        sections=[_section_model(section) for section in row.sections],
+        total_material=row.total_material,
+        total_labor=row.total_labor,
+        total_amount=row.total_amount,
+        created_at=row.created_at,
+        updated_at=row.updated_at,
+        status=row.status,
+        version=row.version,
+    )
+
+def _template_model(row: EstimateTemplateDB) -> EstimateTemplate:
+    return EstimateTemplate(
+        id=str(row.id),
+        name=row.name,
+        description=row.description or "",
+        project_type=row.project_type,
+        sections=[_section_model(section) for section in row.sections],
+        created_at=row.created_at,
+        updated_at=row.updated_at,
+        is_active=row.is_active,
+    )
+
+def _data_dict(row: EstimateDataDB) -> dict:
+    return {
+        "id": str(row.id),
+        "project_info": row.project_info,
+        "items": [_item_model(item).dict() for item in row.items],
+        "metadata": row.meta,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+_estimate_tree = selectinload(EstimateDB.sections).selectinload(EstimateSectionDB.items)
+_template_tree = selectinload(EstimateTemplateDB.sections).selectinload(EstimateSectionDB.items)
+
+#Row -> JSON documents
+#
+# Read routes hand these dicts straight to ORJSONResponse. They have the
+# shape of Estimate.dict() / EstimateTemplate.dict(), built from Core column
+# rows with no ORM objects or pydantic models in between: stored rows are
+# already valid, and re-validating 100k items costs seconds. Ids come back
+# as text from the database (building uuid.UUID objects per row was most of
+# the remaining cost); Enum and datetime values are left for orjson.
+
+_ITEM_FIELDS = tuple(EstimateItem.model_fields)
+_SECTION_FIELDS = tuple(name for name in EstimateSection.model_fields if name != "items")
+_UUID_FIELDS = ("id", "parent_id", "section_id", "template_id")
+
+def _columns(model, names) -> list:
+    return [uuid_text(getattr(model, name)) if name in _UUID_FIELDS else getattr(model, name) for name in names]
+
+def _tree_document(db: Session, owner) -> list[dict]:
+    conn = db.connection()
+    sections = conn.execute(
+        select(*_columns(EstimateSectionDB, _SECTION_FIELDS)).where(owner).order_by(EstimateSectionDB.position)
+    ).all()
+    documents = []
+    items_of = {}
+    for row in sections:
+        values = dict(zip(_SECTION_FIELDS, row))
+        items_of[values["id"]] = items = []
+        documents.append({name: items if name == "items" else values[name] for name in EstimateSection.model_fields})
+    if not documents:
+        return documents
+    items = conn.execute(
+        select(*_columns(EstimateItemDB, ("section_id", *_ITEM_FIELDS)))
+        .join(EstimateSectionDB, EstimateSectionDB.id == EstimateItemDB.section_id)
+        .where(owner)
+        .order_by(EstimateItemDB.sort_order, EstimateItemDB.position)
+    ).all()
+    for section_id, *values in items:
+        items_of[section_id].append(dict(zip(_ITEM_FIELDS, values)))
+    return documents
+
+def estimate_document(db: Session, estimate_id: str) -> dict:
+    key = _parse_id(estimate_id, "Estimate not found")
+    names = [name for name in Estimate.model_fields if name != "sections"]
+    row = db.connection().execute(select(*_columns(EstimateDB, names)).where(EstimateDB.id == key)).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    document = dict(zip(names, row))
+    document["sections"] = _tree_document(db, EstimateSectionDB.estimate_id == key)
+    return {name: document[name] for name in Estimate.model_fields}
+
+def template_document(db: Session, template_id: str) -> dict:
+    key = _parse_id(template_id, "Template not found")
+    names = [name for name in EstimateTemplate.model_fields if name != "sections"]
+    row = db.connection().execute(select(*_columns(EstimateTemplateDB, names)).where(EstimateTemplateDB.id == key)).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Template not found")
+    document = dict(zip(names, row))
+    document["description"] = document["description"] or ""
+    document["sections"] = _tree_document(db, EstimateSectionDB.template_id == key)
+    return {name: document[name] for name in EstimateTemplate.model_fields}
+
+#Estimates
+
+def _estimate_values(estimate: Estimate) -> dict:
+    return {
+        "project_name": estimate.project_name,
+        "project_location": estimate.project_location,
+        "client_name": estimate.client_name,
+        "estimate_date": estimate.estimate_date,
+        "prepared_by": estimate.prepared_by,
+        "template_id": uuid.UUID(estimate.template_id) if estimate.template_id else None,
+        "total_material": estimate.total_material,
+        "total_labor": estimate.total_labor,
+        "total_amount": estimate.total_amount,
+        "status": estimate.status,
+    }
+
+def create_estimate(db: Session, estimate: Estimate) -> str:
+    estimate_id = uuid.UUID(estimate.id) if estimate.id else uuid.uuid4()
+    stamps = {"created_at": estimate.created_at, "updated_at": estimate.updated_at}
+    row = EstimateDB(id=estimate_id, **_estimate_values(estimate), **{k: v for k, v in stamps.items() if v})
+    db.add(row)
+    db.flush()
+    sections, items = _write_sections(db, estimate.sections, estimate_id=estimate_id)
+    state = revisions.state_of(row, sections, items)
+    revisions.record(db, estimate_id, state=state)
+    analytics.track_states(db, None, state)
+    db.commit()
+    return str(estimate_id)
+
+def get_estimate(db: Session, estimate_id: str) -> Estimate:
+    row = db.execute(
+        select(EstimateDB).options(_estimate_tree).where(EstimateDB.id == _parse_id(estimate_id, "Estimate not found"))
+    ).scalar_one_or_none()
+    if not row:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    return _estimate_model(row)
+
+_SUMMARY_COLUMNS = [getattr(EstimateDB, name) for name in EstimateSummary.model_fields]
+
+def estimate_filters(
+    *,
+    status: Optional[str] = None,
+    client_name: Optional[str] = None,
+    template_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> list:
+    """WHERE conditions on EstimateDB for the listing filters that are set"""
+    conditions = []
+    if status:
+        conditions.append(EstimateDB.status == status)
+    if client_name:
+        conditions.append(EstimateDB.client_name == client_name)
+    if template_id:
+        conditions.append(EstimateDB.template_id == _parse_id(template_id, "Template not found"))
+    if date_from:
+        conditions.append(EstimateDB.estimate_date >= date_from)
+    if date_to:
+        conditions.append(EstimateDB.estimate_date <= date_to)
+    return conditions
+
+def list_estimates(
+    db: Session,
+    *,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    status: Optional[str] = None,
+    client_name: Optional[str] = None,
+    template_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> tuple[list[EstimateSummary], Optional[str]]:
+    # Projection only: never touches estimate_sections or estimate_items.
+    stmt = select(*_SUMMARY_COLUMNS).where(*estimate_filters(
+        status=status, client_name=client_name, template_id=template_id, date_from=date_from, date_to=date_to,
+    ))
+    rows, next_cursor = _page(db, stmt, EstimateDB.updated_at, EstimateDB.id, cursor, limit)
+    summaries = [
+        EstimateSummary(**{
+            **row._asdict(),
+            "id": str(row.id),
+            "template_id": str(row.template_id) if row.template_id else None,
+        })
+        for row in rows
+    ]
+    return summaries, next_cursor
+
+_SPLIT_COSTS = ("material_unit_cost", "labor_unit_cost")
+
+def _release_split_costs(estimate: Estimate, old_items: dict) -> bool:
+    # The client sends back the total unit cost it was shown. Where that was
+    # derived and material or labor cost has since changed, it is stale:
+    # drop it so the rollup derives it again. Returns whether any was dropped.
+    released = False
+    for section in estimate.sections:
+        for item in section.items:
+            old = old_items.get(item.id)
+            if (
+                old is not None
+                and item.total_unit_cost == old["total_unit_cost"]
+                and any(getattr(item, name) != old[name] for name in _SPLIT_COSTS)
+                and rollup.follows_split(old["total_unit_cost"], *(old[name] for name in _SPLIT_COSTS))
+            ):
+                item.total_unit_cost = None
+                released = True
+    return released
+
+def update_estimate(db: Session, estimate_id: str, estimate: Estimate) -> int:
+    row = db.get(EstimateDB, _parse_id(estimate_id, "Estimate not found"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    # The old state comes back from the delete itself; no second full load.
+    before = {"estimate": revisions.fields_of(row, revisions.ESTIMATE_FIELDS)}
+    before["sections"], before["items"] = _take_sections(db, row.id)
+    if _release_split_costs(estimate, before["items"]):
+        rollup.apply(estimate)
+    for key, value in _estimate_values(estimate).items():
+        setattr(row, key, value)
+    row.updated_at = estimate.updated_at
+    sections, items = _write_sections(db, estimate.sections, estimate_id=row.id, keep_ids=True)
+    after = revisions.state_of(row, sections, items)
+    version = revisions.record(db, row.id, revisions.diff(before, after), after)
+    analytics.track_states(db, before, after)
+    db.commit()
+    return version
+
+#Revisions
+
+def list_revisions(db: Session, estimate_id: str, *, before: Optional[int] = None, limit: int = 50) -> list[dict]:
+    return revisions.list_revisions(db, _parse_id(estimate_id, "Estimate not found"), before=before, limit=limit)
+
+def get_revision(db: Session, estimate_id: str, version: int) -> Estimate:
+    return revisions.get_version(db, _parse_id(estimate_id, "Estimate not found"), version)
+
+def diff_revisions(db: Session, estimate_id: str, from_version: int, to_version: Optional[int] = None) -> dict:
+    return revisions.diff_versions(db, _parse_id(estimate_id, "Estimate not found"), from_version, to_version)
+
+#Incremental edits
+#
+# Each edit touches only the rows it changes. Section subtotals and estimate
+# totals move by the change in the edited amounts (new - old) with a single
+# UPDATE ... RETURNING each, instead of re-summing the whole tree.
+# SUBTOTAL rows sum a subtree that one item's delta cannot place, so a
+# section that has any is rolled up again from its stored columns and the
+# SUBTOTAL rows whose figures moved are rewritten (refresh_subtotal_rows).
+
+_AMOUNTS = ("material_amount", "labor_amount", "total_amount")
+# What analytics.counts reads from an item.
+_COST_COLUMNS = ("item_type", "section_code", "unit", *analytics.METRICS)
+# EstimateItem fields that cannot be null; an explicit null in a patch is ignored.
+_REQUIRED_ITEM_FIELDS = ("description", "item_type", "level", "sort_order")
+# What refresh_subtotal_rows loads to roll a section up again.
+_ROLLUP_COLUMNS = ("section_id", *rollup.INPUT_FIELDS)
+_ROLLUP_IDS = ("id", "section_id", "parent_id")
+# In rollup.follows_split's argument order.
+_UNIT_COSTS = ("total_unit_cost", "material_unit_cost", "labor_unit_cost")
+# Item fields that place it in the tree (and so under SUBTOTAL rows).
+_TREE_FIELDS = {"parent_id", "level", "sort_order", "item_type"}
+
+def refresh_subtotal_rows(db: Session, section_ids: Iterable[uuid.UUID]) -> dict[str, dict]:
+    """Re-derive the SUBTOTAL rows of the given sections; return {item id: amounts} for those that changed"""
+    section_ids = {section_id for section_id in section_ids if section_id is not None}
+    if not section_ids:
+        return {}
+    owners = db.execute(
+        select(EstimateItemDB.section_id).distinct()
+        .where(EstimateItemDB.section_id.in_(section_ids), EstimateItemDB.item_type == ItemType.SUBTOTAL)
+    ).scalars().all()
+    if not owners:
+        return {}
+    # Ids as text: the rollup only matches them, so no row needs a UUID.
+    rows = db.connection().execute(
+        select(*(
+            uuid_text(getattr(EstimateItemDB, name)).label(name) if name in _ROLLUP_IDS else getattr(EstimateItemDB, name)
+            for name in _ROLLUP_COLUMNS
+        ))
+        .where(EstimateItemDB.section_id.in_(owners))
+        .order_by(EstimateItemDB.section_id, EstimateItemDB.sort_order, EstimateItemDB.position)
+    ).all()
+    columns = dict(zip(_ROLLUP_COLUMNS, zip(*rows)))
+    index = {str(section_id): i for i, section_id in enumerate(owners)}
+    section = [index[section_id] for section_id in columns["section_id"]]
+    positions, figures = rollup.subtotal_rows(rollup.ItemArrays.from_columns(columns, section, len(owners)))
+    changed = {}
+    for position, amounts in zip(positions.tolist(), figures.tolist()):
+        row = rows[position]
+        if tuple(getattr(row, name) for name in _AMOUNTS) != tuple(amounts):
+            changed[row.id] = dict(zip(_AMOUNTS, amounts))
+    if changed:
+        db.execute(update(EstimateItemDB), [{"id": uuid.UUID(item_id), **amounts} for item_id, amounts in changed.items()])
+    return changed
+
+def _amounts(source) -> tuple[float, float, float]:
+    # What an item contributes to its section: only line items count.
+    if source.item_type not in (None, ItemType.LINE_ITEM):
+        return (0.0, 0.0, 0.0)
+    return tuple(getattr(source, name) or 0.0 for name in _AMOUNTS)
+
+def _derive_amounts(item) -> None:
+    item.material_amount, item.labor_amount, item.total_unit_cost, item.total_amount = rollup.item_amounts(item)
+
+def _minus(a: tuple, b: tuple) -> tuple:
+    return tuple(x - y for x, y in zip(a, b))
+
+def _get_section(db: Session, estimate_id: uuid.UUID, section_id: str) -> EstimateSectionDB:
+    section = db.get(EstimateSectionDB, _parse_id(section_id, "Section not found"))
+    if not section or section.estimate_id != estimate_id:
+        raise HTTPException(status_code=404, detail="Section not found")
+    return section
+
+def _get_item(db: Session, estimate_id: uuid.UUID, item_id: str) -> EstimateItemDB:
+    item = db.get(EstimateItemDB, _parse_id(item_id, "Item not found"))
+    if not item or item.estimate_id != estimate_id:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return item
+
+def _ensure_subtotals(db: Session, section: EstimateSectionDB) -> None:
+    # Sections written before subtotals were maintained have NULLs; give them
+    # a baseline once so later deltas land on a correct value.
+    if None not in (section.subtotal_material, section.subtotal_labor, section.subtotal_total):
+        return
+    sums = db.execute(
+        select(*(func.coalesce(func.sum(getattr(EstimateItemDB, name)), 0.0) for name in _AMOUNTS))
+        .where(EstimateItemDB.section_id == section.id, EstimateItemDB.item_type == ItemType.LINE_ITEM)
+    ).one()
+    section.subtotal_material, section.subtotal_labor, section.subtotal_total = sums
+    db.flush()
+
+def _apply_delta(
+    db: Session, estimate_id: uuid.UUID, section_id: Optional[uuid.UUID], delta: tuple, *, regroup: bool = True,
+) -> dict:
+    material, labor, total = delta
+    result = {}
+    if section_id is not None:
+        section = db.execute(
+            update(EstimateSectionDB)
+            .where(EstimateSectionDB.id == section_id)
+            .values(
+                subtotal_material=func.coalesce(EstimateSectionDB.subtotal_material, 0.0) + material,
+                subtotal_labor=func.coalesce(EstimateSectionDB.subtotal_labor, 0.0) + labor,
+                subtotal_total=func.coalesce(EstimateSectionDB.subtotal_total, 0.0) + total,
+            )
+            .returning(
+                EstimateSectionDB.subtotal_material, EstimateSectionDB.subtotal_labor, EstimateSectionDB.subtotal_total
+            ),
+            execution_options={"synchronize_session": False},
+        ).one()
+        result["section"] = {"id": str(section_id), **section._asdict()}
+        # An edit that moves no amounts and leaves the tree alone cannot
+        # change a SUBTOTAL row.
+        subtotal_items = refresh_subtotal_rows(db, [section_id]) if regroup or any(delta) else {}
+        if subtotal_items:
+            result["subtotal_items"] = subtotal_items
+    estimate = db.execute(
+        update(EstimateDB)
+        .where(EstimateDB.id == estimate_id)
+        .values(
+            total_material=func.coalesce(EstimateDB.total_material, 0.0) + material,
+            total_labor=func.coalesce(EstimateDB.total_labor, 0.0) + labor,
+            total_amount=func.coalesce(EstimateDB.total_amount, 0.0) + total,
+            updated_at=utcnow(),
+        )
+        .returning(EstimateDB.total_material, EstimateDB.total_labor, EstimateDB.total_amount, EstimateDB.updated_at),
+        execution_options={"synchronize_session": False},
+    ).one()
+    result["estimate"] = {"id": str(estimate_id), **estimate._asdict()}
+    return result
+
+def _touch(db: Session, estimate_id: uuid.UUID) -> None:
+    db.execute(
+        update(EstimateDB).where(EstimateDB.id == estimate_id).values(updated_at=utcnow()),
+        execution_options={"synchronize_session": False},
+    )
+
+def _record(db: Session, estimate_id: uuid.UUID, result: Optional[dict] = None, **changes) -> int:
+    # The edit knows which rows it touched, so its revision delta is just
+    # those fields plus the totals _apply_delta returned.
+    deltas = [changes] + ([revisions.totals_delta(result)] if result else [])
+    return revisions.record(db, estimate_id, revisions.merge(*deltas))
+
+def _estimate_key(db: Session, estimate_id: str) -> uuid.UUID:
+    key = _parse_id(estimate_id, "Estimate not found")
+    if db.execute(select(EstimateDB.id).where(EstimateDB.id == key)).first() is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    return key
+
+def _next_position(db: Session, column, owner) -> int:
+    return db.execute(select(func.coalesce(func.max(column), -1) + 1).where(owner)).scalar_one()
+
+def add_item(db: Session, estimate_id: str, section_id: str, item: EstimateItem) -> dict:
+    key = _estimate_key(db, estimate_id)
+    section = _get_section(db, key, section_id)
+    _ensure_subtotals(db, section)
+    _derive_amounts(item)
+    row = _item_rows([item], set(), False, section_id=section.id, estimate_id=key)[0]
+    row["position"] = _next_position(db, EstimateItemDB.position, EstimateItemDB.section_id == section.id)
+    if item.parent_id:
+        parent = _get_item(db, key, item.parent_id)
+        row["parent_id"] = parent.id
+    db.execute(insert(EstimateItemDB), [row])
+    result = _apply_delta(db, key, section.id, _amounts(item))
+    _record(db, key, result, items={str(row["id"]): revisions.fields_of(row, revisions.ITEM_FIELDS)})
+    analytics.track_items(db, key, after=[row])
+    db.commit()
+    return {"id": str(row["id"]), **result}
+
+def _check_parent(db: Session, item: EstimateItemDB, parent: Optional[EstimateItemDB]) -> None:
+    # Walk up from the new parent; reaching the item would close a cycle.
+    seen = set()
+    while parent is not None and parent.id not in seen:
+        if parent.id == item.id:
+            raise HTTPException(status_code=400, detail="An item cannot be moved under itself or its own descendant")
+        seen.add(parent.id)
+        parent = db.get(EstimateItemDB, parent.parent_id) if parent.parent_id else None
+
+def update_item(db: Session, estimate_id: str, item_id: str, patch: EstimateItemPatch) -> dict:
+    key = _estimate_key(db, estimate_id)
+    item = _get_item(db, key, item_id)
+    old = revisions.fields_of(item, revisions.ITEM_FIELDS)
+    changes = {
+        name: value for name, value in patch.dict(exclude_unset=True).items()
+        if value is not None or name not in _REQUIRED_ITEM_FIELDS
+    }
+    regroup = bool(changes.keys() & _TREE_FIELDS) or ItemType.SUBTOTAL in (item.item_type, changes.get("item_type"))
+    if "parent_id" in changes:
+        parent_id = changes.pop("parent_id")
+        parent = _get_item(db, key, parent_id) if parent_id else None
+        _check_parent(db, item, parent)
+        item.parent_id = parent.id if parent else None
+    if item.section_id is not None:
+        _ensure_subtotals(db, db.get(EstimateSectionDB, item.section_id))
+    before = _amounts(item)
+    # A derived total unit cost follows a new material or labor cost.
+    if "total_unit_cost" not in changes and rollup.follows_split(*(getattr(item, name) for name in _UNIT_COSTS)):
+        changes["total_unit_cost"] = None
+    for name, value in changes.items():
+        setattr(item, name, value)
+    _derive_amounts(item)
+    delta = _minus(_amounts(item), before)
+    db.flush()
+    result = _apply_delta(db, key, item.section_id, delta, regroup=regroup)
+    new = revisions.fields_of(item, revisions.ITEM_FIELDS)
+    _record(db, key, result, items={str(item.id): {name: value for name, value in new.items() if old[name] != value}})
+    analytics.track_items(db, key, before=[old], after=[new])
+    db.commit()
+    return {"id": item_id, **result}
+
+def delete_item(db: Session, estimate_id: str, item_id: str) -> dict:
+    key = _estimate_key(db, estimate_id)
+    item = _get_item(db, key, item_id)
+    if item.section_id is not None:
+        _ensure_subtotals(db, db.get(EstimateSectionDB, item.section_id))
+    # Children move up to the deleted item's parent rather than disappearing.
+    children = db.execute(
+        update(EstimateItemDB)
+        .where(EstimateItemDB.parent_id == item.id)
+        .values(parent_id=item.parent_id)
+        .returning(EstimateItemDB.id),
+        execution_options={"synchronize_session": False},
+    ).scalars().all()
+    section_id, delta = item.section_id, _minus((0.0, 0.0, 0.0), _amounts(item))
+    analytics.track_items(db, key, before=[revisions.fields_of(item, revisions.ITEM_FIELDS)])
+    db.execute(delete(EstimateItemDB).where(EstimateItemDB.id == item.id), execution_options={"synchronize_session": False})
+    result = _apply_delta(db, key, section_id, delta)
+    parent_id = str(item.parent_id) if item.parent_id else None
+    _record(db, key, result, items={
+        **{str(child): {"parent_id": parent_id} for child in children},
+        str(item.id): None,
+    })
+    db.commit()
+    return result
+
+def reorder_items(db: Session, estimate_id: str, section_id: str, item_ids: list[str]) -> None:
+    key = _estimate_key(db, estimate_id)
+    section = _get_section(db, key, section_id)
+    current = set(db.execute(select(EstimateItemDB.id).where(EstimateItemDB.section_id == section.id)).scalars())
+    ordered = [_parse_id(item_id, "Item not found") for item_id in item_ids]
+    if set(ordered) != current or len(ordered) != len(current):
+        raise HTTPException(status_code=400, detail="Item ids must list every item in the section exactly once")
+    if ordered:
+        db.execute(update(EstimateItemDB), [
+            {"id": item_key, "sort_order": position, "position": position}
+            for position, item_key in enumerate(ordered)
+        ])
+    _touch(db, key)
+    # Items placed by level hang off whatever now precedes them.
+    subtotal_items = refresh_subtotal_rows(db, [section.id])
+    _record(db, key, items={
+        **{str(item_key): {"sort_order": position, "position": position} for position, item_key in enumerate(ordered)},
+        **subtotal_items,
+    })
+    db.commit()
+
+def add_section(db: Session, estimate_id: str, section: EstimateSection) -> dict:
+    key = _estimate_key(db, estimate_id)
+    section_id = uuid.uuid4()
+    subtotals = rollup.apply_sections([section])
+    section_row = {
+        "id": section_id,
+        "section_code": section.section_code,
+        "title": section.title,
+        "subtotal_material": 0.0,
+        "subtotal_labor": 0.0,
+        "subtotal_total": 0.0,
+        "position": _next_position(db, EstimateSectionDB.position, EstimateSectionDB.estimate_id == key),
+        "estimate_id": key,
+    }
+    db.execute(insert(EstimateSectionDB), [section_row])
+    rows = _item_rows(section.items, {section_id}, False, section_id=section_id, estimate_id=key)
+    if rows:
+        db.execute(insert(EstimateItemDB), _parents_first(rows))
+    result = _apply_delta(db, key, section_id, subtotals)
+    _record(
+        db, key, result,
+        sections={str(section_id): revisions.fields_of(section_row, revisions.SECTION_FIELDS)},
+        items={str(row["id"]): revisions.fields_of(row, revisions.ITEM_FIELDS) for row in rows},
+    )
+    analytics.track_items(db, key, after=rows)
+    db.commit()
+    return {"id": str(section_id), **result}
+
+def update_section(db: Session, estimate_id: str, section_id: str, patch: EstimateSectionPatch) -> None:
+    key = _estimate_key(db, estimate_id)
+    section = _get_section(db, key, section_id)
+    changes = {name: value for name, value in patch.dict(exclude_unset=True).items() if value is not None}
+    for name, value in changes.items():
+        setattr(section, name, value)
+    _touch(db, key)
+    _record(db, key, sections={str(section.id): changes})
+    db.commit()
+
+def delete_section(db: Session, estimate_id: str, section_id: str) -> dict:
+    key = _estimate_key(db, estimate_id)
+    section = _get_section(db, key, section_id)
+    _ensure_subtotals(db, section)
+    delta = (-section.subtotal_material, -section.subtotal_labor, -section.subtotal_total)
+    no_sync = {"synchronize_session": False}
+    db.execute(update(EstimateItemDB).where(EstimateItemDB.section_id == section.id).values(parent_id=None), execution_options=no_sync)
+    items = db.execute(
+        delete(EstimateItemDB)
+        .where(EstimateItemDB.section_id == section.id)
+        .returning(EstimateItemDB.id, *(getattr(EstimateItemDB, name) for name in _COST_COLUMNS)),
+        execution_options=no_sync,
+    ).all()
+    db.execute(delete(EstimateSectionDB).where(EstimateSectionDB.id == section.id), execution_options=no_sync)
+    result = _apply_delta(db, key, None, delta)
+    _record(db, key, result, sections={str(section.id): None}, items={str(item.id): None for item in items})
+    analytics.track_items(db, key, before=items)
+    db.commit()
+    return result
+
+def reorder_sections(db: Session, estimate_id: str, section_ids: list[str]) -> None:
+    key = _estimate_key(db, estimate_id)
+    current = set(db.execute(select(EstimateSectionDB.id).where(EstimateSectionDB.estimate_id == key)).scalars())
+    ordered = [_parse_id(section_id, "Section not found") for section_id in section_ids]
+    if set(ordered) != current or len(ordered) != len(current):
+        raise HTTPException(status_code=400, detail="Section ids must list every section in the estimate exactly once")
+    if ordered:
+        db.execute(update(EstimateSectionDB), [
+            {"id": section_key, "position": position} for position, section_key in enumerate(ordered)
+        ])
+    _touch(db, key)
+    _record(db, key, sections={str(section_key): {"position": position} for position, section_key in enumerate(ordered)})
+    db.commit()
+
+#Templates
+
+def create_template(db: Session, template: EstimateTemplate) -> str:
+    template_id = uuid.UUID(template.id) if template.id else uuid.uuid4()
+    stamps = {"created_at": template.created_at, "updated_at": template.updated_at}
+    db.add(EstimateTemplateDB(
+        id=template_id,
+        name=template.name,
+        description=template.description,
+        project_type=template.project_type,
+        is_active=template.is_active,
+        **{k: v for k, v in stamps.items() if v},
+    ))
+    db.flush()
+    _write_sections(db, template.sections, template_id=template_id)
+    db.commit()
+    return str(template_id)
+
+def get_template(db: Session, template_id: str) -> EstimateTemplate:
+    row = db.execute(
+        select(EstimateTemplateDB).options(_template_tree)
+        .where(EstimateTemplateDB.id == _parse_id(template_id, "Template not found"))
+    ).scalar_one_or_none()
+    if not row:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return _template_model(row)
+
+_TEMPLATE_SUMMARY_COLUMNS = [getattr(EstimateTemplateDB, name) for name in TemplateSummary.model_fields]
+
+def list_templates(
+    db: Session,
+    *,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    project_type: Optional[str] = None,
+    is_active: Optional[bool] = None,
+) -> tuple[list[TemplateSummary], Optional[str]]:
+    stmt = select(*_TEMPLATE_SUMMARY_COLUMNS)
+    if project_type:
+        stmt = stmt.where(EstimateTemplateDB.project_type == project_type)
+    if is_active is not None:
+        stmt = stmt.where(EstimateTemplateDB.is_active == is_active)
+    rows, next_cursor = _page(db, stmt, EstimateTemplateDB.updated_at, EstimateTemplateDB.id, cursor, limit)
+    summaries = [
+        TemplateSummary(**{**row._asdict(), "id": str(row.id), "description": row.description or ""})
+        for row in rows
+    ]
+    return summaries, next_cursor
+
+def update_template(db: Session, template_id: str, template: EstimateTemplate) -> None:
+    row = db.get(EstimateTemplateDB, _parse_id(template_id, "Template not found"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Template not found")
+    row.name = template.name
+    row.description = template.description
+    row.project_type = template.project_type
+    row.is_active = template.is_active
+    row.updated_at = template.updated_at
+    _delete_sections(db, template_id=row.id)
+    _write_sections(db, template.sections, template_id=row.id, keep_ids=True)
+    db.commit()
+
+#Revision states in SQL
+#
+# revisions.state_of as one JSON value built by the database, so a snapshot
+# of rows copied in the database never passes through Python. Enum columns
+# hold member names and are mapped to the values the states carry.
+
+_JSON_BUILDERS = {"sqlite": ("json_object", "json_group_object"), "postgresql": ("json_build_object", "json_object_agg")}
+
+def _state_field(model, name: str, dialect: str):
+    column = getattr(model, name)
+    if name in _UUID_FIELDS:
+        return uuid_text(column)
+    enum = getattr(column.type, "enum_class", None)
+    if enum is not None:
+        return case({member.name: member.value for member in enum}, value=cast(column, String))
+    if dialect == "sqlite" and isinstance(column.type, Float):
+        # SQLite's JSON functions print reals to 15 digits; 17 round-trip
+        # (its printf needs the ! flag to go past 16).
+        return case((column.is_(None), None), else_=func.json(func.printf("%!.17g", column)))
+    return column
+
+def _state_json(db: Session, estimate_id: uuid.UUID):
+    """The stored estimate's revision state, as a JSON expression for an INSERT"""
+    dialect = db.bind.dialect.name
+    if dialect not in _JSON_BUILDERS:
+        raise HTTPException(status_code=501, detail=f"Revision snapshots in SQL are not available on {dialect}")
+    build, group = (getattr(func, name) for name in _JSON_BUILDERS[dialect])
+
+    def rows(model, names):
+        pairs = [part for name in names for part in (literal(name, String), _state_field(model, name, dialect))]
+        aggregate = select(group(uuid_text(model.id), build(*pairs))).where(model.estimate_id == estimate_id).scalar_subquery()
+        # An empty aggregate is '{}' on SQLite and NULL on Postgres.
+        return func.json(aggregate) if dialect == "sqlite" else func.coalesce(aggregate, cast(literal("{}"), JSON))
+
+    estimate = db.execute(
+        select(*(getattr(EstimateDB, name) for name in revisions.ESTIMATE_FIELDS)).where(EstimateDB.id == estimate_id)
+    ).one()
+    header = json.dumps(revisions.fields_of(estimate, revisions.ESTIMATE_FIELDS))
+    return build(
+        literal("estimate", String), func.json(literal(header)) if dialect == "sqlite" else cast(literal(header), JSON),
+        literal("sections", String), rows(EstimateSectionDB, revisions.SECTION_FIELDS),
+        literal("items", String), rows(EstimateItemDB, revisions.ITEM_FIELDS),
+    )
+
+def instantiate_template(db: Session, template_id: str, estimate: Estimate) -> str:
+    """Create an estimate from a template by copying its rows in the database.
+
+    The estimate row takes its totals from the template's (already rolled up)
+    section subtotals; sections and items are copied with one INSERT ... SELECT
+    each under fresh server-side ids, and item parents are remapped with one
+    UPDATE through source_id. The first revision snapshot and the analytics
+    counts are built from the copied rows by the database too, so the
+    statement count is fixed and no row is loaded into Python.
+    """
+    key = _parse_id(template_id, "Template not found")
+    if db.get(EstimateTemplateDB, key) is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    estimate_id = uuid.UUID(estimate.id) if estimate.id else uuid.uuid4()
+    stamps = {"created_at": estimate.created_at, "updated_at": estimate.updated_at}
+    values = _estimate_values(estimate)
+    template_sections = select(EstimateSectionDB.id).where(EstimateSectionDB.template_id == key)
+    for column, subtotal in (
+        ("total_material", EstimateSectionDB.subtotal_material),
+        ("total_labor", EstimateSectionDB.subtotal_labor),
+        ("total_amount", EstimateSectionDB.subtotal_total),
+    ):
+        values[column] = (
+            select(func.coalesce(func.sum(subtotal), 0.0))
+            .where(EstimateSectionDB.template_id == key)
+            .scalar_subquery()
+        )
+    values["template_id"] = key
+    db.add(EstimateDB(id=estimate_id, **values, **{k: v for k, v in stamps.items() if v}))
+    db.flush()
+
+    section_columns = ("section_code", "title", "subtotal_material", "subtotal_labor", "subtotal_total", "position")
+    db.execute(insert(EstimateSectionDB).from_select(
+        ["id", "estimate_id", "source_id", *section_columns],
+        select(
+            random_uuid(), literal(estimate_id, Uuid()), EstimateSectionDB.id,
+            *(getattr(EstimateSectionDB, c) for c in section_columns),
+        ).where(EstimateSectionDB.template_id == key),
+    ))
+
+    copied = aliased(EstimateSectionDB)
+    item_columns = (*_ITEM_COLUMNS, "position")
+    db.execute(insert(EstimateItemDB).from_select(
+        ["id", "estimate_id", "section_id", "source_id", *item_columns],
+        select(
+            random_uuid(), literal(estimate_id, Uuid()), copied.id, EstimateItemDB.id,
+            *(getattr(EstimateItemDB, c) for c in item_columns),
+        ).join(copied, (copied.source_id == EstimateItemDB.section_id) & (copied.estimate_id == estimate_id)),
+    ))
+
+    # New parent = the copy of the original's parent.
+    original = aliased(EstimateItemDB)
+    parent = aliased(EstimateItemDB)
+    db.execute(
+        update(EstimateItemDB)
+        .where(
+            EstimateItemDB.estimate_id == estimate_id,
+            EstimateItemDB.source_id.in_(
+                select(original.id).where(original.section_id.in_(template_sections), original.parent_id.is_not(None))
+            ),
+        )
+        .values(parent_id=(
+            select(parent.id)
+            .join(original, original.parent_id == parent.source_id)
+            .where(original.id == EstimateItemDB.source_id, parent.estimate_id == estimate_id)
+            .scalar_subquery()
+        )),
+        execution_options={"synchronize_session": False},
+    )
+    revisions.record(db, estimate_id, state=_state_json(db, estimate_id))
+    analytics.track_estimate(db, estimate_id)
+    db.commit()
+    return str(estimate_id)
+
+#Imported data
+
+def create_data(db: Session, data: EstimateData) -> str:
+    data_id = uuid.uuid4()
+    db.add(EstimateDataDB(id=data_id, project_info=data.project_info, meta=data.metadata))
+    db.flush()
+    rows = _item_rows(data.items, set(), False, data_id=data_id)
+    if rows:
+        db.execute(insert(EstimateItemDB), _parents_first(rows))
+    db.commit()
+    return str(data_id)
+
+def get_data(db: Session, data_id: str) -> dict:
+    row = db.execute(
+        select(EstimateDataDB).options(selectinload(EstimateDataDB.items))
+        .where(EstimateDataDB.id == _parse_id(data_id, "Data not found"))
+    ).scalar_one_or_none()
+    if not row:
+        raise HTTPException(status_code=404, detail="Data not found")
+    return _data_dict(row)
+
+def get_data_items(db: Session, data_id: str) -> tuple[dict, list[EstimateItem]]:
+    # Column rows, not ORM objects: this feeds the mapping stage, which only
+    # needs the items' values and can see 100k of them.
+    key = _parse_id(data_id, "Data not found")
+    project_info = db.execute(select(EstimateDataDB.project_info).where(EstimateDataDB.id == key)).first()
+    if not project_info:
+        raise HTTPException(status_code=404, detail="Data not found")
+    rows = db.execute(
+        select(EstimateItemDB.id, EstimateItemDB.parent_id, *(getattr(EstimateItemDB, c) for c in _ITEM_COLUMNS))
+        .where(EstimateItemDB.data_id == key)
+        .order_by(EstimateItemDB.sort_order, EstimateItemDB.position)
+    )
+    items = [_item_model(row) for row in rows]
+    return project_info[0] or {}, items
+
+def list_data(db: Session, *, cursor: Optional[str] = None, limit: int = 50) -> tuple[list[dict], Optional[str]]:
+    # Imported data is never edited, so created_at is its version stamp.
+    stmt = select(EstimateDataDB.id, EstimateDataDB.project_info, EstimateDataDB.meta, EstimateDataDB.created_at)
+    rows, next_cursor = _page(db, stmt, EstimateDataDB.created_at, EstimateDataDB.id, cursor, limit)
+    data = [
+        {
+            "id": str(row.id),
+            "project_info": row.project_info,
+            "metadata": row.meta,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in rows
+    ]
+    return data, next_cursor
@@ -0,0 +1,277 @@
+import uuid
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .database import EstimateDB, EstimateItemDB, EstimateRevisionDB, EstimateSectionDB
+from .models import Estimate, EstimateItem, EstimateSection, EstimateSummary
+from .settings import settings
+
+# Estimate version history.
+#
+# Every save bumps estimates.version and records one estimate_revisions row.
+# Most rows are deltas: only the estimate, section and item fields that the
+# save changed, keyed by row id, with None marking a deleted row. Every
+# REVISION_SNAPSHOT_EVERY-th version stores the whole estimate instead, so
+# rebuilding a version reads one snapshot and the deltas after it, never
+# the full history.
+#
+# State is plain JSON:
+#   {"estimate": {field: value},
+#    "sections": {section_id: {field: value}},
+#    "items": {item_id: {field: value}}}
+
+ESTIMATE_FIELDS = tuple(name for name in EstimateSummary.model_fields if name not in ("id", "updated_at"))
+SECTION_FIELDS = ("section_code", "title", "subtotal_material", "subtotal_labor", "subtotal_total", "position")
+ITEM_FIELDS = tuple(name for name in EstimateItem.model_fields if name != "id") + ("section_id", "position")
+_ROWS = ("sections", "items")
+_MISSING = object()
+_JSON_TYPES = {str, int, float, bool}
+
+
+def _plain(value):
+    if value is None or type(value) in _JSON_TYPES:
+        return value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def fields_of(source, names: tuple) -> dict:
+    """JSON-ready values of `names` from an ORM object, result row or row dict"""
+    if isinstance(source, dict):
+        return {name: _plain(source[name]) for name in names}
+    return {name: _plain(getattr(source, name)) for name in names}
+
+
+def _row_id(source) -> str:
+    return _plain(source["id"] if isinstance(source, dict) else source.id)
+
+
+#States and deltas
+
+def state_of(estimate, section_rows: list, item_rows: list) -> dict:
+    return {
+        "estimate": fields_of(estimate, ESTIMATE_FIELDS),
+        "sections": {_row_id(row): fields_of(row, SECTION_FIELDS) for row in section_rows},
+        "items": {_row_id(row): fields_of(row, ITEM_FIELDS) for row in item_rows},
+    }
+
+
+def rows_state(rows, names: tuple) -> dict:
+    """{row id: fields} from result rows of (id, *names)"""
+    return {_plain(row[0]): dict(zip(names, map(_plain, row[1:]))) for row in rows}
+
+
+def load_state(db: Session, estimate_id: uuid.UUID) -> dict:
+    """Current state of a stored estimate, read column-wise"""
+    estimate = db.execute(
+        select(*(getattr(EstimateDB, name) for name in ESTIMATE_FIELDS)).where(EstimateDB.id == estimate_id)
+    ).one()
+    sections = db.execute(
+        select(EstimateSectionDB.id, *(getattr(EstimateSectionDB, name) for name in SECTION_FIELDS))
+        .where(EstimateSectionDB.estimate_id == estimate_id)
+    ).all()
+    items = db.execute(
+        select(EstimateItemDB.id, *(getattr(EstimateItemDB, name) for name in ITEM_FIELDS))
+        .where(EstimateItemDB.estimate_id == estimate_id)
+    ).all()
+    return state_of(estimate, sections, items)
+
+
+def diff(old: dict, new: dict) -> dict:
+    """Delta that turns state `old` into state `new`"""
+    delta = {}
+    estimate = {name: value for name, value in new["estimate"].items() if old["estimate"].get(name, _MISSING) != value}
+    if estimate:
+        delta["estimate"] = estimate
+    for part in _ROWS:
+        before, after = old[part], new[part]
+        changes = {}
+        for key, fields in after.items():
+            prior = before.get(key)
+            if prior is None:
+                changes[key] = fields
+                continue
+            changed = {name: value for name, value in fields.items() if prior.get(name, _MISSING) != value}
+            if changed:
+                changes[key] = changed
+        for key in before.keys() - after.keys():
+            changes[key] = None
+        if changes:
+            delta[part] = changes
+    return delta
+
+
+def apply(state: dict, delta: dict) -> dict:
+    """Apply `delta` to `state` in place and return it"""
+    state["estimate"].update(delta.get("estimate", {}))
+    for part in _ROWS:
+        rows = state[part]
+        for key, fields in delta.get(part, {}).items():
+            if fields is None:
+                rows.pop(key, None)
+            else:
+                rows.setdefault(key, {}).update(fields)
+    return state
+
+
+def merge(*deltas: dict) -> dict:
+    """One delta with the effect of applying `deltas` in order"""
+    merged: dict = {}
+    for delta in deltas:
+        if "estimate" in delta:
+            merged.setdefault("estimate", {}).update(delta["estimate"])
+        for part in _ROWS:
+            for key, fields in delta.get(part, {}).items():
+                rows = merged.setdefault(part, {})
+                if fields is None or rows.get(key, _MISSING) is None:
+                    rows[key] = None if fields is None else dict(fields)
+                else:
+                    rows.setdefault(key, {}).update(fields)
+    return merged
+
+
+def totals_delta(result: dict) -> dict:
+    """Delta for the subtotals, SUBTOTAL rows and estimate totals an incremental edit returned"""
+    estimate = result["estimate"]
+    delta = {"estimate": {name: estimate[name] for name in ("total_material", "total_labor", "total_amount")}}
+    section = result.get("section")
+    if section:
+        delta["sections"] = {
+            section["id"]: {name: section[name] for name in ("subtotal_material", "subtotal_labor", "subtotal_total")}
+        }
+    if result.get("subtotal_items"):
+        delta["items"] = result["subtotal_items"]
+    return delta
+
+
+def to_estimate(estimate_id: str, state: dict, updated_at: Optional[datetime] = None, version: Optional[int] = None) -> Estimate:
+    items: dict = {}
+    ordered = sorted(state["items"].items(), key=lambda entry: (entry[1]["sort_order"] or 0, entry[1]["position"] or 0))
+    for item_id, fields in ordered:
+        values = {name: value for name, value in fields.items() if name not in ("section_id", "position")}
+        items.setdefault(fields["section_id"], []).append(EstimateItem(id=item_id, **values))
+    sections = [
+        EstimateSection(
+            id=section_id,
+            items=items.get(section_id, []),
+            **{name: value for name, value in fields.items() if name != "position"},
+        )
+        for section_id, fields in sorted(state["sections"].items(), key=lambda entry: entry[1]["position"] or 0)
+    ]
+    return Estimate(id=estimate_id, sections=sections, updated_at=updated_at, version=version, **state["estimate"])
+
+
+#Recording
+
+def _snapshot_due(version: int) -> bool:
+    return (version - 1) % max(settings.REVISION_SNAPSHOT_EVERY, 1) == 0
+
+
+def record(db: Session, estimate_id: uuid.UUID, delta: Optional[dict] = None, state: Optional[dict] = None) -> int:
+    """Bump the estimate's version and store this save; returns the new version
+
+    Pass the delta of the save, and the full new state when the caller has it
+    anyway (as a dict, or a SQL expression that builds it); it is loaded from
+    the database only when a snapshot is due.
+    """
+    version = db.execute(
+        update(EstimateDB)
+        .where(EstimateDB.id == estimate_id)
+        # Leave updated_at alone: the save itself decides that.
+        .values(version=EstimateDB.version + 1, updated_at=EstimateDB.updated_at)
+        .returning(EstimateDB.version),
+        execution_options={"synchronize_session": False},
+    ).scalar_one()
+    if delta is None or _snapshot_due(version):
+        kind, data = "snapshot", state if state is not None else load_state(db, estimate_id)
+    else:
+        kind, data = "delta", delta
+    db.execute(insert(EstimateRevisionDB).values(
+        id=uuid.uuid4(), estimate_id=estimate_id, version=version, kind=kind, data=data,
+    ))
+    # What this transaction recorded; live.py broadcasts it once committed.
+    db.info.setdefault("recorded", []).append((estimate_id, version, delta))
+    return version
+
+
+#Reading
+
+def _state_at(db: Session, estimate_id: uuid.UUID, version: int) -> tuple[dict, datetime]:
+    # Nearest snapshot at or before `version`, then the deltas up to it.
+    base = (
+        select(func.max(EstimateRevisionDB.version))
+        .where(
+            EstimateRevisionDB.estimate_id == estimate_id,
+            EstimateRevisionDB.kind == "snapshot",
+            EstimateRevisionDB.version <= version,
+        )
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(EstimateRevisionDB.version, EstimateRevisionDB.data, EstimateRevisionDB.created_at)
+        .where(
+            EstimateRevisionDB.estimate_id == estimate_id,
+            EstimateRevisionDB.version >= base,
+            EstimateRevisionDB.version <= version,
+        )
+        .order_by(EstimateRevisionDB.version)
+    ).all()
+    if not rows or rows[-1].version != version:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    state = rows[0].data
+    for row in rows[1:]:
+        apply(state, row.data)
+    return state, rows[-1].created_at
+
+
+def _current_version(db: Session, estimate_id: uuid.UUID) -> int:
+    version = db.execute(select(EstimateDB.version).where(EstimateDB.id == estimate_id)).scalar_one_or_none()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    return version
+
+
+def changes_since(db: Session, estimate_id: uuid.UUID, version: int) -> Optional[dict]:
+    """Merged delta of the saves after `version`; None when one of them stored only a snapshot"""
+    later = (EstimateRevisionDB.estimate_id == estimate_id, EstimateRevisionDB.version > version)
+    # Check kinds first so a snapshot's whole state is never read here.
+    if db.execute(select(EstimateRevisionDB.id).where(*later, EstimateRevisionDB.kind == "snapshot").limit(1)).first():
+        return None
+    return merge(*db.execute(select(EstimateRevisionDB.data).where(*later).order_by(EstimateRevisionDB.version)).scalars())
+
+
+def list_revisions(db: Session, estimate_id: uuid.UUID, *, before: Optional[int] = None, limit: int = 50) -> list[dict]:
+    """Newest first; page with `before` set to the last version seen"""
+    _current_version(db, estimate_id)
+    stmt = select(EstimateRevisionDB.version, EstimateRevisionDB.kind, EstimateRevisionDB.created_at).where(
+        EstimateRevisionDB.estimate_id == estimate_id
+    )
+    if before is not None:
+        stmt = stmt.where(EstimateRevisionDB.version < before)
+    rows = db.execute(stmt.order_by(EstimateRevisionDB.version.desc()).limit(limit)).all()
+    return [row._asdict() for row in rows]
+
+
+def get_version(db: Session, estimate_id: uuid.UUID, version: int) -> Estimate:
+    _current_version(db, estimate_id)
+    state, created_at = _state_at(db, estimate_id, version)
+    return to_estimate(str(estimate_id), state, created_at, version)
+
+
+def diff_versions(db: Session, estimate_id: uuid.UUID, from_version: int, to_version: Optional[int] = None) -> dict:
+    """Changes between two versions; `to_version` defaults to the latest"""
+    if to_version is None:
+        to_version = _current_version(db, estimate_id)
+    old, _ = _state_at(db, estimate_id, from_version)
+    new, _ = _state_at(db, estimate_id, to_version)
+    return {"from_version": from_version, "to_version": to_version, "changes": diff(old, new)}
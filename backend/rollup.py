@@ -0,0 +1,316 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .models import Estimate, EstimateSection, ItemType
+
+# Estimate rollup engine.
+#
+# An estimate's items are loaded once into flat NumPy columns and every
+# figure is derived with array operations: line amounts from quantity and
+# unit costs, SUBTOTAL rows, per-parent (hierarchical) subtotals, section
+# subtotals and grand totals. Python only loops over items to read them in
+# and write them back; all arithmetic is vectorized.
+#
+# Rules:
+#   - material/labor amount = quantity * unit cost when both are known,
+#     otherwise the supplied amount (lump sums).
+#   - total unit cost defaults to material + labor unit cost, and a stored
+#     one that still equals their sum follows them when they change.
+#   - total amount = quantity * total unit cost when both are known,
+#     otherwise material + labor amount, otherwise the supplied amount.
+#   - Only LINE_ITEM rows count towards subtotals and totals. Headers are
+#     labels; a SUBTOTAL row shows the rollup of its parent's line items
+#     (or of its section when it has no parent).
+#   - Items without a parent_id but with level > 0 hang off the nearest
+#     preceding item of a lower level in the same section.
+#   - A parent_id cycle is cut at its first item (in document order),
+#     which becomes top level.
+
+_TYPE_CODES = {item_type: code for code, item_type in enumerate(ItemType)}
+_LINE = _TYPE_CODES[ItemType.LINE_ITEM]
+_SUBTOTAL = _TYPE_CODES[ItemType.SUBTOTAL]
+# Item fields the rollup reads.
+INPUT_FIELDS = (
+    "id", "parent_id", "level", "item_type", "quantity",
+    "material_unit_cost", "labor_unit_cost", "total_unit_cost",
+    "material_amount", "labor_amount", "total_amount",
+)
+
+
+def _floats(values: Sequence[Optional[float]]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _known(*columns: np.ndarray) -> np.ndarray:
+    mask = ~np.isnan(columns[0])
+    for column in columns[1:]:
+        mask &= ~np.isnan(column)
+    return mask
+
+
+class ItemArrays:
+    """Columnar view of an estimate's items, in document order"""
+
+    def __init__(
+        self,
+        quantity: np.ndarray,
+        material_unit_cost: np.ndarray,
+        labor_unit_cost: np.ndarray,
+        total_unit_cost: np.ndarray,
+        material_amount: np.ndarray,
+        labor_amount: np.ndarray,
+        total_amount: np.ndarray,
+        item_type: np.ndarray,
+        section: np.ndarray,
+        parent: np.ndarray,
+        level: np.ndarray,
+        section_count: int,
+    ):
+        self.quantity = quantity
+        self.material_unit_cost = material_unit_cost
+        self.labor_unit_cost = labor_unit_cost
+        self.total_unit_cost = total_unit_cost
+        self.material_amount = material_amount
+        self.labor_amount = labor_amount
+        self.total_amount = total_amount
+        self.item_type = item_type
+        self.section = section
+        self.parent = parent
+        self.level = level
+        self.section_count = section_count
+
+    def __len__(self) -> int:
+        return len(self.quantity)
+
+    @classmethod
+    def from_sections(cls, sections: Sequence[EstimateSection]) -> "ItemArrays":
+        items = [item for section in sections for item in section.items]
+        section = np.repeat(
+            np.arange(len(sections), dtype=np.int64),
+            [len(s.items) for s in sections],
+        )
+        columns = {name: [getattr(item, name) for item in items] for name in INPUT_FIELDS}
+        return cls.from_columns(columns, section, len(sections))
+
+    @classmethod
+    def from_columns(cls, columns: dict, section: Sequence[int], section_count: int) -> "ItemArrays":
+        """INPUT_FIELDS as value sequences in document order, and each item's section index"""
+        position = {item_id: i for i, item_id in enumerate(columns["id"]) if item_id}
+        parent = np.array([position.get(p, -1) if p else -1 for p in columns["parent_id"]], dtype=np.int64)
+        return cls(
+            quantity=_floats(columns["quantity"]),
+            material_unit_cost=_floats(columns["material_unit_cost"]),
+            labor_unit_cost=_floats(columns["labor_unit_cost"]),
+            total_unit_cost=_floats(columns["total_unit_cost"]),
+            material_amount=_floats(columns["material_amount"]),
+            labor_amount=_floats(columns["labor_amount"]),
+            total_amount=_floats(columns["total_amount"]),
+            item_type=np.array([_TYPE_CODES.get(t, _LINE) for t in columns["item_type"]], dtype=np.int8),
+            section=np.asarray(section, dtype=np.int64),
+            parent=parent,
+            level=np.array([level or 0 for level in columns["level"]], dtype=np.int64),
+            section_count=section_count,
+        )
+
+
+class Rollup:
+    """Derived figures for every item, parent, section and the estimate"""
+
+    def __init__(
+        self,
+        material_amount: np.ndarray,
+        labor_amount: np.ndarray,
+        total_amount: np.ndarray,
+        total_unit_cost: np.ndarray,
+        parent: np.ndarray,
+        subtree: np.ndarray,
+        sections: np.ndarray,
+        totals: np.ndarray,
+    ):
+        self.material_amount = material_amount
+        self.labor_amount = labor_amount
+        self.total_amount = total_amount
+        self.total_unit_cost = total_unit_cost
+        # Resolved parent index per item (-1 for top level)
+        self.parent = parent
+        # (n, 3) material/labor/total of the line items under each item
+        self.subtree = subtree
+        # (sections, 3) and (3,) material/labor/total
+        self.sections = sections
+        self.totals = totals
+
+
+def _resolve_parents(arrays: ItemArrays) -> np.ndarray:
+    parent = arrays.parent.copy()
+    n = len(parent)
+    index = np.arange(n)
+    # Parents must be in the same section and not the item itself.
+    linked = parent >= 0
+    linked[linked] &= (arrays.section[parent[linked]] == arrays.section[linked]) & (parent[linked] != index[linked])
+    parent[~linked] = -1
+    # Level fallback: nearest preceding item of a lower level, per level.
+    orphan = (parent < 0) & (arrays.level > 0)
+    for level in np.unique(arrays.level[orphan]):
+        candidate = np.where(arrays.level < level, index, -1)
+        # Shift by one so an item never picks itself, then carry forward.
+        nearest = np.maximum.accumulate(np.concatenate(([-1], candidate[:-1])))
+        target = orphan & (arrays.level == level)
+        found = nearest[target]
+        same = found >= 0
+        same[same] &= arrays.section[found[same]] == arrays.section[target][same]
+        parent[target] = np.where(same, found, -1)
+    _cut_cycles(parent)
+    return parent
+
+
+def _cut_cycles(parent: np.ndarray) -> None:
+    # Pointer doubling: after pass k, ancestor is 2^k levels up and low is
+    # the smallest index on the way there. Once 2^k > n, an item whose
+    # ancestor is still set is on a cycle or leads into one, and low of its
+    # ancestor (a cycle member) is the cycle's smallest index. That item's
+    # parent link is dropped, one cut per cycle.
+    ancestor = parent.copy()
+    low = np.arange(len(parent))
+    for _ in range(max(len(parent), 1).bit_length()):
+        climbing = np.flatnonzero(ancestor >= 0)
+        if not len(climbing):
+            return
+        up = ancestor[climbing]
+        low[climbing] = np.minimum(low[climbing], low[up])
+        ancestor[climbing] = ancestor[up]
+    stuck = ancestor[ancestor >= 0]
+    parent[np.unique(low[stuck])] = -1
+
+
+def _depths(parent: np.ndarray) -> np.ndarray:
+    # Pointer doubling over an acyclic parent array: each pass adds the depth
+    # of the current ancestor and jumps to its ancestor, so ceil(log2 n)
+    # passes reach every root.
+    depth = (parent >= 0).astype(np.int64)
+    ancestor = parent.copy()
+    for _ in range(max(len(parent), 1).bit_length()):
+        climbing = np.flatnonzero(ancestor >= 0)
+        if not len(climbing):
+            break
+        up = ancestor[climbing]
+        depth[climbing] += depth[up]
+        ancestor[climbing] = ancestor[up]
+    return depth
+
+
+def compute(arrays: ItemArrays) -> Rollup:
+    """Run the whole rollup over an estimate's columns"""
+    q = arrays.quantity
+    material = np.where(_known(q, arrays.material_unit_cost), q * arrays.material_unit_cost, arrays.material_amount)
+    labor = np.where(_known(q, arrays.labor_unit_cost), q * arrays.labor_unit_cost, arrays.labor_amount)
+    split_cost = ~(np.isnan(arrays.material_unit_cost) & np.isnan(arrays.labor_unit_cost))
+    total_unit_cost = np.where(
+        np.isnan(arrays.total_unit_cost) & split_cost,
+        np.nan_to_num(arrays.material_unit_cost) + np.nan_to_num(arrays.labor_unit_cost),
+        arrays.total_unit_cost,
+    )
+    split_amount = ~(np.isnan(material) & np.isnan(labor))
+    total = np.where(
+        _known(q, total_unit_cost),
+        q * total_unit_cost,
+        np.where(split_amount, np.nan_to_num(material) + np.nan_to_num(labor), arrays.total_amount),
+    )
+
+    line = arrays.item_type == _LINE
+    counted = np.where(line[:, None], np.nan_to_num(np.column_stack((material, labor, total))), 0.0)
+
+    parent = _resolve_parents(arrays)
+    depth = _depths(parent)
+    # Subtree sums: fold each depth level into its parents, deepest first.
+    # Items are sorted by depth once, so a level is a slice and a deep chain
+    # costs one small step per level rather than a scan of every item.
+    subtree = counted.copy()
+    by_depth = np.argsort(depth)
+    starts = np.concatenate(([0], np.cumsum(np.bincount(depth)))).tolist()
+    for level in range(len(starts) - 2, 0, -1):
+        at_level = by_depth[starts[level]:starts[level + 1]]
+        np.add.at(subtree, parent[at_level], subtree[at_level])
+
+    sections = np.zeros((arrays.section_count, 3))
+    np.add.at(sections, arrays.section, counted)
+    totals = counted.sum(axis=0)
+
+    # SUBTOTAL rows report their parent's line items, or their section's.
+    subtotal_rows = np.flatnonzero(arrays.item_type == _SUBTOTAL)
+    if len(subtotal_rows):
+        owner = parent[subtotal_rows]
+        figures = np.where(
+            (owner >= 0)[:, None],
+            subtree[np.maximum(owner, 0)],
+            sections[arrays.section[subtotal_rows]],
+        )
+        material[subtotal_rows], labor[subtotal_rows], total[subtotal_rows] = figures.T
+
+    return Rollup(material, labor, total, total_unit_cost, parent, subtree, sections, totals)
+
+
+def subtotal_rows(arrays: ItemArrays) -> tuple[np.ndarray, np.ndarray]:
+    """Indices of the SUBTOTAL rows and their (k, 3) material/labor/total figures"""
+    result = compute(arrays)
+    rows = np.flatnonzero(arrays.item_type == _SUBTOTAL)
+    figures = np.column_stack((result.material_amount, result.labor_amount, result.total_amount))
+    return rows, figures[rows]
+
+
+def _values(column: np.ndarray) -> list:
+    return [None if v != v else v for v in column.tolist()]
+
+
+def apply_sections(sections: Sequence[EstimateSection]) -> tuple[float, float, float]:
+    """Fill in item amounts and section subtotals in place; return the totals"""
+    result = compute(ItemArrays.from_sections(sections))
+    material = _values(result.material_amount)
+    labor = _values(result.labor_amount)
+    total = _values(result.total_amount)
+    unit_cost = _values(result.total_unit_cost)
+    i = 0
+    for section, (sub_material, sub_labor, sub_total) in zip(sections, result.sections.tolist()):
+        for item in section.items:
+            item.material_amount = material[i]
+            item.labor_amount = labor[i]
+            item.total_amount = total[i]
+            item.total_unit_cost = unit_cost[i]
+            i += 1
+        section.subtotal_material = sub_material
+        section.subtotal_labor = sub_labor
+        section.subtotal_total = sub_total
+    return tuple(result.totals.tolist())
+
+
+def apply(estimate: Estimate) -> Estimate:
+    """Roll up an estimate in place: items, sections and totals"""
+    estimate.total_material, estimate.total_labor, estimate.total_amount = apply_sections(estimate.sections)
+    return estimate
+
+
+def follows_split(total_unit_cost: Optional[float], material_unit_cost: Optional[float], labor_unit_cost: Optional[float]) -> bool:
+    """Whether a stored total unit cost was derived (is material + labor), not entered on its own"""
+    if total_unit_cost is None:
+        return True
+    return abs(total_unit_cost - ((material_unit_cost or 0.0) + (labor_unit_cost or 0.0))) < 1e-9
+
+
+def item_amounts(item) -> tuple[Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """Scalar form of the amount rules for a single edited item.
+
+    Returns (material_amount, labor_amount, total_unit_cost, total_amount).
+    """
+    q = item.quantity
+    material = q * item.material_unit_cost if None not in (q, item.material_unit_cost) else item.material_amount
+    labor = q * item.labor_unit_cost if None not in (q, item.labor_unit_cost) else item.labor_amount
+    unit_cost = item.total_unit_cost
+    if unit_cost is None and (item.material_unit_cost is not None or item.labor_unit_cost is not None):
+        unit_cost = (item.material_unit_cost or 0.0) + (item.labor_unit_cost or 0.0)
+    if None not in (q, unit_cost):
+        total = q * unit_cost
+    elif material is not None or labor is not None:
+        total = (material or 0.0) + (labor or 0.0)
+    else:
+        total = item.total_amount
+    return material, labor, unit_cost, total
@@ -0,0 +1,244 @@
+import base64
+import json
+import re
+import uuid
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .settings import settings
+
+# Search over estimate line items, estimates and templates.
+#
+# Postgres: expression GIN indexes (see the search_indexes migration) on a
+# tsvector of the searched columns for word matches, plus pg_trgm on the
+# same text for typo-tolerant matches. A hit's score is ts_rank_cd plus
+# trigram word_similarity.
+#
+# SQLite: one FTS5 table per source (porter stemming), kept in step with
+# triggers and keyed by the source row's rowid. Query words match as
+# prefixes and the score is bm25. There is no typo tolerance here; it is
+# the zero-config dev fallback. VACUUM can renumber rowids, so call
+# rebuild() after one.
+#
+# Each source ranks at most SEARCH_MAX_CANDIDATES matches and pages on
+# (score desc, key) before anything is joined, so a page costs a bounded
+# index scan per source plus `limit` row lookups, however many rows match.
+# A very common term is therefore ranked within its newest matches only.
+
+KINDS = ("estimate", "item", "template")
+
+#Indexes (SQLite)
+
+# FTS table -> (source table, indexed columns, rows to index)
+_FTS = {
+    "estimate_items_fts": ("estimate_items", ("description", "section_code"), "estimate_id IS NOT NULL"),
+    "estimates_fts": ("estimates", ("project_name", "client_name"), None),
+    "estimate_templates_fts": ("estimate_templates", ("name", "description"), None),
+}
+
+
+def _fts_ddl(fts: str, table: str, columns: tuple, where: Optional[str]) -> list[str]:
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    when_new = f" WHEN new.{where}" if where else ""
+    insert_new = f"INSERT INTO {fts}(rowid, {cols}) SELECT new.rowid, {new}"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table}{when_new} BEGIN {insert_new}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN DELETE FROM {fts} WHERE rowid = old.rowid; END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"DELETE FROM {fts} WHERE rowid = old.rowid; {insert_new}{f' WHERE new.{where}' if where else ''}; END",
+    ]
+
+
+def _fill(conn, fts: str) -> None:
+    table, columns, where = _FTS[fts]
+    cols = ", ".join(columns)
+    conn.exec_driver_sql(f"DELETE FROM {fts}")
+    conn.exec_driver_sql(
+        f"INSERT INTO {fts}(rowid, {cols}) SELECT rowid, {cols} FROM {table}" + (f" WHERE {where}" if where else "")
+    )
+
+
+def install(bind: Engine) -> None:
+    """Create the SQLite FTS tables and triggers if missing (no-op elsewhere)"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        for fts, (table, columns, where) in _FTS.items():
+            fresh = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).first() is None
+            for ddl in _fts_ddl(fts, table, columns, where):
+                conn.exec_driver_sql(ddl)
+            if fresh:
+                _fill(conn, fts)
+
+
+def rebuild(bind: Engine) -> None:
+    """Re-index every SQLite FTS table from its source"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        for fts in _FTS:
+            _fill(conn, fts)
+
+
+#Queries
+
+# Ranked candidates per source as (key, score). Postgres expressions must
+# match the indexes created by the search_indexes migration exactly.
+_ITEM_TEXT = "coalesce(i.description, '') || ' ' || coalesce(i.section_code, '')"
+_ESTIMATE_TEXT = "coalesce(e.project_name, '') || ' ' || coalesce(e.client_name, '')"
+_TEMPLATE_TEXT = "coalesce(t.name, '') || ' ' || coalesce(t.description, '')"
+
+
+def _fts_hits(fts: str, weights: str) -> str:
+    # Only the newest :cap matches (highest rowids) are ranked; FTS5 walks
+    # its doclists in rowid order, so this stops after :cap rows.
+    return (
+        f"SELECT rowid AS key, -bm25({fts}, {weights}) AS score FROM {fts} "
+        f"WHERE {fts} MATCH :match ORDER BY rowid DESC LIMIT :cap"
+    )
+
+
+_HITS = {
+    "sqlite": {
+        "item": _fts_hits("estimate_items_fts", "4.0, 1.0"),
+        "estimate": _fts_hits("estimates_fts", "2.0, 1.0"),
+        "template": _fts_hits("estimate_templates_fts", "4.0, 1.0"),
+    },
+    # Postgres ranks the first :cap rows the index yields.
+    "postgresql": {
+        "item": f"SELECT i.id::text AS key, (ts_rank_cd(to_tsvector('english', {_ITEM_TEXT}), q) "
+                f"+ word_similarity(:query, i.description))::float8 AS score "
+                f"FROM estimate_items i, websearch_to_tsquery('english', :query) q "
+                f"WHERE i.estimate_id IS NOT NULL "
+                f"AND (to_tsvector('english', {_ITEM_TEXT}) @@ q OR :query <% i.description) LIMIT :cap",
+        "estimate": f"SELECT e.id::text AS key, (ts_rank_cd(to_tsvector('simple', {_ESTIMATE_TEXT}), q) "
+                    f"+ word_similarity(:query, {_ESTIMATE_TEXT}))::float8 AS score "
+                    f"FROM estimates e, websearch_to_tsquery('simple', :query) q "
+                    f"WHERE to_tsvector('simple', {_ESTIMATE_TEXT}) @@ q OR :query <% ({_ESTIMATE_TEXT}) LIMIT :cap",
+        "template": f"SELECT t.id::text AS key, (ts_rank_cd(to_tsvector('english', {_TEMPLATE_TEXT}), q) "
+                    f"+ word_similarity(:query, t.name))::float8 AS score "
+                    f"FROM estimate_templates t, websearch_to_tsquery('english', :query) q "
+                    f"WHERE to_tsvector('english', {_TEMPLATE_TEXT}) @@ q OR :query <% t.name LIMIT :cap",
+    },
+}
+
+# Rows for one page of keys, joined to their owning estimate and section.
+_JOIN_KEY = {"sqlite": "{alias}.rowid = page.key", "postgresql": "{alias}.id = page.key::uuid"}
+_ROWS = {
+    "item": "SELECT page.key, page.score, i.id, i.description AS text, i.section_code, "
+            "e.id AS estimate_id, e.project_name, s.id AS section_id, s.title AS section_title, "
+            "s.section_code AS section_section_code "
+            "FROM page JOIN estimate_items i ON {join} JOIN estimates e ON e.id = i.estimate_id "
+            "LEFT JOIN estimate_sections s ON s.id = i.section_id",
+    "estimate": "SELECT page.key, page.score, e.id, e.project_name AS text, e.client_name "
+                "FROM page JOIN estimates e ON {join}",
+    "template": "SELECT page.key, page.score, t.id, t.name AS text, t.project_type "
+                "FROM page JOIN estimate_templates t ON {join}",
+}
+_ALIAS = {"item": "i", "estimate": "e", "template": "t"}
+
+
+def _fts_match(query: str) -> Optional[str]:
+    # Each whitespace-separated chunk becomes a prefix phrase, so "03-30"
+    # matches the tokens 03 30 in order. Only word characters reach FTS5.
+    phrases = [" ".join(re.findall(r"\w+", chunk)) for chunk in query.split()]
+    return " ".join(f'"{phrase}"*' for phrase in phrases if phrase) or None
+
+
+def _encode_cursor(score: float, kind: str, key) -> str:
+    raw = json.dumps([score, kind, key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[float, str, object]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, kind, key = json.loads(raw)
+        if kind not in KINDS:
+            raise ValueError(kind)
+        return float(score), kind, key
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(kind: str, cursor: Optional[tuple]) -> str:
+    # Merged order is (score desc, kind, key); translate the cursor into a
+    # filter on this source's own (score, key) order.
+    if cursor is None:
+        return "TRUE"
+    _, cursor_kind, _ = cursor
+    if KINDS.index(kind) < KINDS.index(cursor_kind):
+        return "score < :score"
+    if kind == cursor_kind:
+        return "(score < :score OR (score = :score AND key > :key))"
+    return "score <= :score"
+
+
+def _id(value) -> str:
+    return str(value if isinstance(value, uuid.UUID) else uuid.UUID(value))
+
+
+def _hit(kind: str, row) -> dict:
+    hit = {"kind": kind, "id": _id(row.id), "score": row.score, "text": row.text}
+    if kind == "item":
+        hit.update(
+            section_code=row.section_code,
+            estimate={"id": _id(row.estimate_id), "project_name": row.project_name},
+            section={
+                "id": _id(row.section_id), "title": row.section_title, "section_code": row.section_section_code,
+            } if row.section_id else None,
+        )
+    elif kind == "estimate":
+        hit.update(estimate={"id": hit["id"], "project_name": row.text, "client_name": row.client_name})
+    else:
+        hit.update(project_type=row.project_type)
+    return hit
+
+
+def search(
+    db: Session,
+    query: str,
+    *,
+    kinds: Optional[list[str]] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> tuple[list[dict], Optional[str]]:
+    """Best matches first across the requested kinds; returns (hits, next_cursor)"""
+    dialect = db.bind.dialect.name
+    if dialect not in _HITS:
+        raise HTTPException(status_code=501, detail=f"Search is not available on {dialect}")
+    query = query.strip()
+    params = {
+        "query": query, "match": _fts_match(query), "limit": limit + 1, "cap": max(settings.SEARCH_MAX_CANDIDATES, 1),
+    }
+    if not params["match"]:
+        raise HTTPException(status_code=400, detail="Search query must contain a word")
+    after = _decode_cursor(cursor) if cursor else None
+    if after:
+        params.update(score=after[0], key=after[2])
+
+    candidates = []
+    for kind in KINDS:
+        if kinds and kind not in kinds:
+            continue
+        sql = (
+            f"WITH hits AS ({_HITS[dialect][kind]}), "
+            f"page AS (SELECT key, score FROM hits WHERE {_after(kind, after)} ORDER BY score DESC, key LIMIT :limit) "
+            f"{_ROWS[kind].format(join=_JOIN_KEY[dialect].format(alias=_ALIAS[kind]))} "
+            f"ORDER BY page.score DESC, page.key"
+        )
+        candidates.extend((kind, row) for row in db.execute(text(sql), params))
+
+    candidates.sort(key=lambda entry: (-entry[1].score, KINDS.index(entry[0]), entry[1].key))
+    next_cursor = None
+    if len(candidates) > limit:
+        candidates = candidates[:limit]
+        kind, last = candidates[-1]
+        next_cursor = _encode_cursor(last.score, kind, last.key)
+    return [_hit(kind, row) for kind, row in candidates], next_cursor
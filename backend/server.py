@@ -1,11 +1,91 @@
+import argparse
+
 import uvicorn
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
 
-if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="127.0.0.1",
-        port=8000,
-        reload=True
-    )
+from .database import after_fork
+from .settings import settings
+
+# Server launcher. Run from the repository root:
+#
+#     python -m backend.server            production: gunicorn + uvicorn workers
+#     python -m backend.server --reload   development: one process, reloads on change
+#
+# Production runs WEB_CONCURRENCY uvicorn workers under a gunicorn master.
+# The app is imported once in the master before forking, so workers share
+# its memory copy-on-write and a broken import fails the launch instead of
+# every worker; each worker then drops the inherited connection pools and
+# opens its own. uvloop and httptools are used when installed.
+#
+# SIGTERM drains: workers stop accepting, close live-editing
+# sockets with 1012 so clients reconnect elsewhere, and give in-flight
+# requests SERVER_GRACEFUL_TIMEOUT seconds before cancelling them; the
+# lifespan shutdown then stops the reaper and closes the pools. A worker
+# that has served SERVER_MAX_REQUESTS (plus jitter) drains the same way
+# and is replaced, which bounds slow memory growth.
+#
+# State kept in memory is per worker: /metrics and the profiles describe the
+# worker that answered, and live-editing deltas only reach sockets on the
+# worker that saved (see live.py for the cross-process broker this needs).
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": settings.SERVER_LOOP,
+        "http": settings.SERVER_HTTP,
+        "lifespan": "on",
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_TIMEOUT,
+    }
+
+
+def _post_fork(server, worker) -> None:
+    after_fork()
+
+
+class Application(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
 
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
 
+    def load(self):
+        from .main import app
+        return app
+
+
+def options(workers: int, bind: str) -> dict:
+    return {
+        "bind": bind,
+        "workers": workers,
+        "worker_class": "backend.server.Worker",
+        "preload_app": True,
+        "post_fork": _post_fork,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        # uvicorn cancels what is left after its own timeout; the margin lets
+        # the lifespan shutdown finish before the master kills the worker.
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT + 5,
+        "keepalive": settings.SERVER_KEEPALIVE,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the CEAS API")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.WEB_CONCURRENCY)
+    parser.add_argument("--reload", action="store_true", help="development server: one process, reloads on change")
+    args = parser.parse_args()
+
+    if args.reload:
+        uvicorn.run("backend.main:app", host=args.host, port=args.port, reload=True)
+        return
+    Application(options(args.workers, f"{args.host}:{args.port}")).run()
+
+
+if __name__ == "__main__":
+    main()
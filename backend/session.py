@@ -1,23 +1,26 @@
-rom datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional, Tuple
-import uuid, secrets
+import hashlib, hmac, uuid, secrets
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
+from .cache import TTLCache
 from .settings import settings
-from .database import get_db
+from .database import get_async_db
 from .models import User, RefreshToken
 
 # Tells FastAPI how to read "Authorization: Bearer <access_token>"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/issue")
 
-# passlib context to hash and verify refresh token secrets
-_pwd = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
+# passlib context for refresh token hashes written before the HMAC scheme
+_legacy_pwd = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
 #Pydantic models (responses & claims)
 
 class TokenPair(BaseModel):
@@ -69,17 +72,82 @@ def _decode_access_token(token: str) -> TokenData:
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired access token")
 
+#Auth cache
+# Verified access tokens and user rows, kept in-process so an authenticated
+# request normally costs neither a signature check nor a users query.
+# Tokens are keyed by the raw token string (the jti sits inside the signed
+# payload, so finding it means decoding) and never outlive their exp. Users
+# are keyed by email and dropped on any ORM update/delete of the row and on
+# revoke_all_devices; other workers catch up within AUTH_CACHE_TTL_SECONDS.
+
+_token_cache = TTLCache(settings.AUTH_CACHE_MAX_TOKENS, settings.AUTH_CACHE_TTL_SECONDS)
+_user_cache = TTLCache(settings.AUTH_CACHE_MAX_USERS, settings.AUTH_CACHE_TTL_SECONDS)
+_USER_FIELDS = ("id", "email", "full_name", "ms_oid", "created_at")
+
+def _cached_token_data(token: str) -> TokenData:
+    data = _token_cache.get(token)
+    if data is None:
+        data = _decode_access_token(token)
+        _token_cache.set(token, data, ttl=data.exp - _now().timestamp())
+    return data
+
+def invalidate_user(email: str) -> None:
+    """Forget a user's cached row and verified tokens in this process"""
+    _user_cache.pop(email)
+    _token_cache.discard_where(lambda data: data.sub == email)
+
+def auth_cache_stats() -> dict:
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target: User) -> None:
+    # The old address too, when the email itself changed.
+    for email in {target.email, *inspect(target).attrs.email.history.deleted}:
+        if email:
+            invalidate_user(email)
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_async_db)],
 ) -> User:
-    data = _decode_access_token(token)
-    user = db.query(User).filter(User.email == data.sub).first()
+    data = _cached_token_data(token)
+    # Cache hits get a fresh detached copy, so no request can mutate another's user.
+    fields = _user_cache.get(data.sub)
+    if fields is not None:
+        return User(**fields)
+    user = (await db.execute(select(User).where(User.email == data.sub))).scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    _user_cache.set(user.email, {field: getattr(user, field) for field in _USER_FIELDS})
     return user
 
 #Refresh tokens (opaque, hashed in DB)
+# The secret is 48 random bytes, so key stretching buys nothing: it is stored
+# as a keyed HMAC-SHA256 and checked with a constant-time compare. Rows still
+# holding a sha256_crypt hash are verified the slow way (in the threadpool);
+# every use ends a token's life, so they are replaced by HMAC-hashed tokens
+# as they are rotated.
+#
+# A token is claimed with one UPDATE ... WHERE revoked_at IS NULL RETURNING:
+# the database hands the row to exactly one caller, so two concurrent
+# refreshes of the same token cannot both succeed. A wrong secret rolls the
+# claim back.
+
+_HMAC_PREFIX = "hmac-sha256$"
+# A dedicated key, or one derived from SECRET_KEY so JWT signing and token hashing never share a key.
+_HASH_KEY = (
+    settings.REFRESH_TOKEN_HASH_KEY.encode()
+    or hmac.new(settings.SECRET_KEY.encode(), b"ceas-refresh-token-hash", hashlib.sha256).digest()
+)
+
+def _hash_secret(secret: str) -> str:
+    return _HMAC_PREFIX + hmac.new(_HASH_KEY, secret.encode(), hashlib.sha256).hexdigest()
+
+async def _secret_matches(stored: str, secret: str) -> bool:
+    if stored.startswith(_HMAC_PREFIX):
+        return hmac.compare_digest(stored, _hash_secret(secret))
+    return await run_in_threadpool(_legacy_pwd.verify, secret, stored)
 
 def _split_refresh_token(raw: str) -> Tuple[str, str]:
     if "." not in raw:
@@ -89,73 +157,81 @@ def _split_refresh_token(raw: str) -> Tuple[str, str]:
         raise HTTPException(status_code=401, detail="Malformed refresh token")
     return j, s
 
-def _new_refresh_token(db: Session, user: User, parent: Optional[RefreshToken] = None) -> str:
+async def _find_refresh_token(db: AsyncSession, jti: str) -> Optional[RefreshToken]:
+    return (await db.execute(select(RefreshToken).where(RefreshToken.jti == jti))).scalar_one_or_none()
+
+async def _claim_refresh_token(db: AsyncSession, jti: str, secret: str, *columns):
+    """Revoke a live token and return its row, or None (nothing changed)"""
+    row = (await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.jti == jti, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_now())
+        .returning(RefreshToken.token_hash, *columns),
+        execution_options={"synchronize_session": False},
+    )).first()
+    if row is None or not await _secret_matches(row.token_hash, secret):
+        await db.rollback()
+        return None
+    return row
+
+def _add_refresh_token(db: AsyncSession, user_id: int, parent_jti: Optional[str] = None) -> str:
+    # Pending until the caller commits.
     jti = uuid.uuid4().hex[:32]         # compact 32-char id
     secret = secrets.token_urlsafe(48)  # raw secret (only shown once to the client)
-    hashed = _pwd.hash(secret)          # store only the hash
-    rt = RefreshToken(
+    hashed = _hash_secret(secret)       # store only the hash
+    db.add(RefreshToken(
         jti=jti,
         token_hash=hashed,
-        user_id=user.id,
-        parent_jti=parent.jti if parent else None,
+        user_id=user_id,
+        parent_jti=parent_jti,
         expires_at=_now() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
-    )
-    db.add(rt)
-    db.commit()
+    ))
     # Return the "opaque" token: client stores this exact string.
     return f"{jti}.{secret}"
 
-def issue_session(db: Session, email: str, full_name: str | None = None, ms_oid: str | None = None) -> TokenPair:
-    user = db.query(User).filter(User.email == email).first()
+async def issue_session(db: AsyncSession, email: str, full_name: str | None = None, ms_oid: str | None = None) -> TokenPair:
+    user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
     if not user:
         user = User(email=email, full_name=full_name, ms_oid=ms_oid)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
     access = _create_access_token(user.email)
-    refresh = _new_refresh_token(db, user)
+    refresh = _add_refresh_token(db, user.id)
+    await db.commit()
     return TokenPair(access_token=access, refresh_token=refresh)
 
-def rotate_refresh(db: Session, raw_refresh: str) -> TokenPair:
+_owner_email = select(User.email).where(User.id == RefreshToken.user_id).scalar_subquery()
+
+async def rotate_refresh(db: AsyncSession, raw_refresh: str) -> TokenPair:
     jti, secret = _split_refresh_token(raw_refresh)
-    # Find the DB row for this token id (non-secret lookup)
-    rt = db.query(RefreshToken).filter(RefreshToken.jti == jti).first()
-    if not rt or rt.revoked_at:
+    # One transaction: claim (revoke) the old token, insert its successor.
+    row = await _claim_refresh_token(db, jti, secret, RefreshToken.user_id, RefreshToken.expires_at, _owner_email.label("email"))
+    if row is None:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
     # Normalize Timezones before comparing
-    expires_at = _as_aware(rt.expires_at)
-    if expires_at <= _now():
-        rt.revoked_at = _now()
-        db.commit()
+    if _as_aware(row.expires_at) <= _now():
+        # Keep the revocation: an expired token is dead either way.
+        await db.commit()
         raise HTTPException(status_code=401, detail="Expired refresh token")
-    # Verify provided secret against the bcrypt hash in DB
-    if not _pwd.verify(secret, rt.token_hash):
-        raise HTTPException(status_code=401, detail="Invalid refresh token")
-    # Rotation: mark this token as used, then issue a new one
-    rt.revoked_at = _now()
-    db.commit()
-    user = db.query(User).filter(User.id == rt.user_id).first()
-    if not user:
+    if row.email is None:
+        await db.rollback()
         raise HTTPException(status_code=401, detail="User not found")
-    new_access = _create_access_token(user.email)
-    new_refresh = _new_refresh_token(db, user, parent=rt)
+    new_access = _create_access_token(row.email)
+    new_refresh = _add_refresh_token(db, row.user_id, parent_jti=jti)
+    await db.commit()
     return TokenPair(access_token=new_access, refresh_token=new_refresh)
 
-def revoke_this_device(db: Session, raw_refresh: str) -> None:
+async def revoke_this_device(db: AsyncSession, raw_refresh: str) -> None:
     jti, secret = _split_refresh_token(raw_refresh)
-    rt = db.query(RefreshToken).filter(RefreshToken.jti == jti).first()
-    if not rt or rt.revoked_at:
-        return
-    if not _pwd.verify(secret, rt.token_hash):
-        return
-    rt.revoked_at = _now()
-    db.commit()
-
-def revoke_all_devices(db: Session, user: User) -> None:
-    tokens = db.query(RefreshToken).filter(
-        RefreshToken.user_id == user.id,
-        RefreshToken.revoked_at.is_(None)
-    ).all()
-    for t in tokens:
-        t.revoked_at = _now()
-    db.commit()
+    if await _claim_refresh_token(db, jti, secret) is not None:
+        await db.commit()
+
+async def revoke_all_devices(db: AsyncSession, user: User) -> None:
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user.id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_now()),
+        execution_options={"synchronize_session": False},
+    )
+    await db.commit()
+    invalidate_user(user.email)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+import pytest
+
+# Settings and engines are read when the app is imported, so point them at a
+# throwaway SQLite database and export directory first.
+_TMP = tempfile.mkdtemp(prefix="ceas-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_TMP, "ceas.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["EXPORT_DIR"] = os.path.join(_TMP, "exports")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from backend.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def estimate(client):
+    """A stored estimate: one section with a header over three line items"""
+    payload = {
+        "project_name": "Test project",
+        "project_location": "Site",
+        "client_name": "Client",
+        "estimate_date": "2026-01-01T00:00:00",
+        "prepared_by": "Tester",
+        "sections": [{
+            "section_code": "03-00-00",
+            "title": "Concrete",
+            "items": [
+                {"description": "Footings", "item_type": "sub_header", "sort_order": 0},
+                {"description": "Formwork", "quantity": 10, "unit": "SF", "material_unit_cost": 2.0, "level": 1, "sort_order": 1},
+                {"description": "Rebar", "quantity": 2, "unit": "TON", "material_unit_cost": 900.0, "level": 1, "sort_order": 2},
+                {"description": "Pour", "quantity": 5, "unit": "CY", "labor_unit_cost": 40.0, "level": 1, "sort_order": 3},
+            ],
+        }],
+    }
+    response = client.post("/api/v1/estimates", json=payload)
+    assert response.status_code == 200, response.text
+    return client.get(f"/api/v1/estimates/{response.json()['id']}").json()
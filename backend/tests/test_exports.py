@@ -0,0 +1,43 @@
+def _export(client, estimate):
+    response = client.post(f"/api/v1/estimates/{estimate['id']}/export/excel", json={"estimate_id": estimate["id"]})
+    assert response.status_code == 200, response.text
+    return response.json()["download_url"]
+
+
+def test_unchanged_estimate_is_served_from_the_cache(client, estimate):
+    url = _export(client, estimate)
+    response = client.post(f"/api/v1/estimates/{estimate['id']}/export/excel", json={"estimate_id": estimate["id"]})
+    assert response.json() == {"filename": url.rsplit("/", 1)[1], "download_url": url, "cached": True}
+
+
+def test_etag_revalidates(client, estimate):
+    url = _export(client, estimate)
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.content[:2] == b"PK"
+    etag = full.headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_ranges(client, estimate):
+    url = _export(client, estimate)
+    full = client.get(url)
+    size = len(full.content)
+
+    part = client.get(url, headers={"Range": "bytes=10-19"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 10-19/{size}"
+    assert part.content == full.content[10:20]
+
+    tail = client.get(url, headers={"Range": "bytes=-5"})
+    assert tail.content == full.content[-5:]
+
+    assert client.get(url, headers={"Range": f"bytes={size}-"}).status_code == 416
+    # A Range under a stale If-Range gets the whole, current file.
+    stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert (stale.status_code, stale.content) == (200, full.content)
+
+
+def test_missing_file_is_not_found(client):
+    assert client.get("/api/v1/downloads/estimate_missing.xlsx").status_code == 404
@@ -0,0 +1,40 @@
+import io
+import json
+import uuid
+
+from openpyxl import Workbook
+
+
+def _xlsx(*rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _import(client, content):
+    response = client.post("/api/v1/data/import/file", files={"file": ("takeoff.xlsx", content)})
+    assert response.status_code == 200, response.text
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]
+
+
+def test_numeric_cells_in_text_columns_are_read_as_text(client):
+    progress, done = _import(client, _xlsx(
+        ["ID", "Parent", "Description", "Section Code", "Qty", "Material Unit Cost"],
+        [1, None, "Concrete", 3100, 2, 10.5],
+        [2, 1, 12345, 3100.0, 1.5, 4],
+        [3.5, 1, "Odd id", "03-10", 1, 1],
+    ))
+    assert not [error for batch in progress for error in batch.get("errors", [])]
+    # Stored ids are uuid5 keys of the file's ids, so "1" and "1.0" differ.
+    data_id = uuid.UUID(done["id"])
+    key = {str(uuid.uuid5(data_id, name)): name for name in ("1", "2", "3.5")}
+    items = {key[item["id"]]: item for item in client.get(f"/api/v1/data/{done['id']}").json()["items"]}
+    assert set(items) == {"1", "2", "3.5"}
+    assert key[items["2"]["parent_id"]] == "1"
+    assert items["2"]["description"] == "12345"
+    assert items["1"]["section_code"] == items["2"]["section_code"] == "3100"
+    assert items["2"]["quantity"] == 1.5
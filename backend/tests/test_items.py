@@ -0,0 +1,105 @@
+def _item_url(estimate, item):
+    return f"/api/v1/estimates/{estimate['id']}/items/{item['id']}"
+
+
+def _stored_items(client, estimate):
+    return {item["id"]: item for item in client.get(f"/api/v1/estimates/{estimate['id']}").json()["sections"][0]["items"]}
+
+
+def test_null_required_fields_are_ignored(client, estimate):
+    item = estimate["sections"][0]["items"][1]
+    for field in ("description", "item_type", "level", "sort_order"):
+        response = client.patch(_item_url(estimate, item), json={field: None})
+        assert response.status_code == 200, (field, response.text)
+    stored = _stored_items(client, estimate)[item["id"]]
+    for field in ("description", "item_type", "level", "sort_order"):
+        assert stored[field] == item[field]
+
+
+def test_null_optional_field_is_cleared(client, estimate):
+    item = estimate["sections"][0]["items"][1]
+    response = client.patch(_item_url(estimate, item), json={"quantity": None})
+    assert response.status_code == 200, response.text
+    assert _stored_items(client, estimate)[item["id"]]["quantity"] is None
+
+
+def test_parent_cycles_are_rejected(client, estimate):
+    header, first, second, _ = estimate["sections"][0]["items"]
+    assert client.patch(_item_url(estimate, first), json={"parent_id": header["id"]}).status_code == 200
+    assert client.patch(_item_url(estimate, second), json={"parent_id": first["id"]}).status_code == 200
+
+    for item, parent in ((header, second), (header, first), (first, first)):
+        response = client.patch(_item_url(estimate, item), json={"parent_id": parent["id"]})
+        assert response.status_code == 400, response.text
+
+    stored = _stored_items(client, estimate)
+    assert stored[header["id"]]["parent_id"] is None
+    assert stored[first["id"]]["parent_id"] == header["id"]
+    assert stored[second["id"]]["parent_id"] == first["id"]
+
+
+def test_moving_an_item_out_of_a_subtree_is_allowed(client, estimate):
+    header, first, _, _ = estimate["sections"][0]["items"]
+    assert client.patch(_item_url(estimate, first), json={"parent_id": header["id"]}).status_code == 200
+    assert client.patch(_item_url(estimate, first), json={"parent_id": None}).status_code == 200
+    assert client.patch(_item_url(estimate, header), json={"parent_id": first["id"]}).status_code == 200
+
+
+def _assert_totals_add_up(document):
+    for section in document["sections"]:
+        for item in section["items"]:
+            if item["item_type"] == "line_item":
+                assert item["total_amount"] == (item["material_amount"] or 0.0) + (item["labor_amount"] or 0.0), item
+        assert section["subtotal_total"] == section["subtotal_material"] + section["subtotal_labor"]
+    assert document["total_amount"] == document["total_material"] + document["total_labor"]
+
+
+def test_saving_a_new_unit_cost_moves_the_total(client, estimate):
+    document = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    item = document["sections"][0]["items"][1]
+    assert item["total_unit_cost"] == 2.0
+    item["material_unit_cost"] = 3.0
+    response = client.put(f"/api/v1/estimates/{estimate['id']}", json=document)
+    assert response.status_code == 200, response.text
+
+    saved = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    stored = saved["sections"][0]["items"][1]
+    assert stored["total_unit_cost"] == 3.0
+    assert stored["total_amount"] == stored["material_amount"] == 30.0
+    _assert_totals_add_up(saved)
+
+
+def test_saving_keeps_an_entered_total_unit_cost(client, estimate):
+    document = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    item = document["sections"][0]["items"][1]
+    item["total_unit_cost"] = 5.0
+    assert client.put(f"/api/v1/estimates/{estimate['id']}", json=document).status_code == 200
+    document = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    document["sections"][0]["items"][1]["material_unit_cost"] = 3.0
+    assert client.put(f"/api/v1/estimates/{estimate['id']}", json=document).status_code == 200
+
+    stored = client.get(f"/api/v1/estimates/{estimate['id']}").json()["sections"][0]["items"][1]
+    assert stored["total_unit_cost"] == 5.0
+    assert stored["total_amount"] == 50.0
+
+
+def test_patching_a_unit_cost_moves_the_total(client, estimate):
+    item = estimate["sections"][0]["items"][1]
+    response = client.patch(_item_url(estimate, item), json={"material_unit_cost": 3.0})
+    assert response.status_code == 200, response.text
+
+    saved = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    stored = saved["sections"][0]["items"][1]
+    assert stored["total_unit_cost"] == 3.0
+    assert stored["total_amount"] == stored["material_amount"] == 30.0
+    _assert_totals_add_up(saved)
+
+
+def test_patching_keeps_an_entered_total_unit_cost(client, estimate):
+    item = estimate["sections"][0]["items"][1]
+    assert client.patch(_item_url(estimate, item), json={"total_unit_cost": 5.0}).status_code == 200
+    assert client.patch(_item_url(estimate, item), json={"material_unit_cost": 3.0}).status_code == 200
+
+    stored = _stored_items(client, estimate)[item["id"]]
+    assert stored["total_unit_cost"] == 5.0
+    assert stored["total_amount"] == 50.0
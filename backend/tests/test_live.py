@@ -0,0 +1,56 @@
+import json
+
+
+def _reply(socket, ref):
+    # Deltas of other saves can arrive before the edit's own answer.
+    while True:
+        message = json.loads(socket.receive_text())
+        if message.get("ref") == ref:
+            return message
+
+
+def _edit(socket, ref, base_version, item_id, data):
+    socket.send_text(json.dumps({"ref": ref, "op": "update_item", "base_version": base_version, "item_id": item_id, "data": data}))
+    return _reply(socket, ref)
+
+
+def test_stale_edit_to_the_same_field_conflicts(client, estimate):
+    formwork, rebar = (item["id"] for item in estimate["sections"][0]["items"][1:3])
+    with client.websocket_connect(f"/api/v1/estimates/{estimate['id']}/live") as socket:
+        hello = json.loads(socket.receive_text())
+        assert hello["type"] == "hello"
+        base = hello["version"]
+
+        first = _edit(socket, "a", base, formwork, {"material_unit_cost": 3.0})
+        assert (first["type"], first["version"]) == ("ack", base + 1)
+
+        # Same field of the same row, made against the older version.
+        conflict = _edit(socket, "b", base, formwork, {"material_unit_cost": 4.0})
+        assert (conflict["type"], conflict["status"]) == ("error", 409)
+
+        # Another field of that row, or another row, still goes through.
+        assert _edit(socket, "c", base, formwork, {"description": "Forms"})["type"] == "ack"
+        assert _edit(socket, "d", base, rebar, {"material_unit_cost": 950.0})["type"] == "ack"
+
+    items = client.get(f"/api/v1/estimates/{estimate['id']}").json()["sections"][0]["items"]
+    assert (items[1]["description"], items[1]["material_unit_cost"]) == ("Forms", 3.0)
+    assert items[2]["material_unit_cost"] == 950.0
+
+
+def test_edit_ahead_of_the_estimate_is_refused(client, estimate):
+    formwork = estimate["sections"][0]["items"][1]["id"]
+    with client.websocket_connect(f"/api/v1/estimates/{estimate['id']}/live") as socket:
+        base = json.loads(socket.receive_text())["version"]
+        reply = _edit(socket, "a", base + 5, formwork, {"material_unit_cost": 3.0})
+    assert (reply["type"], reply["status"]) == ("error", 400)
+
+
+def test_saves_reach_subscribers_as_deltas(client, estimate):
+    formwork = estimate["sections"][0]["items"][1]["id"]
+    with client.websocket_connect(f"/api/v1/estimates/{estimate['id']}/live") as socket:
+        base = json.loads(socket.receive_text())["version"]
+        response = client.patch(f"/api/v1/estimates/{estimate['id']}/items/{formwork}", json={"quantity": 20})
+        assert response.status_code == 200, response.text
+        message = json.loads(socket.receive_text())
+    assert (message["type"], message["version"]) == ("delta", base + 1)
+    assert message["delta"]["items"][formwork]["quantity"] == 20
@@ -0,0 +1,84 @@
+import time
+import uuid
+from datetime import timedelta
+
+from backend import recalc
+from backend.database import RecalculationJobDB, SessionLocal, utcnow
+from backend.settings import settings
+
+
+def _auth(client):
+    response = client.post("/auth/issue", json={"email": f"{uuid.uuid4().hex[:12]}@example.com"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _finished(client, headers, status_url):
+    for _ in range(200):
+        job = client.get(status_url, headers=headers).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job still {job['status']}")
+
+
+def _reprice(client, headers, estimate, dry_run):
+    response = client.post("/api/v1/recalculations", headers=headers, json={
+        "estimate_ids": [estimate["id"]],
+        "overrides": [{"description_pattern": "formwork", "material_unit_cost": 3.0}],
+        "dry_run": dry_run,
+    })
+    assert response.status_code == 202, response.text
+    assert response.json()["estimates"] == 1
+    return _finished(client, headers, response.json()["status_url"])
+
+
+def test_dry_run_reports_deltas_and_changes_nothing(client, estimate):
+    job = _reprice(client, _auth(client), estimate, dry_run=True)
+    assert job["status"] == "done", job["error"]
+    assert job["progress"] == {"estimates_done": 1, "estimates_total": 1, "items_changed": 1}
+    assert job["result"]["totals"] == {"total_material": 10.0, "total_labor": 0.0, "total_amount": 10.0}
+    assert client.get(f"/api/v1/estimates/{estimate['id']}").json()["total_amount"] == estimate["total_amount"]
+
+
+def test_job_reprices_and_rolls_up(client, estimate):
+    job = _reprice(client, _auth(client), estimate, dry_run=False)
+    assert job["status"] == "done", job["error"]
+    assert job["finished_at"]
+    document = client.get(f"/api/v1/estimates/{estimate['id']}").json()
+    formwork = document["sections"][0]["items"][1]
+    assert (formwork["material_unit_cost"], formwork["total_amount"]) == (3.0, 30.0)
+    assert document["total_amount"] == estimate["total_amount"] + 10.0
+
+
+def test_jobs_need_a_user(client):
+    assert client.post("/api/v1/recalculations", json={"overrides": []}).status_code == 401
+
+
+def _job(db, status, age):
+    job = RecalculationJobDB(status=status, created_at=utcnow() - age)
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def test_a_job_whose_worker_died_reads_as_failed(client):
+    with SessionLocal() as db:
+        stale = _job(db, "running", timedelta(seconds=settings.RECALC_JOB_TIMEOUT_SECONDS + 60))
+        fresh = _job(db, "queued", timedelta(seconds=1))
+
+        job = recalc.get_job(db, str(stale))
+        assert job["status"] == "failed"
+        assert job["error"] and job["finished_at"]
+        assert recalc.get_job(db, str(fresh))["status"] == "queued"
+
+
+def test_stale_jobs_are_failed_in_bulk(client):
+    with SessionLocal() as db:
+        age = timedelta(seconds=settings.RECALC_JOB_TIMEOUT_SECONDS + 60)
+        stale = [_job(db, status, age) for status in ("queued", "running")]
+        done = _job(db, "done", age)
+
+        assert recalc.fail_stale_jobs(db) >= 2
+        assert {db.get(RecalculationJobDB, job_id).status for job_id in stale} == {"failed"}
+        assert db.get(RecalculationJobDB, done).status == "done"
@@ -0,0 +1,80 @@
+import random
+import time
+
+import numpy as np
+
+from backend import rollup
+from backend.models import Estimate, EstimateItem, EstimateSection
+
+
+def _line(item_id, parent_id=None, cost=1.0):
+    return EstimateItem(id=item_id, description=item_id, parent_id=parent_id, quantity=1, material_unit_cost=cost)
+
+
+def _estimate(*items):
+    return Estimate(
+        project_name="P", project_location="L", client_name="C", estimate_date="2026-01-01T00:00:00",
+        prepared_by="T", sections=[EstimateSection(section_code="01", title="S", items=list(items))],
+    )
+
+
+def _walk_depths(parent):
+    depths = []
+    for i in range(len(parent)):
+        depth, j = 0, parent[i]
+        while j >= 0:
+            depth, j = depth + 1, parent[j]
+        depths.append(depth)
+    return np.array(depths)
+
+
+def test_parent_cycle_is_cut_at_its_first_item():
+    items = [_line("a", "b", 1.0), _line("b", "a", 2.0), _line("c", "b", 4.0)]
+    result = rollup.compute(rollup.ItemArrays.from_sections(_estimate(*items).sections))
+    assert result.parent.tolist() == [-1, 0, 1]
+    assert result.subtree[:, 0].tolist() == [7.0, 6.0, 4.0]
+    assert result.totals[0] == 7.0
+
+
+def test_cycles_leave_an_acyclic_tree():
+    # Random parent arrays: each cut drops one link per cycle, and the depths
+    # afterwards match a plain walk up the tree.
+    rng = random.Random(4)
+    for _ in range(200):
+        n = rng.randint(1, 40)
+        original = np.array([rng.randrange(-1, n) for _ in range(n)], dtype=np.int64)
+        parent = original.copy()
+        rollup._cut_cycles(parent)
+        cut = np.flatnonzero(parent != original)
+        assert (parent[cut] == -1).all()
+        assert (rollup._depths(parent) == _walk_depths(parent)).all()
+
+
+def _chain_columns(n, parent_of):
+    ids = [f"i{i}" for i in range(n)]
+    columns = {name: [None] * n for name in rollup.INPUT_FIELDS}
+    columns["id"] = ids
+    columns["parent_id"] = [ids[p] if p is not None else None for p in map(parent_of, range(n))]
+    columns["quantity"] = [1.0] * n
+    columns["material_unit_cost"] = [1.0] * n
+    return rollup.ItemArrays.from_columns(columns, [0] * n, 1)
+
+
+def test_cycle_in_a_large_estimate_stays_fast():
+    # A single 2-cycle used to cost one pass over every item per item.
+    n = 100_000
+    arrays = _chain_columns(n, lambda i: 1 if i == 0 else 0)
+    began = time.perf_counter()
+    result = rollup.compute(arrays)
+    assert time.perf_counter() - began < 5
+    assert result.parent[:2].tolist() == [-1, 0]
+    assert result.subtree[0, 0] == n
+
+
+def test_deep_chain_stays_fast():
+    n = 100_000
+    arrays = _chain_columns(n, lambda i: i - 1 if i else None)
+    began = time.perf_counter()
+    result = rollup.compute(arrays)
+    assert time.perf_counter() - began < 5
+    assert result.subtree[:, 0].tolist() == list(range(n, 0, -1))
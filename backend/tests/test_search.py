@@ -0,0 +1,51 @@
+import uuid
+
+
+def _estimate(client, name, description):
+    response = client.post("/api/v1/estimates", json={
+        "project_name": name,
+        "project_location": "",
+        "client_name": "",
+        "estimate_date": "2026-01-01T00:00:00",
+        "prepared_by": "",
+        "sections": [{"section_code": "09-00-00", "title": "Finishes", "items": [{"description": description, "quantity": 1}]}],
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_pages_cover_every_hit_once(client):
+    word = f"w{uuid.uuid4().hex[:10]}"
+    for n in range(7):
+        _estimate(client, f"{word} tower {n}", f"{word} paint")
+
+    seen, cursor = [], None
+    while True:
+        params = {"q": word, "limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/v1/search", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page["hits"]) <= 3
+        seen.extend((hit["kind"], hit["id"]) for hit in page["hits"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == len(set(seen)) == 14
+    assert {kind for kind, _ in seen} == {"estimate", "item"}
+    scores = [hit["score"] for hit in client.get("/api/v1/search", params={"q": word, "limit": 100}).json()["hits"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_kind_filter(client):
+    word = f"w{uuid.uuid4().hex[:10]}"
+    _estimate(client, f"{word} school", "drywall")
+    hits = client.get("/api/v1/search", params={"q": word, "kind": "item"}).json()["hits"]
+    assert hits == []
+    hits = client.get("/api/v1/search", params={"q": word, "kind": "estimate"}).json()["hits"]
+    assert [hit["kind"] for hit in hits] == ["estimate"]
+    assert client.get("/api/v1/search", params={"q": word, "kind": "budget"}).status_code == 400
+
+
+def test_query_without_words_is_refused(client):
+    assert client.get("/api/v1/search", params={"q": "!!"}).status_code == 400
@@ -0,0 +1,49 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _issue(client):
+    response = client.post("/auth/issue", json={"email": f"{uuid.uuid4().hex[:12]}@example.com"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_refresh_token_is_single_use(client):
+    first = _issue(client)["refresh_token"]
+    response = client.post("/auth/refresh", json={"refresh_token": first})
+    assert response.status_code == 200, response.text
+    second = response.json()["refresh_token"]
+    assert second != first
+
+    assert client.post("/auth/refresh", json={"refresh_token": first}).status_code == 401
+    assert client.post("/auth/refresh", json={"refresh_token": second}).status_code == 200
+
+
+def test_concurrent_refreshes_of_one_token_issue_one_session(client):
+    token = _issue(client)["refresh_token"]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = list(pool.map(
+            lambda _: client.post("/auth/refresh", json={"refresh_token": token}).status_code,
+            range(16),
+        ))
+    assert codes.count(200) == 1
+    assert codes.count(401) == 15
+
+
+def test_wrong_secret_does_not_burn_the_token(client):
+    token = _issue(client)["refresh_token"]
+    jti = token.split(".", 1)[0]
+    assert client.post("/auth/refresh", json={"refresh_token": f"{jti}.wrong"}).status_code == 401
+    assert client.post("/auth/refresh", json={"refresh_token": token}).status_code == 200
+
+
+def test_logout_all_revokes_every_device(client):
+    pair = _issue(client)
+    headers = {"Authorization": f"Bearer {pair['access_token']}"}
+    me = client.get("/me", headers=headers)
+    assert me.status_code == 200, me.text
+    other = client.post("/auth/issue", json={"email": me.json()["email"]}).json()["refresh_token"]
+
+    assert client.post("/auth/logout-all", headers=headers).status_code == 204
+    for token in (pair["refresh_token"], other):
+        assert client.post("/auth/refresh", json={"refresh_token": token}).status_code == 401
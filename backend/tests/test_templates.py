@@ -0,0 +1,94 @@
+import uuid
+from collections import Counter
+
+from backend import analytics, revisions
+from sqlalchemy import select
+
+from backend.database import EstimateRevisionDB, SessionLocal, UnitCostRollupDB
+
+
+def _template(client):
+    payload = {
+        "name": "Slab on grade",
+        "description": "Template",
+        "project_type": "Commercial",
+        "sections": [
+            {
+                "section_code": "03-30-00",
+                "title": "Cast-in-place",
+                "items": [
+                    {"description": "Slab", "item_type": "sub_header", "sort_order": 0},
+                    {"description": "Mesh", "quantity": 3, "unit": "SF", "material_unit_cost": 0.1, "level": 1, "sort_order": 1},
+                    {"description": "Place", "quantity": 4, "unit": "CY", "labor_unit_cost": 35.5, "level": 1, "sort_order": 2},
+                ],
+            },
+            {
+                "section_code": "09-90-00",
+                "title": "Painting",
+                "items": [{"description": "Primer", "quantity": 7, "unit": "SF", "material_unit_cost": 1.25, "labor_unit_cost": 0.75}],
+            },
+        ],
+    }
+    response = client.post("/api/v1/templates", json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _rollup(db) -> Counter:
+    return Counter({(row.section_code, row.unit, row.month, row.metric, row.bin): row.count for row in db.query(UnitCostRollupDB)})
+
+
+def test_estimate_from_template_copies_rows_and_totals(client):
+    template_id = _template(client)
+    response = client.post(f"/api/v1/estimates/from-template/{template_id}", json={"project_name": "Copy"})
+    assert response.status_code == 200, response.text
+    document = client.get(f"/api/v1/estimates/{response.json()['id']}").json()
+
+    assert document["template_id"] == template_id
+    assert [section["section_code"] for section in document["sections"]] == ["03-30-00", "09-90-00"]
+    slab = document["sections"][0]
+    assert [item["description"] for item in slab["items"]] == ["Slab", "Mesh", "Place"]
+    # Children point at the copied header, not the template's.
+    header = slab["items"][0]["id"]
+    assert {item["parent_id"] for item in slab["items"][1:]} <= {header, None}
+    assert document["total_amount"] == sum(section["subtotal_total"] for section in document["sections"])
+    assert document["total_amount"] == 3 * 0.1 + 4 * 35.5 + 7 * 2.0
+
+
+def test_first_revision_of_a_templated_estimate_is_its_full_state(client):
+    template_id = _template(client)
+    estimate_id = client.post(f"/api/v1/estimates/from-template/{template_id}", json={"project_name": "Copy"}).json()["id"]
+
+    with SessionLocal() as db:
+        stored = db.execute(
+            select(EstimateRevisionDB.kind, EstimateRevisionDB.data)
+            .where(EstimateRevisionDB.estimate_id == uuid.UUID(estimate_id), EstimateRevisionDB.version == 1)
+        ).one()
+        assert stored.kind == "snapshot"
+        stored = stored.data
+        assert stored == revisions.load_state(db, uuid.UUID(estimate_id))
+
+    response = client.get(f"/api/v1/estimates/{estimate_id}/revisions/1")
+    assert response.status_code == 200, response.text
+    assert response.json()["total_amount"] == client.get(f"/api/v1/estimates/{estimate_id}").json()["total_amount"]
+
+
+def test_estimate_from_template_counts_its_line_items(client):
+    template_id = _template(client)
+    with SessionLocal() as db:
+        before = _rollup(db)
+    estimate_id = client.post(f"/api/v1/estimates/from-template/{template_id}", json={"project_name": "Copy"}).json()["id"]
+
+    with SessionLocal() as db:
+        added = _rollup(db)
+        added.subtract(before)
+        state = revisions.load_state(db, uuid.UUID(estimate_id))
+        expected = analytics.counts(state["items"].values(), analytics._month(state["estimate"]["estimate_date"]))
+    assert +added == expected
+    # Mesh and Place count one split cost and the total each, Primer all three.
+    assert sum(expected.values()) == 7
+
+
+def test_unknown_template_is_not_found(client):
+    response = client.post(f"/api/v1/estimates/from-template/{uuid.uuid4()}", json={"project_name": "Copy"})
+    assert response.status_code == 404
@@ -1,7 +1,10 @@
-import React from 'react';
+import React, { useState } from 'react';
 import EstimatesList from '../src/components/EstimatesList';
+import EstimateEditor from '../src/components/EstimateEditor';
 
 const EstimatesPage = ({ onBack }) => {
+    const [editingId, setEditingId] = useState(null);
+
     return (
         <div style={{ padding: '20px' }}>
             {/* Back Button */}
@@ -25,8 +28,12 @@ const EstimatesPage = ({ onBack }) => {
                 </button>
             </div>
 
-            {/* Estimates List Component */}
-            <EstimatesList />
+            {/* Live editor for one estimate, or the list */}
+            {editingId ? (
+                <EstimateEditor estimateId={editingId} onClose={() => setEditingId(null)} />
+            ) : (
+                <EstimatesList onEdit={setEditingId} />
+            )}
         </div>
     );
 };
@@ -0,0 +1,193 @@
+import React, { useState } from 'react';
+import { useLiveEstimate } from '../liveEstimate';
+
+const units = ['SF', 'EA', 'LS', 'LF', 'CY', 'SY', 'TON', 'HR'];
+const numberFields = ['quantity', 'material_unit_cost', 'labor_unit_cost'];
+
+const statusColors = {
+    live: '#28a745',
+    connecting: '#ffc107',
+    reconnecting: '#ffc107',
+    closed: '#dc3545'
+};
+
+const cellStyle = { padding: '6px 8px', borderBottom: '1px solid #e0e0e0', fontSize: '13px' };
+const inputStyle = { width: '100%', padding: '4px 6px', border: '1px solid #ddd', borderRadius: '4px', fontSize: '13px' };
+
+const money = (value) => `$${(value || 0).toLocaleString(undefined, { maximumFractionDigits: 2 })}`;
+
+// Edits one estimate live: every change is sent as a single item or section
+// edit and everyone with the estimate open sees it as soon as it is saved.
+const EstimateEditor = ({ estimateId, onClose }) => {
+    const { estimate, status, error, edit } = useLiveEstimate(estimateId);
+    const [notice, setNotice] = useState(null);
+
+    const send = (op, fields) => {
+        setNotice(null);
+        edit(op, fields).catch((failure) => {
+            setNotice(failure.status === 409
+                ? 'Someone else changed this first. Their version is shown; make your change again if it still applies.'
+                : `Not saved: ${typeof failure.detail === 'string' ? failure.detail : JSON.stringify(failure.detail)}`);
+        });
+    };
+
+    const changeItem = (item, name, raw) => {
+        const value = numberFields.includes(name) ? (raw === '' ? null : parseFloat(raw)) : raw;
+        if (value === item[name] || Number.isNaN(value)) {
+            return;
+        }
+        send('update_item', { item_id: item.id, data: { [name]: value } });
+    };
+
+    const addItem = (section) => {
+        send('add_item', {
+            section_id: section.id,
+            data: { description: 'New item', quantity: 0, unit: 'EA', section_code: section.section_code }
+        });
+    };
+
+    if (!estimate) {
+        return (
+            <div style={{ textAlign: 'center', padding: '40px' }}>
+                <div style={{ fontSize: '24px', marginBottom: '10px' }}>⏳</div>
+                <p>{error || 'Loading estimate...'}</p>
+                <button onClick={onClose} style={{ padding: '8px 16px', borderRadius: '4px', border: '1px solid #ccc', cursor: 'pointer' }}>
+                    Close
+                </button>
+            </div>
+        );
+    }
+
+    return (
+        <div style={{ maxWidth: '1100px', margin: '0 auto' }}>
+            <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '15px' }}>
+                <div>
+                    <h3 style={{ margin: '0 0 4px 0', color: '#333' }}>✏️ {estimate.project_name}</h3>
+                    <span style={{ fontSize: '12px', color: '#666' }}>
+                        {estimate.client_name} · version {estimate.version}
+                    </span>
+                </div>
+                <div style={{ display: 'flex', alignItems: 'center', gap: '12px' }}>
+                    <span style={{ fontSize: '12px', color: statusColors[status] || '#6c757d', fontWeight: 'bold' }}>● {status}</span>
+                    <button
+                        onClick={onClose}
+                        style={{
+                            backgroundColor: '#6c757d',
+                            color: 'white',
+                            border: 'none',
+                            padding: '8px 16px',
+                            borderRadius: '4px',
+                            cursor: 'pointer',
+                            fontSize: '12px'
+                        }}
+                    >
+                        Done
+                    </button>
+                </div>
+            </div>
+
+            {(notice || error) && (
+                <div style={{ backgroundColor: '#fff3cd', color: '#856404', padding: '10px 15px', borderRadius: '6px', marginBottom: '15px', fontSize: '13px' }}>
+                    {notice || error}
+                </div>
+            )}
+
+            {estimate.sections.map((section) => (
+                <div
+                    key={section.id}
+                    style={{ backgroundColor: 'white', borderRadius: '8px', boxShadow: '0 2px 4px rgba(0,0,0,0.1)', padding: '15px', marginBottom: '15px' }}
+                >
+                    <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '10px' }}>
+                        <h4 style={{ margin: 0, color: '#333' }}>{section.section_code} {section.title}</h4>
+                        <strong style={{ color: '#007bff' }}>{money(section.subtotal_total)}</strong>
+                    </div>
+                    <table style={{ width: '100%', borderCollapse: 'collapse' }}>
+                        <thead>
+                            <tr style={{ textAlign: 'left', color: '#666', fontSize: '12px' }}>
+                                <th style={cellStyle}>Description</th>
+                                <th style={cellStyle}>Qty</th>
+                                <th style={cellStyle}>Unit</th>
+                                <th style={cellStyle}>Material / unit</th>
+                                <th style={cellStyle}>Labor / unit</th>
+                                <th style={cellStyle}>Total</th>
+                                <th style={cellStyle}></th>
+                            </tr>
+                        </thead>
+                        <tbody>
+                            {section.items.map((item) => (
+                                <tr key={item.id}>
+                                    <td style={cellStyle}>
+                                        <input
+                                            key={`${item.id}-description-${item.description}`}
+                                            defaultValue={item.description}
+                                            onBlur={(e) => changeItem(item, 'description', e.target.value)}
+                                            style={inputStyle}
+                                        />
+                                    </td>
+                                    <td style={{ ...cellStyle, width: '90px' }}>
+                                        <input
+                                            key={`${item.id}-quantity-${item.quantity}`}
+                                            type="number"
+                                            defaultValue={item.quantity ?? ''}
+                                            onBlur={(e) => changeItem(item, 'quantity', e.target.value)}
+                                            style={inputStyle}
+                                        />
+                                    </td>
+                                    <td style={{ ...cellStyle, width: '80px' }}>
+                                        <select value={item.unit || ''} onChange={(e) => changeItem(item, 'unit', e.target.value)} style={inputStyle}>
+                                            {units.map((unit) => <option key={unit} value={unit}>{unit}</option>)}
+                                        </select>
+                                    </td>
+                                    {['material_unit_cost', 'labor_unit_cost'].map((name) => (
+                                        <td key={name} style={{ ...cellStyle, width: '110px' }}>
+                                            <input
+                                                key={`${item.id}-${name}-${item[name]}`}
+                                                type="number"
+                                                defaultValue={item[name] ?? ''}
+                                                onBlur={(e) => changeItem(item, name, e.target.value)}
+                                                style={inputStyle}
+                                            />
+                                        </td>
+                                    ))}
+                                    <td style={{ ...cellStyle, width: '100px', fontWeight: 'bold' }}>{money(item.total_amount)}</td>
+                                    <td style={{ ...cellStyle, width: '40px' }}>
+                                        <button
+                                            onClick={() => send('delete_item', { item_id: item.id })}
+                                            title="Delete item"
+                                            style={{ border: 'none', background: 'none', cursor: 'pointer', color: '#dc3545' }}
+                                        >
+                                            ✕
+                                        </button>
+                                    </td>
+                                </tr>
+                            ))}
+                        </tbody>
+                    </table>
+                    <button
+                        onClick={() => addItem(section)}
+                        style={{ marginTop: '10px', border: '1px dashed #007bff', background: 'none', color: '#007bff', padding: '6px 12px', borderRadius: '4px', cursor: 'pointer', fontSize: '12px' }}
+                    >
+                        ➕ Add item
+                    </button>
+                </div>
+            ))}
+
+            <div style={{ display: 'grid', gridTemplateColumns: 'repeat(3, 1fr)', gap: '20px', backgroundColor: '#f8f9fa', padding: '15px', borderRadius: '6px' }}>
+                <div style={{ textAlign: 'center' }}>
+                    <div style={{ fontSize: '12px', color: '#666', marginBottom: '5px' }}>MATERIAL</div>
+                    <div style={{ fontSize: '18px', fontWeight: 'bold', color: '#333' }}>{money(estimate.total_material)}</div>
+                </div>
+                <div style={{ textAlign: 'center' }}>
+                    <div style={{ fontSize: '12px', color: '#666', marginBottom: '5px' }}>LABOR</div>
+                    <div style={{ fontSize: '18px', fontWeight: 'bold', color: '#333' }}>{money(estimate.total_labor)}</div>
+                </div>
+                <div style={{ textAlign: 'center' }}>
+                    <div style={{ fontSize: '12px', color: '#666', marginBottom: '5px' }}>TOTAL</div>
+                    <div style={{ fontSize: '20px', fontWeight: 'bold', color: '#007bff' }}>{money(estimate.total_amount)}</div>
+                </div>
+            </div>
+        </div>
+    );
+};
+
+export default EstimateEditor;
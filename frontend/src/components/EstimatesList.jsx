@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 
-const EstimatesList = () => {
+const EstimatesList = ({ onEdit }) => {
     const [estimates, setEstimates] = useState([]);
     const [loading, setLoading] = useState(false);
 
@@ -95,7 +95,11 @@ const EstimatesList = () => {
     };
 
     const editEstimate = (estimateId) => {
-        // Mock edit functionality
+        // Opens the live editor; without one, fall back to the prototype notice
+        if (onEdit) {
+            onEdit(estimateId);
+            return;
+        }
         alert(`Editing estimate ${estimateId}... (This is a prototype)`);
     };
 
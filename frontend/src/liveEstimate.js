@@ -0,0 +1,163 @@
+import { useCallback, useEffect, useRef, useState } from 'react';
+
+const API_URL = 'http://localhost:8000';
+const WS_URL = API_URL.replace(/^http/, 'ws');
+
+// Applies one revision delta ({estimate, sections, items}, rows keyed by id,
+// null for a deleted row) to an estimate document and returns a new one.
+export const applyDelta = (estimate, delta) => {
+    const sections = new Map(estimate.sections.map((section, index) => [
+        section.id,
+        { position: index, ...section, items: section.items.map((item, itemIndex) => ({ position: itemIndex, ...item })) }
+    ]));
+    for (const [id, fields] of Object.entries(delta.sections || {})) {
+        if (fields === null) {
+            sections.delete(id);
+        } else {
+            sections.set(id, { id, items: [], ...sections.get(id), ...fields });
+        }
+    }
+    const items = new Map();
+    for (const section of sections.values()) {
+        for (const item of section.items) {
+            items.set(item.id, { section_id: section.id, ...item });
+        }
+    }
+    for (const [id, fields] of Object.entries(delta.items || {})) {
+        if (fields === null) {
+            items.delete(id);
+        } else {
+            items.set(id, { id, ...items.get(id), ...fields });
+        }
+    }
+    for (const section of sections.values()) {
+        section.items = [];
+    }
+    for (const item of items.values()) {
+        sections.get(item.section_id)?.items.push(item);
+    }
+    const byPosition = (a, b) => (a.position ?? 0) - (b.position ?? 0);
+    const ordered = [...sections.values()].sort(byPosition);
+    for (const section of ordered) {
+        section.items.sort((a, b) => (a.sort_order ?? 0) - (b.sort_order ?? 0) || byPosition(a, b));
+    }
+    return { ...estimate, ...(delta.estimate || {}), sections: ordered };
+};
+
+// Keeps one estimate in sync over its live socket and sends edits through it.
+//
+// Deltas are applied in version order; when one goes missing (or the server
+// says reload, or the socket drops) the document is fetched again. edit()
+// resolves with the ack's result, or rejects with {status, detail}; a 409
+// means someone else changed the same field first.
+export const useLiveEstimate = (estimateId) => {
+    const [estimate, setEstimate] = useState(null);
+    const [status, setStatus] = useState('connecting');
+    const [error, setError] = useState(null);
+    const socket = useRef(null);
+    const version = useRef(0);
+    const pending = useRef(new Map());
+    const early = useRef(new Map());
+    const loading = useRef(false);
+    const nextRef = useRef(0);
+
+    const load = useCallback(async () => {
+        if (loading.current) {
+            return;
+        }
+        loading.current = true;
+        try {
+            const response = await fetch(`${API_URL}/api/v1/estimates/${estimateId}`);
+            if (!response.ok) {
+                throw new Error(`Could not load estimate (${response.status})`);
+            }
+            let loaded = await response.json();
+            // Deltas that arrived while the document was loading.
+            for (let next = loaded.version + 1; early.current.has(next); next += 1) {
+                loaded = { ...applyDelta(loaded, early.current.get(next)), version: next };
+            }
+            early.current.clear();
+            version.current = loaded.version;
+            setEstimate(loaded);
+            setError(null);
+        } finally {
+            loading.current = false;
+        }
+    }, [estimateId]);
+
+    useEffect(() => {
+        let closed = false;
+        let retry = null;
+
+        const connect = () => {
+            setStatus('connecting');
+            const ws = new WebSocket(`${WS_URL}/api/v1/estimates/${estimateId}/live`);
+            socket.current = ws;
+            ws.onopen = () => setStatus('live');
+            ws.onmessage = (event) => {
+                const message = JSON.parse(event.data);
+                if (message.type === 'hello') {
+                    load().catch((loadError) => setError(loadError.message));
+                } else if (message.type === 'delta') {
+                    if (message.version <= version.current) {
+                        return;
+                    }
+                    if (loading.current || message.version !== version.current + 1) {
+                        early.current.set(message.version, message.delta);
+                        load().catch((loadError) => setError(loadError.message));
+                        return;
+                    }
+                    version.current = message.version;
+                    setEstimate((current) => current && { ...applyDelta(current, message.delta), version: message.version });
+                } else if (message.type === 'reload') {
+                    load().catch((loadError) => setError(loadError.message));
+                } else if (message.type === 'ack' || message.type === 'error') {
+                    const waiting = pending.current.get(message.ref);
+                    pending.current.delete(message.ref);
+                    if (waiting && message.type === 'ack') {
+                        waiting.resolve(message.result);
+                    } else if (waiting) {
+                        waiting.reject({ status: message.status, detail: message.detail });
+                    }
+                }
+            };
+            ws.onclose = (event) => {
+                for (const waiting of pending.current.values()) {
+                    waiting.reject({ status: 0, detail: 'Connection lost' });
+                }
+                pending.current.clear();
+                if (closed) {
+                    return;
+                }
+                if (event.code === 4404) {
+                    setStatus('closed');
+                    setError('Estimate not found');
+                    return;
+                }
+                setStatus('reconnecting');
+                retry = setTimeout(connect, 1000);
+            };
+        };
+
+        connect();
+        return () => {
+            closed = true;
+            clearTimeout(retry);
+            socket.current?.close();
+        };
+    }, [estimateId, load]);
+
+    const edit = useCallback((op, fields = {}) => new Promise((resolve, reject) => {
+        const ws = socket.current;
+        if (!ws || ws.readyState !== WebSocket.OPEN) {
+            reject({ status: 0, detail: 'Not connected' });
+            return;
+        }
+        nextRef.current += 1;
+        const ref = String(nextRef.current);
+        pending.current.set(ref, { resolve, reject });
+        ws.send(JSON.stringify({ ref, op, base_version: version.current, ...fields }));
+    }), []);
+
+    return { estimate, status, error, edit };
+};